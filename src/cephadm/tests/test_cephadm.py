@@ -1581,6 +1581,108 @@ class TestCephVolume(object):
             assert ctx.keyring == 'bar'
 
 
+class TestGather(object):
+
+    @mock.patch('cephadm.logger')
+    def test_gather(self, _logger, cephadm_fs, capsys):
+        fsid = '00000000-0000-0000-0000-0000deadbeef'
+        cmd = ['--image', 'quay.io/ceph/ceph:v17', 'gather', '--fsid', fsid,
+               '--probe', 'ls', '--probe', 'networks', '--probe', 'devices']
+        nets = {'10.0.0.0/24': {'eth0': {'10.0.0.2', '10.0.0.1'}}}
+        with with_cephadm_ctx(cmd, list_networks=nets) as ctx, \
+                mock.patch('cephadm.list_daemons', return_value=[{'name': 'mon.a'}]), \
+                mock.patch('cephadm.call', side_effect=[
+                    ('', 'unrecognized arguments: --filter-for-batch', 2),
+                    ('[{"path": "/dev/sdb"}]', '', 0),
+                ]) as _call:
+            cd.command_gather(ctx)
+        out = json.loads(capsys.readouterr().out)
+        assert sorted(out) == ['devices', 'ls', 'networks']
+        assert out['ls']['data'] == [{'name': 'mon.a'}]
+        assert out['networks']['data'] == {'10.0.0.0/24': {'eth0': ['10.0.0.1', '10.0.0.2']}}
+        assert out['devices']['data'] == [{'path': '/dev/sdb'}]
+        assert '--filter-for-batch' not in _call.call_args[0][1]
+        for r in out.values():
+            assert r['started'] <= r['finished']
+
+        # a failed probe doesn't fail the others
+        with with_cephadm_ctx(['gather', '--probe', 'ls', '--probe', 'devices']) as ctx, \
+                mock.patch('cephadm.list_daemons', return_value=[]):
+            cd.command_gather(ctx)
+        out = json.loads(capsys.readouterr().out)
+        assert out['ls'] == {'started': mock.ANY, 'finished': mock.ANY, 'data': []}
+        assert out['devices']['error'] == 'must pass --fsid to specify cluster'
+
+        # the image gather_devices picks stays with the probe
+        with with_cephadm_ctx(['gather', '--fsid', fsid, '--probe', 'devices']) as ctx, \
+                mock.patch.dict(os.environ, {'CEPHADM_IMAGE': 'quay.io/ceph/ceph:v18'}), \
+                mock.patch('cephadm.call', return_value=('[]', '', 0)):
+            cd.command_gather(ctx)
+            assert not ctx.image
+        assert json.loads(capsys.readouterr().out)['devices']['data'] == []
+
+
+class TestListDaemons(object):
+
+    @mock.patch('cephadm.logger')
+    def test_list_daemons(self, _logger, cephadm_fs):
+        fsid = '00000000-0000-0000-0000-0000deadbeef'
+        for name in ['mon.a', 'mgr.x', 'osd.1', 'crash.host1']:
+            cephadm_fs.create_dir(os.path.join(cd.DATA_DIR, fsid, name))
+
+        calls = []
+
+        def _call(ctx, cmd, **kwargs):
+            calls.append(cmd)
+            if cmd[:2] == ['systemctl', 'show']:
+                return '\n\n'.join(
+                    'Id=%s.service\nUnitFileState=enabled\nActiveState=active' % u
+                    for u in cmd[4:]), '', 0
+            if cmd[1] == 'ps':
+                # mon.a has an old-style container name, osd.1 has none
+                return '\n'.join([f'ceph-{fsid}-mon.a', f'ceph-{fsid}-mgr-x',
+                                   f'ceph-{fsid}-crash-host1', 'other']), '', 0
+            if cmd[1] == 'inspect':
+                return '\n'.join(
+                    f'{n},{n}-id,quay.io/ceph/ceph:v17,sha256:1234,2022-01-01 00:00:00 +0000 UTC,'
+                    for n in cmd[4:]), '', 0
+            if cmd[1:3] == ['image', 'inspect']:
+                return 'sha256:1234,[quay.io/ceph/ceph@sha256:abcd]', '', 0
+            if cmd[1] == 'exec':
+                return 'ceph version 17.2.0 (xyz) quincy (stable)', '', 0
+            return '', '', 0
+
+        with with_cephadm_ctx([]) as ctx, \
+                mock.patch('cephadm.call', side_effect=_call):
+            ls = {d['name']: d for d in cd.list_daemons(ctx)}
+            n_calls = len(calls)
+            assert ls['mon.a']['container_id'] == f'ceph-{fsid}-mon.a-id'
+            assert ls['mgr.x']['container_image_digests'] == ['quay.io/ceph/ceph@sha256:abcd']
+            assert ls['osd.1']['container_id'] is None
+            assert all(d['state'] == 'running' and d['enabled'] for d in ls.values())
+            assert all(ls[n]['version'] == '17.2.0' for n in ['mon.a', 'mgr.x', 'crash.host1'])
+            # systemctl, 2x stats, ps, inspect, image inspect, one exec per image
+            assert n_calls == 7
+
+            # versions are remembered across runs
+            calls.clear()
+            assert os.path.exists(os.path.join(cd.DATA_DIR, cd.IMAGE_VERSIONS_FILE))
+            ls = {d['name']: d for d in cd.list_daemons(ctx)}
+            assert ls['mon.a']['version'] == '17.2.0'
+            assert not [c for c in calls if c[1] == 'exec']
+            assert len(calls) == n_calls - 1
+
+            # versions of images no longer in use are dropped
+            path = os.path.join(cd.DATA_DIR, cd.IMAGE_VERSIONS_FILE)
+            with open(path, 'w') as f:
+                json.dump({'1234': '17.2.0', '5678': '16.2.0', 'nfs:5678': '3.5'}, f)
+            cd.list_daemons(ctx)
+            with open(path) as f:
+                assert json.load(f) == {'1234': '17.2.0'}
+            assert [n for n in os.listdir(cd.DATA_DIR)
+                    if n.startswith(cd.IMAGE_VERSIONS_FILE)] == [cd.IMAGE_VERSIONS_FILE]
+
+
 class TestIscsi:
     def test_unit_run(self, cephadm_fs):
         fsid = '9b9d7609-f4d5-4aba-94c8-effa764d96c9'
@@ -13,11 +13,14 @@
 
 #include "PyFormatter.h"
 
+#include "common/ceph_time.h"
 #include "common/debug.h"
+#include "common/perf_counters.h"
 #include "mon/MonCommand.h"
 
 #include "ActivePyModule.h"
 #include "MgrSession.h"
+#include "mgr_perf_counters.h"
 
 
 #define dout_context g_ceph_context
@@ -63,12 +66,14 @@ void ActivePyModule::notify(const std::string &notify_type, const std::string &n
 
   ceph_assert(pClassInstance != nullptr);
 
+  auto start = ceph::mono_clock::now();
   Gil gil(py_module->pMyThreadState, true);
 
   // Execute
   auto pValue = PyObject_CallMethod(pClassInstance,
-       const_cast<char*>("notify"), const_cast<char*>("(ss)"),
+       const_cast<char*>("_dispatch_notify"), const_cast<char*>("(ss)"),
        notify_type.c_str(), notify_id.c_str());
+  perfcounter->tinc(l_mgr_module_notify_lat, ceph::mono_clock::now() - start);
 
   if (pValue != NULL) {
     Py_DECREF(pValue);
@@ -91,6 +96,7 @@ void ActivePyModule::notify_clog(const LogEntry &log_entry)
 
   ceph_assert(pClassInstance != nullptr);
 
+  auto start = ceph::mono_clock::now();
   Gil gil(py_module->pMyThreadState, true);
 
   // Construct python-ized LogEntry
@@ -100,8 +106,9 @@ void ActivePyModule::notify_clog(const LogEntry &log_entry)
 
   // Execute
   auto pValue = PyObject_CallMethod(pClassInstance,
-       const_cast<char*>("notify"), const_cast<char*>("(sN)"),
+       const_cast<char*>("_dispatch_notify"), const_cast<char*>("(sN)"),
        "clog", py_log_entry);
+  perfcounter->tinc(l_mgr_module_notify_lat, ceph::mono_clock::now() - start);
 
   if (pValue != NULL) {
     Py_DECREF(pValue);
@@ -207,6 +214,7 @@ int ActivePyModule::handle_command(
     return -EINVAL;
   }
 
+  auto start = ceph::mono_clock::now();
   Gil gil(py_module->pMyThreadState, true);
 
   PyFormatter f;
@@ -223,6 +231,8 @@ int ActivePyModule::handle_command(
       const_cast<char*>("_handle_command"), const_cast<char*>("s#O"),
       instr.c_str(), instr.length(), py_cmd);
 
+  perfcounter->tinc(l_mgr_module_command_lat, ceph::mono_clock::now() - start);
+
   m_command_perms.clear();
   m_session = nullptr;
   Py_DECREF(py_cmd);
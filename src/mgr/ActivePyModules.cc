@@ -483,6 +483,27 @@ PyObject *ActivePyModules::get_python(const std::string &what)
       }
     }
     f.close_section();
+  } else if (what == "map_versions") {
+    without_gil_t no_gil;
+    const epoch_t osd_map = cluster_state.with_osdmap(
+      [](const OSDMap &osdmap) { return osdmap.get_epoch(); });
+    const version_t pg_map = cluster_state.with_pgmap(
+      [](const PGMap &pgmap) { return pgmap.get_version(); });
+    const epoch_t fs_map = cluster_state.with_fsmap(
+      [](const FSMap &fsmap) { return fsmap.get_epoch(); });
+    const epoch_t mon_map = cluster_state.with_monmap(
+      [](const MonMap &monmap) { return monmap.get_epoch(); });
+    const epoch_t mgr_map = cluster_state.with_mgrmap(
+      [](const MgrMap &mgrmap) { return mgrmap.get_epoch(); });
+    const epoch_t service_map = cluster_state.with_servicemap(
+      [](const ServiceMap &servicemap) { return servicemap.epoch; });
+    no_gil.acquire_gil();
+    f.dump_unsigned("osd_map", osd_map);
+    f.dump_unsigned("pg_map", pg_map);
+    f.dump_unsigned("fs_map", fs_map);
+    f.dump_unsigned("mon_map", mon_map);
+    f.dump_unsigned("mgr_map", mgr_map);
+    f.dump_unsigned("service_map", service_map);
   } else if (what == "have_local_config_map") {
     f.dump_bool("have_local_config_map", have_local_config_map);
   } else if (what == "active_clean_pgs"){
@@ -735,45 +756,91 @@ PyObject *ActivePyModules::get_store_prefix(const std::string &module_name,
 void ActivePyModules::set_store(const std::string &module_name,
     const std::string &key, const std::optional<std::string>& val)
 {
-  const std::string global_key = PyModule::mgr_store_prefix
-                                   + module_name + "/" + key;
+  set_store_batch(module_name, {{key, val}});
+}
 
-  Command set_cmd;
+uint64_t ActivePyModules::set_store_batch(const std::string &module_name,
+    const std::vector<std::pair<std::string,
+				std::optional<std::string>>> &ops)
+{
+  // Send all the commands before waiting for any of them: the mon
+  // commits the config-key updates that are pending at the same time in
+  // a single proposal, so a batch costs about one round trip.
+  std::vector<std::pair<std::string, std::unique_ptr<Command>>> set_cmds;
+  uint64_t version;
   {
     std::lock_guard l(lock);
 
-    // NOTE: this isn't strictly necessary since we'll also get an MKVData
-    // update from the mon due to our subscription *before* our command is acked.
-    if (val) {
-      store_cache[global_key] = *val;
-    } else {
-      store_cache.erase(global_key);
+    for (const auto& [key, val] : ops) {
+      const std::string global_key = PyModule::mgr_store_prefix
+                                       + module_name + "/" + key;
+
+      // NOTE: this isn't strictly necessary since we'll also get an MKVData
+      // update from the mon due to our subscription *before* our command is acked.
+      if (val) {
+        store_cache[global_key] = *val;
+      } else {
+        store_cache.erase(global_key);
+      }
+
+      std::ostringstream cmd_json;
+      JSONFormatter jf;
+      jf.open_object_section("cmd");
+      if (val) {
+        jf.dump_string("prefix", "config-key set");
+        jf.dump_string("key", global_key);
+        jf.dump_string("val", *val);
+      } else {
+        jf.dump_string("prefix", "config-key del");
+        jf.dump_string("key", global_key);
+      }
+      jf.close_section();
+      jf.flush(cmd_json);
+      auto& set_cmd = set_cmds.emplace_back(
+        global_key, std::make_unique<Command>()).second;
+      set_cmd->run(&monc, cmd_json.str());
     }
+    // a batch is a single change as far as the version is concerned
+    auto& v = store_versions[module_name];
+    v++;
+    version = store_base_version + v;
+  }
 
-    std::ostringstream cmd_json;
-    JSONFormatter jf;
-    jf.open_object_section("cmd");
-    if (val) {
-      jf.dump_string("prefix", "config-key set");
-      jf.dump_string("key", global_key);
-      jf.dump_string("val", *val);
-    } else {
-      jf.dump_string("prefix", "config-key del");
-      jf.dump_string("key", global_key);
+  for (auto& [global_key, set_cmd] : set_cmds) {
+    set_cmd->wait();
+
+    if (set_cmd->r != 0) {
+      // config-key set will fail if mgr's auth key has insufficient
+      // permission to set config keys
+      // FIXME: should this somehow raise an exception back into Python land?
+      dout(0) << "`config-key set " << global_key << "` failed: "
+        << cpp_strerror(set_cmd->r) << dendl;
+      dout(0) << "mon returned " << set_cmd->r << ": " << set_cmd->outs << dendl;
     }
-    jf.close_section();
-    jf.flush(cmd_json);
-    set_cmd.run(&monc, cmd_json.str());
   }
-  set_cmd.wait();
+  return version;
+}
 
-  if (set_cmd.r != 0) {
-    // config-key set will fail if mgr's auth key has insufficient
-    // permission to set config keys
-    // FIXME: should this somehow raise an exception back into Python land?
-    dout(0) << "`config-key set " << global_key << " " << val << "` failed: "
-      << cpp_strerror(set_cmd.r) << dendl;
-    dout(0) << "mon returned " << set_cmd.r << ": " << set_cmd.outs << dendl;
+uint64_t ActivePyModules::get_store_version(const std::string &module_name) const
+{
+  std::lock_guard l(lock);
+  auto i = store_versions.find(module_name);
+  return store_base_version + (i == store_versions.end() ? 0 : i->second);
+}
+
+void ActivePyModules::_bump_store_version(std::string_view global_key)
+{
+  ceph_assert(ceph_mutex_is_locked_by_me(lock));
+  if (global_key.find(PyModule::mgr_store_prefix) != 0) {
+    return;
+  }
+  auto module_name = global_key.substr(PyModule::mgr_store_prefix.size());
+  module_name = module_name.substr(0, module_name.find('/'));
+  auto i = store_versions.find(module_name);
+  if (i == store_versions.end()) {
+    store_versions.emplace(module_name, 1);
+  } else {
+    i->second++;
   }
 }
 
@@ -813,16 +880,30 @@ void ActivePyModules::update_kv_data(
       dout(20) << " rm prior " << p->first << dendl;
       p = store_cache.erase(p);
     }
+    // invalidates the stores of all the modules
+    store_base_version++;
   } else {
     dout(10) << "incremental update on " << prefix << dendl;
   }
   for (auto& i : data) {
     if (i.second) {
       dout(20) << " set " << i.first << " = " << i.second->to_str() << dendl;
-      store_cache[i.first] = i.second->to_str();
+      auto value = i.second->to_str();
+      auto p = store_cache.find(i.first);
+      if (p == store_cache.end()) {
+        store_cache.emplace(i.first, std::move(value));
+        _bump_store_version(i.first);
+      } else if (p->second != value) {
+        // our own set_store() already updated the cache before the mon
+        // echoed the change back, that must not count as a change
+        p->second = std::move(value);
+        _bump_store_version(i.first);
+      }
     } else {
       dout(20) << " rm " << i.first << dendl;
-      store_cache.erase(i.first);
+      if (store_cache.erase(i.first)) {
+        _bump_store_version(i.first);
+      }
     }
     if (i.first.find("config/") == 0) {
       do_config = true;
@@ -982,6 +1063,57 @@ PyObject* ActivePyModules::get_latest_counter_python(
   return with_perf_counters(extract_latest_counters, svc_name, svc_id, path);
 }
 
+PyObject* ActivePyModules::get_latest_counters_python(
+    const std::string &svc_type,
+    const std::string &svc_id,
+    const std::vector<std::string> &paths)
+{
+  // the sums of long running averages and the values of the other
+  // counters, plus the counts of long running averages (0 otherwise).
+  // Counters which aren't known (anymore) are reported as 0.
+  std::vector<uint64_t> values(paths.size(), 0);
+  std::vector<uint64_t> counts(paths.size(), 0);
+  {
+    without_gil_t no_gil;
+    std::lock_guard l(lock);
+    auto metadata = daemon_state.get(DaemonKey{svc_type, svc_id});
+    if (metadata) {
+      std::lock_guard l2(metadata->lock);
+      const auto &instances = metadata->perf_counters.instances;
+      const auto &types = metadata->perf_counters.types;
+      for (size_t i = 0; i < paths.size(); ++i) {
+        auto instance = instances.find(paths[i]);
+        auto type = types.find(paths[i]);
+        if (instance == instances.end() || type == types.end()) {
+          continue;
+        }
+        if (type->second.type & PERFCOUNTER_LONGRUNAVG) {
+          const auto &data = instance->second.get_data_avg();
+          if (!data.empty()) {
+            values[i] = data.back().s;
+            counts[i] = data.back().c;
+          }
+        } else {
+          const auto &data = instance->second.get_data();
+          if (!data.empty()) {
+            values[i] = data.back().v;
+          }
+        }
+      }
+    } else {
+      dout(4) << "No daemon state for " << svc_type << "." << svc_id << ")"
+              << dendl;
+    }
+  }
+  PyObject *py_values = PyList_New(paths.size());
+  PyObject *py_counts = PyList_New(paths.size());
+  for (size_t i = 0; i < paths.size(); ++i) {
+    PyList_SET_ITEM(py_values, i, PyLong_FromUnsignedLongLong(values[i]));
+    PyList_SET_ITEM(py_counts, i, PyLong_FromUnsignedLongLong(counts[i]));
+  }
+  return Py_BuildValue("(NN)", py_values, py_counts);
+}
+
 PyObject* ActivePyModules::get_perf_schema_python(
     const std::string &svc_type,
     const std::string &svc_id)
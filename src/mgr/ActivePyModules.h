@@ -48,6 +48,9 @@ class ActivePyModules
   PyModuleConfig &module_config;
   bool have_local_config_map = false;
   std::map<std::string, std::string> store_cache;
+  // bumped whenever the store of a module changes, see get_store_version()
+  std::map<std::string, uint64_t, std::less<>> store_versions;
+  uint64_t store_base_version = 0;
   ConfigMap config_map;  ///< derived from store_cache config/ keys
   DaemonStateIndex &daemon_state;
   ClusterState &cluster_state;
@@ -67,6 +70,8 @@ private:
 
   mutable ceph::mutex lock = ceph::make_mutex("ActivePyModules::lock");
 
+  void _bump_store_version(std::string_view global_key);
+
 public:
   ActivePyModules(
     PyModuleConfig &module_config,
@@ -98,6 +103,10 @@ public:
     const std::string &svc_type,
     const std::string &svc_id,
     const std::string &path);
+  PyObject *get_latest_counters_python(
+    const std::string &svc_type,
+    const std::string &svc_id,
+    const std::vector<std::string> &paths);
   PyObject *get_perf_schema_python(
      const std::string &svc_type,
      const std::string &svc_id);
@@ -133,6 +142,10 @@ public:
 			      const std::string &prefix) const;
   void set_store(const std::string &module_name,
       const std::string &key, const std::optional<std::string> &val);
+  uint64_t set_store_batch(const std::string &module_name,
+      const std::vector<std::pair<std::string,
+				  std::optional<std::string>>> &ops);
+  uint64_t get_store_version(const std::string &module_name) const;
 
   bool get_config(const std::string &module_name,
       const std::string &key, std::string *val) const;
@@ -24,8 +24,10 @@
 
 #include "mon/MonClient.h"
 #include "common/errno.h"
+#include "common/perf_counters.h"
 #include "common/version.h"
 #include "mgr/Types.h"
+#include "mgr/mgr_perf_counters.h"
 
 #include "PyUtil.h"
 #include "BaseMgrModule.h"
@@ -541,6 +543,49 @@ ceph_store_set(BaseMgrModule *self, PyObject *args)
   Py_RETURN_NONE;
 }
 
+static PyObject*
+ceph_store_set_batch(BaseMgrModule *self, PyObject *args)
+{
+  PyObject *py_ops = nullptr;
+  if (!PyArg_ParseTuple(args, "O:ceph_store_set_batch", &py_ops)) {
+    return nullptr;
+  }
+  PyObject *seq = PySequence_Fast(py_ops, "ops must be a sequence");
+  if (seq == nullptr) {
+    return nullptr;
+  }
+  std::vector<std::pair<std::string, std::optional<std::string>>> ops;
+  for (Py_ssize_t i = 0; i < PySequence_Fast_GET_SIZE(seq); i++) {
+    PyObject *op = PySequence_Fast_GET_ITEM(seq, i);
+    char *key = nullptr;
+    char *value = nullptr;
+    if (!PyArg_ParseTuple(op, "sz:ceph_store_set_batch", &key, &value)) {
+      Py_DECREF(seq);
+      return nullptr;
+    }
+    std::optional<string> val;
+    if (value) {
+      val = value;
+    }
+    ops.emplace_back(key, val);
+  }
+  Py_DECREF(seq);
+  auto version = without_gil([&] {
+    return self->py_modules->set_store_batch(self->this_module->get_name(),
+                                             ops);
+  });
+  return PyLong_FromUnsignedLongLong(version);
+}
+
+static PyObject*
+ceph_store_get_version(BaseMgrModule *self, PyObject *args)
+{
+  auto version = without_gil([&] {
+    return self->py_modules->get_store_version(self->this_module->get_name());
+  });
+  return PyLong_FromUnsignedLongLong(version);
+}
+
 static PyObject*
 get_metadata(BaseMgrModule *self, PyObject *args)
 {
@@ -657,6 +702,36 @@ get_latest_counter(BaseMgrModule *self, PyObject *args)
       svc_name, svc_id, counter_path);
 }
 
+static PyObject*
+get_latest_counters(BaseMgrModule *self, PyObject *args)
+{
+  char *svc_name = nullptr;
+  char *svc_id = nullptr;
+  PyObject *py_paths = nullptr;
+  if (!PyArg_ParseTuple(args, "ssO:get_latest_counters", &svc_name,
+                        &svc_id, &py_paths)) {
+    return nullptr;
+  }
+  PyObject *seq = PySequence_Fast(py_paths, "paths must be a sequence");
+  if (seq == nullptr) {
+    return nullptr;
+  }
+  std::vector<std::string> paths;
+  const Py_ssize_t n = PySequence_Fast_GET_SIZE(seq);
+  paths.reserve(n);
+  for (Py_ssize_t i = 0; i < n; ++i) {
+    const char *path = PyUnicode_AsUTF8(PySequence_Fast_GET_ITEM(seq, i));
+    if (path == nullptr) {
+      Py_DECREF(seq);
+      return nullptr;
+    }
+    paths.emplace_back(path);
+  }
+  Py_DECREF(seq);
+  return self->py_modules->get_latest_counters_python(
+      svc_name, svc_id, paths);
+}
+
 static PyObject*
 get_perf_schema(BaseMgrModule *self, PyObject *args)
 {
@@ -1411,6 +1486,26 @@ ceph_unregister_client(BaseMgrModule *self, PyObject *args)
   Py_RETURN_NONE;
 }
 
+static PyObject*
+ceph_update_snapshot_cache_metrics(BaseMgrModule *self, PyObject *args)
+{
+  unsigned long long hits = 0;
+  unsigned long long misses = 0;
+  if (!PyArg_ParseTuple(args, "KK:ceph_update_snapshot_cache_metrics",
+			&hits, &misses)) {
+    return nullptr;
+  }
+  if (perfcounter) {
+    if (hits) {
+      perfcounter->inc(l_mgr_snapshot_cache_hit, hits);
+    }
+    if (misses) {
+      perfcounter->inc(l_mgr_snapshot_cache_miss, misses);
+    }
+  }
+  Py_RETURN_NONE;
+}
+
 PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_get", (PyCFunction)ceph_state_get, METH_VARARGS,
    "Get a cluster object"},
@@ -1457,12 +1552,21 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_set_store", (PyCFunction)ceph_store_set, METH_VARARGS,
    "Set a stored field"},
 
+  {"_ceph_set_store_batch", (PyCFunction)ceph_store_set_batch, METH_VARARGS,
+   "Set and remove several stored fields at once"},
+
+  {"_ceph_get_store_version", (PyCFunction)ceph_store_get_version, METH_NOARGS,
+   "Get the version of the stored fields, bumped on every change"},
+
   {"_ceph_get_counter", (PyCFunction)get_counter, METH_VARARGS,
     "Get a performance counter"},
 
   {"_ceph_get_latest_counter", (PyCFunction)get_latest_counter, METH_VARARGS,
     "Get the latest performance counter"},
 
+  {"_ceph_get_latest_counters", (PyCFunction)get_latest_counters, METH_VARARGS,
+    "Get the latest values of many perf counters of a daemon"},
+
   {"_ceph_get_perf_schema", (PyCFunction)get_perf_schema, METH_VARARGS,
     "Get the performance counter schema"},
 
@@ -1540,6 +1644,9 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_unregister_client", (PyCFunction)ceph_unregister_client,
     METH_VARARGS, "Unregister RADOS instance for potential blocklisting"},
 
+  {"_ceph_update_snapshot_cache_metrics", (PyCFunction)ceph_update_snapshot_cache_metrics,
+    METH_VARARGS, "Count hits and misses of the module snapshot cache"},
+
   {NULL, NULL, 0, NULL}
 };
 
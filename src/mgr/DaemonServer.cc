@@ -2417,6 +2417,21 @@ bool DaemonServer::_handle_command(
       cmdctx->reply(0, ss);
     }
     return true;
+  } else if (prefix == "mgr profile") {
+    // handled by the MgrModule base class of the named module, route it
+    // there as if the module had declared the command itself
+    string module_name;
+    cmd_getval(cmdctx->cmdmap, "module", module_name);
+    if (!py_modules.get_module(module_name)) {
+      ss << "Module '" << module_name << "' does not exist";
+      cmdctx->reply(-ENOENT, ss);
+      return true;
+    }
+    py_command.cmdstring = mgr_cmd->cmdstring;
+    py_command.helpstring = mgr_cmd->helpstring;
+    py_command.perm = "rw";
+    py_command.polling = false;
+    py_command.module_name = module_name;
   } else {
     if (!pgmap_ready) {
       ss << "Warning: due to ceph-mgr restart, some PG states may not be up to date\n";
@@ -189,6 +189,13 @@ COMMAND("config show-with-defaults " \
 	"Show running configuration (including compiled-in defaults)",
 	"mgr", "r")
 
+COMMAND("mgr profile " \
+	"name=action,type=CephChoices,strings=start|stop|dump|reset " \
+	"name=module,type=CephString",
+	"Control the sampling profiler of a mgr module and dump its "
+	"collapsed stacks and command/notify latencies",
+	"mgr", "rw")
+
 COMMAND("device ls",
 	"Show devices",
 	"mgr", "r")
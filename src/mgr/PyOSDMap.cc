@@ -89,6 +89,32 @@ static PyObject *osdmap_apply_incremental(BasePyOSDMap *self,
   return construct_with_capsule("mgr_module", "OSDMap", (void*)next);
 }
 
+static PyObject *osdmap_copy(BasePyOSDMap *self, PyObject *obj)
+{
+  // a deep copy, crush included, which can be used from another thread
+  PyThreadState *tstate = PyEval_SaveThread();
+  bufferlist bl;
+  self->osdmap->encode(bl, CEPH_FEATURES_ALL|CEPH_FEATURE_RESERVED);
+  OSDMap *copy = new OSDMap;
+  copy->decode(bl);
+  PyEval_RestoreThread(tstate);
+  dout(10) << __func__ << " map " << self->osdmap << " copy " << copy << dendl;
+
+  return construct_with_capsule("mgr_module", "OSDMap", (void*)copy);
+}
+
+static PyObject *osdmap_diff(BasePyOSDMap *self, BasePyOSDMap *other)
+{
+  if (!PyObject_TypeCheck(other, &BasePyOSDMapType)) {
+    PyErr_SetString(PyExc_TypeError, "expected an OSDMap");
+    return nullptr;
+  }
+
+  PyFormatter f;
+  other->osdmap->dump_changes_since(*(self->osdmap), &f);
+  return f.get();
+}
+
 static PyObject *osdmap_get_crush(BasePyOSDMap* self, PyObject *obj)
 {
   return construct_with_capsule("mgr_module", "CRUSHMap",
@@ -189,6 +215,58 @@ static PyObject *osdmap_map_pool_pgs_up(BasePyOSDMap* self, PyObject *args)
   return f.get();
 }
 
+static PyObject *osdmap_map_pool_pgs_moved(BasePyOSDMap* self, PyObject *args)
+{
+  BasePyOSDMap *other;
+  int poolid;
+  int osd;
+  if (!PyArg_ParseTuple(args, "O!ii:map_pool_pgs_moved",
+			&BasePyOSDMapType, &other, &poolid, &osd)) {
+    return nullptr;
+  }
+  auto pi = self->osdmap->get_pg_pool(poolid);
+  if (!pi) {
+    PyErr_Format(PyExc_KeyError, "pool %d does not exist", poolid);
+    return nullptr;
+  }
+  // a pool that is gone from the other map maps nowhere
+  bool other_has_pool = other->osdmap->have_pg_pool(poolid);
+  vector<unsigned> moved;
+  PyThreadState *tstate = PyEval_SaveThread();
+  vector<int> acting, other_acting;
+  for (unsigned ps = 0; ps < pi->get_pg_num(); ++ps) {
+    pg_t pgid(ps, poolid);
+    self->osdmap->pg_to_acting_osds(pgid, acting);
+    if (other_has_pool) {
+      other->osdmap->pg_to_acting_osds(pgid, other_acting);
+    } else {
+      other_acting.clear();
+    }
+    if (std::find(acting.begin(), acting.end(), osd) == acting.end() &&
+	std::find(other_acting.begin(), other_acting.end(), osd) ==
+	other_acting.end()) {
+      continue;
+    }
+    std::sort(acting.begin(), acting.end());
+    std::sort(other_acting.begin(), other_acting.end());
+    acting.erase(std::unique(acting.begin(), acting.end()), acting.end());
+    other_acting.erase(std::unique(other_acting.begin(), other_acting.end()),
+		       other_acting.end());
+    if (acting != other_acting) {
+      moved.push_back(ps);
+    }
+  }
+  PyEval_RestoreThread(tstate);
+  dout(10) << __func__ << " pool " << poolid << " osd." << osd
+	   << " moved " << moved.size() << "/" << pi->get_pg_num() << dendl;
+
+  PyObject *list = PyList_New(moved.size());
+  for (size_t i = 0; i < moved.size(); ++i) {
+    PyList_SET_ITEM(list, i, PyLong_FromUnsignedLong(moved[i]));
+  }
+  return list;
+}
+
 static int
 BasePyOSDMap_init(BasePyOSDMap *self, PyObject *args, PyObject *kwds)
 {
@@ -319,6 +397,10 @@ PyMethodDef BasePyOSDMap_methods[] = {
    "Create OSDMap::Incremental"},
   {"_apply_incremental", (PyCFunction)osdmap_apply_incremental, METH_O,
    "Apply OSDMap::Incremental and return the resulting OSDMap"},
+  {"_copy", (PyCFunction)osdmap_copy, METH_NOARGS,
+   "Create a deep copy of the OSDMap"},
+  {"_diff", (PyCFunction)osdmap_diff, METH_O,
+   "Get changes between this OSDMap and another"},
   {"_get_crush", (PyCFunction)osdmap_get_crush, METH_NOARGS, "Get CrushWrapper"},
   {"_get_pools_by_take", (PyCFunction)osdmap_get_pools_by_take, METH_VARARGS,
    "Get pools that have CRUSH rules that TAKE the given root"},
@@ -326,6 +408,9 @@ PyMethodDef BasePyOSDMap_methods[] = {
    "Calculate new pg-upmap values"},
   {"_map_pool_pgs_up", (PyCFunction)osdmap_map_pool_pgs_up, METH_VARARGS,
    "Calculate up set mappings for all PGs in a pool"},
+  {"_map_pool_pgs_moved", (PyCFunction)osdmap_map_pool_pgs_moved, METH_VARARGS,
+   "Find the PGs of a pool mapped to an OSD whose acting set differs in "
+   "another OSDMap"},
   {"_pg_to_up_acting_osds", (PyCFunction)osdmap_pg_to_up_acting_osds, METH_VARARGS,
     "Calculate up+acting OSDs for a PG ID"},
   {"_pool_raw_used_rate", (PyCFunction)osdmap_pool_raw_used_rate, METH_VARARGS,
@@ -491,6 +576,34 @@ static PyObject *osdmap_inc_set_compat_weight_set_weights(
   Py_RETURN_NONE;
 }
 
+static PyObject *osdmap_inc_merge_upmaps(BasePyOSDMapIncremental *self,
+    BasePyOSDMapIncremental *other)
+{
+  if (!PyObject_TypeCheck(other, &BasePyOSDMapIncrementalType)) {
+    PyErr_SetString(PyExc_TypeError, "expected an OSDMapIncremental");
+    return nullptr;
+  }
+  auto inc = self->inc;
+  for (auto& [pg, um] : other->inc->new_pg_upmap) {
+    inc->old_pg_upmap.erase(pg);
+    inc->new_pg_upmap[pg] = um;
+  }
+  for (auto& pg : other->inc->old_pg_upmap) {
+    inc->new_pg_upmap.erase(pg);
+    inc->old_pg_upmap.insert(pg);
+  }
+  for (auto& [pg, items] : other->inc->new_pg_upmap_items) {
+    inc->old_pg_upmap_items.erase(pg);
+    inc->new_pg_upmap_items[pg] = items;
+  }
+  for (auto& pg : other->inc->old_pg_upmap_items) {
+    inc->new_pg_upmap_items.erase(pg);
+    inc->old_pg_upmap_items.insert(pg);
+  }
+  dout(10) << __func__ << " " << other->inc << " into " << inc << dendl;
+  Py_RETURN_NONE;
+}
+
 PyMethodDef BasePyOSDMapIncremental_methods[] = {
   {"_get_epoch", (PyCFunction)osdmap_inc_get_epoch, METH_NOARGS,
     "Get OSDMap::Incremental epoch"},
@@ -501,6 +614,8 @@ PyMethodDef BasePyOSDMapIncremental_methods[] = {
   {"_set_crush_compat_weight_set_weights",
    (PyCFunction)osdmap_inc_set_compat_weight_set_weights, METH_O,
    "Set weight values in the pending CRUSH compat weight-set"},
+  {"_merge_upmaps", (PyCFunction)osdmap_inc_merge_upmaps, METH_O,
+   "Merge the pg-upmap changes of another OSDMap::Incremental"},
   {NULL, NULL, 0, NULL}
 };
 
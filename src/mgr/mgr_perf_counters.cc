@@ -14,6 +14,14 @@ int mgr_perf_start(CephContext *cct)
 
   plb.add_u64_counter(l_mgr_cache_hit, "cache_hit", "Cache hits");
   plb.add_u64_counter(l_mgr_cache_miss, "cache_miss", "Cache miss");
+  plb.add_u64_counter(l_mgr_snapshot_cache_hit, "snapshot_cache_hit",
+                      "Module snapshot cache hits");
+  plb.add_u64_counter(l_mgr_snapshot_cache_miss, "snapshot_cache_miss",
+                      "Module snapshot cache misses");
+  plb.add_time_avg(l_mgr_module_notify_lat, "module_notify_lat",
+                   "Module notify latency, including waiting for the GIL");
+  plb.add_time_avg(l_mgr_module_command_lat, "module_command_lat",
+                   "Module command latency, including waiting for the GIL");
 
   perfcounter = plb.create_perf_counters();
   cct->get_perfcounters_collection()->add(perfcounter);
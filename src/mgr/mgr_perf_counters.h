@@ -14,6 +14,10 @@ enum {
 
   l_mgr_cache_hit,
   l_mgr_cache_miss,
+  l_mgr_snapshot_cache_hit,
+  l_mgr_snapshot_cache_miss,
+  l_mgr_module_notify_lat,
+  l_mgr_module_command_lat,
 
   l_mgr_last,
 };
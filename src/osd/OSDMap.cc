@@ -3877,6 +3877,134 @@ void OSDMap::dump(Formatter *f) const
   f->close_section();
 }
 
+// dump the pgs whose entry in the (sorted by pg) maps differs
+template<typename M>
+static void dump_changed_pgs(const char *name, const M& prev, const M& cur,
+			     Formatter *f)
+{
+  f->open_array_section(name);
+  auto p = prev.begin();
+  auto q = cur.begin();
+  while (p != prev.end() || q != cur.end()) {
+    if (q == cur.end() || (p != prev.end() && p->first < q->first)) {
+      f->dump_stream("pgid") << p->first;
+      ++p;
+    } else if (p == prev.end() || q->first < p->first) {
+      f->dump_stream("pgid") << q->first;
+      ++q;
+    } else {
+      if (p->second != q->second) {
+	f->dump_stream("pgid") << q->first;
+      }
+      ++p;
+      ++q;
+    }
+  }
+  f->close_section();
+}
+
+void OSDMap::dump_changes_since(const OSDMap& prev, Formatter *f) const
+{
+  f->dump_int("from_epoch", prev.get_epoch());
+  f->dump_int("to_epoch", get_epoch());
+  f->dump_bool("crush_changed", prev.get_crush_version() != get_crush_version());
+  f->dump_bool("flags_changed", prev.get_flags() != get_flags());
+
+  // only the attributes that changed are dumped, as [previous, current]
+  f->open_array_section("osds");
+  for (int o = 0; o < std::max(prev.get_max_osd(), get_max_osd()); ++o) {
+    bool prev_exists = prev.exists(o);
+    bool cur_exists = exists(o);
+    if (!prev_exists && !cur_exists) {
+      continue;
+    }
+    auto prev_weight = prev_exists ? prev.get_weight(o) : CEPH_OSD_OUT;
+    auto cur_weight = cur_exists ? get_weight(o) : CEPH_OSD_OUT;
+    auto prev_affinity = prev_exists ? prev.get_primary_affinity(o) :
+      CEPH_OSD_DEFAULT_PRIMARY_AFFINITY;
+    auto cur_affinity = cur_exists ? get_primary_affinity(o) :
+      CEPH_OSD_DEFAULT_PRIMARY_AFFINITY;
+    bool prev_up = prev_exists && prev.is_up(o);
+    bool cur_up = cur_exists && is_up(o);
+    if (prev_exists == cur_exists &&
+	prev_up == cur_up &&
+	prev_weight == cur_weight &&
+	prev_affinity == cur_affinity) {
+      continue;
+    }
+    f->open_object_section("osd");
+    f->dump_int("osd", o);
+    if (prev_exists != cur_exists) {
+      f->open_array_section("exists");
+      f->dump_bool("prev", prev_exists);
+      f->dump_bool("cur", cur_exists);
+      f->close_section();
+    }
+    if (prev_up != cur_up) {
+      f->open_array_section("up");
+      f->dump_bool("prev", prev_up);
+      f->dump_bool("cur", cur_up);
+      f->close_section();
+    }
+    if (prev_weight != cur_weight) {
+      f->open_array_section("weight");
+      f->dump_float("prev", (float)prev_weight / (float)CEPH_OSD_IN);
+      f->dump_float("cur", (float)cur_weight / (float)CEPH_OSD_IN);
+      f->close_section();
+    }
+    if (prev_affinity != cur_affinity) {
+      f->open_array_section("primary_affinity");
+      f->dump_float("prev", (float)prev_affinity /
+		    (float)CEPH_OSD_MAX_PRIMARY_AFFINITY);
+      f->dump_float("cur", (float)cur_affinity /
+		    (float)CEPH_OSD_MAX_PRIMARY_AFFINITY);
+      f->close_section();
+    }
+    f->close_section();
+  }
+  f->close_section();
+
+  // pools are changed if their last_change epoch moved
+  f->open_array_section("pools_created");
+  for (auto& [id, pool] : pools) {
+    if (!prev.pools.count(id)) {
+      f->dump_int("pool", id);
+    }
+  }
+  f->close_section();
+  f->open_array_section("pools_removed");
+  for (auto& [id, pool] : prev.pools) {
+    if (!pools.count(id)) {
+      f->dump_int("pool", id);
+    }
+  }
+  f->close_section();
+  f->open_array_section("pools_changed");
+  for (auto& [id, pool] : pools) {
+    auto p = prev.pools.find(id);
+    if (p != prev.pools.end() && p->second.last_change != pool.last_change) {
+      f->dump_int("pool", id);
+    }
+  }
+  f->close_section();
+
+  // maps that were not touched are shared between the two epochs
+  if (prev.pg_temp == pg_temp) {
+    f->open_array_section("pg_temp");
+    f->close_section();
+  } else {
+    dump_changed_pgs("pg_temp", *prev.pg_temp, *pg_temp, f);
+  }
+  if (prev.primary_temp == primary_temp) {
+    f->open_array_section("primary_temp");
+    f->close_section();
+  } else {
+    dump_changed_pgs("primary_temp", *prev.primary_temp, *primary_temp, f);
+  }
+  dump_changed_pgs("pg_upmap", prev.pg_upmap, pg_upmap, f);
+  dump_changed_pgs("pg_upmap_items", prev.pg_upmap_items, pg_upmap_items, f);
+}
+
 void OSDMap::generate_test_instances(list<OSDMap*>& o)
 {
   o.push_back(new OSDMap);
@@ -1657,6 +1657,8 @@ public:
   void dump(ceph::Formatter *f) const;
   void dump_osd(int id, ceph::Formatter *f) const;
   void dump_osds(ceph::Formatter *f) const;
+  /// dump what changed between @p prev and this map
+  void dump_changes_since(const OSDMap& prev, ceph::Formatter *f) const;
   static void generate_test_instances(std::list<OSDMap*>& o);
   bool check_new_blocklist_entries() const { return new_blocklist_entries; }
 
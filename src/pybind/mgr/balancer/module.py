@@ -2,19 +2,25 @@
 Balance PG distribution across OSDs.
 """
 
-import copy
+import concurrent.futures
 import enum
 import errno
 import json
 import math
 import random
 import time
-from mgr_module import CLIReadCommand, CLICommand, CommandResult, MgrModule, Option, OSDMap
+from mgr_module import CLIReadCommand, CLICommand, CommandResult, MgrModule, Option, OSDMap, \
+    OSDMapIncremental
 from threading import Event
 from typing import cast, Any, Dict, List, Optional, Sequence, Tuple, Union
 from mgr_module import CRUSHMap
 import datetime
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
 TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
 
 
@@ -39,6 +45,26 @@ class MappingState:
             self.pg_up_by_poolid[poolid] = osdmap.map_pool_pgs_up(poolid)
             for a, b in self.pg_up_by_poolid[poolid].items():
                 self.pg_up[a] = b
+        self._pg_arrays: Dict[int, Tuple[Any, Any, Any]] = {}
+
+    def pg_arrays(self, poolid: int) -> Tuple[Any, Any, Any]:
+        """
+        The up sets of a pool's PGs as a (pg, replica) matrix of OSD ids,
+        padded with ITEM_NONE, along with the vectors of the objects and
+        bytes stored in each of those PGs.  Requires NumPy.
+        """
+        if poolid not in self._pg_arrays:
+            pm = self.pg_up_by_poolid[poolid]
+            width = max([len(up) for up in pm.values()] + [1])
+            up = np.full((len(pm), width), CRUSHMap.ITEM_NONE, dtype=np.int64)
+            objects = np.zeros(len(pm), dtype=np.int64)
+            bytes = np.zeros(len(pm), dtype=np.int64)
+            for i, (pgid, osds) in enumerate(pm.items()):
+                up[i, :len(osds)] = osds
+                objects[i] = self.pg_stat[pgid]['num_objects']
+                bytes[i] = self.pg_stat[pgid]['num_bytes']
+            self._pg_arrays[poolid] = (up, objects, bytes)
+        return self._pg_arrays[poolid]
 
     def calc_misplaced_from(self, other_ms):
         num = len(other_ms.pg_up)
@@ -176,6 +202,9 @@ class Eval:
                 continue
 
             avg = float(total[t]) / float(num)
+            if np is not None:
+                r[t] = self._calc_stats_np(count[t], target, avg, num)
+                continue
             dev = 0.0
 
             # score is a measure of how uneven the data distribution is.
@@ -225,6 +254,33 @@ class Eval:
             }
         return r
 
+    @staticmethod
+    def _calc_stats_np(count: Dict[int, float],
+                       target: Dict[int, float],
+                       avg: float,
+                       num: int) -> Dict[str, Union[int, float]]:
+        # same as the loop in calc_stats, on arrays of the per-OSD values
+        v = np.fromiter(count.values(), dtype=np.float64, count=len(count))
+        w = np.fromiter((target[k] for k in count), dtype=np.float64,
+                        count=len(count))
+        adjusted = np.zeros_like(v)
+        np.divide(v, w * float(num), out=adjusted, where=w != 0)
+        over = adjusted > avg
+        x = (adjusted[over] - avg) / avg / math.sqrt(2.0)
+        erf = np.fromiter((math.erf(a) for a in x.tolist()),
+                          dtype=np.float64, count=len(x))
+        sum_weight = float(w[over].sum())
+        score = float(np.dot(w[over], erf))
+        dev = float(np.square(avg - adjusted).sum())
+        return {
+            'max': max(count.values()),
+            'min': min(count.values()),
+            'avg': avg,
+            'stddev': math.sqrt(dev / float(max(num - 1, 1))),
+            'sum_weight': sum_weight,
+            'score': score / max(sum_weight, 1),
+        }
+
 
 class Module(MgrModule):
     MODULE_OPTIONS = [
@@ -323,6 +379,7 @@ class Module(MgrModule):
     optimizing = False
     last_optimize_started = ''
     last_optimize_duration = ''
+    last_optimize_partitions: List[Dict[str, Any]] = []
     optimize_result = ''
     success_string = 'Optimization plan created successfully'
     in_progress_string = 'in progress'
@@ -341,6 +398,7 @@ class Module(MgrModule):
             'active': self.active,
             'last_optimize_started': self.last_optimize_started,
             'last_optimize_duration': self.last_optimize_duration,
+            'last_optimize_partitions': self.last_optimize_partitions,
             'optimize_result': self.optimize_result,
             'mode': self.get_module_option('mode'),
         }
@@ -706,6 +764,105 @@ class Module(MgrModule):
                           pools)
         return plan
 
+    def _count_pool(self,
+                    pe: Eval,
+                    ms: MappingState,
+                    pool: str,
+                    poolid: int,
+                    actual_by_root: Dict[str, Dict[str, dict]]) -> Tuple[int, int, int,
+                                                                         Dict[int, int],
+                                                                         Dict[int, int],
+                                                                         Dict[int, int]]:
+        pm = ms.pg_up_by_poolid[poolid]
+        pgs = 0
+        objects = 0
+        bytes = 0
+        pgs_by_osd: Dict[int, int] = {}
+        objects_by_osd: Dict[int, int] = {}
+        bytes_by_osd: Dict[int, int] = {}
+        for pgid, up in pm.items():
+            for osd in [int(osd) for osd in up]:
+                if osd == CRUSHMap.ITEM_NONE:
+                    continue
+                if osd not in pgs_by_osd:
+                    pgs_by_osd[osd] = 0
+                    objects_by_osd[osd] = 0
+                    bytes_by_osd[osd] = 0
+                pgs_by_osd[osd] += 1
+                objects_by_osd[osd] += ms.pg_stat[pgid]['num_objects']
+                bytes_by_osd[osd] += ms.pg_stat[pgid]['num_bytes']
+                # pick a root to associate this pg instance with.
+                # note that this is imprecise if the roots have
+                # overlapping children.
+                # FIXME: divide bytes by k for EC pools.
+                for root in pe.pool_roots[pool]:
+                    if osd in pe.target_by_root[root]:
+                        actual_by_root[root]['pgs'][osd] += 1
+                        actual_by_root[root]['objects'][osd] += ms.pg_stat[pgid]['num_objects']
+                        actual_by_root[root]['bytes'][osd] += ms.pg_stat[pgid]['num_bytes']
+                        pgs += 1
+                        objects += ms.pg_stat[pgid]['num_objects']
+                        bytes += ms.pg_stat[pgid]['num_bytes']
+                        pe.total_by_root[root]['pgs'] += 1
+                        pe.total_by_root[root]['objects'] += ms.pg_stat[pgid]['num_objects']
+                        pe.total_by_root[root]['bytes'] += ms.pg_stat[pgid]['num_bytes']
+                        break
+        return pgs, objects, bytes, pgs_by_osd, objects_by_osd, bytes_by_osd
+
+    def _count_pool_np(self,
+                       pe: Eval,
+                       ms: MappingState,
+                       pool: str,
+                       poolid: int,
+                       actual_by_root: Dict[str, Dict[str, dict]]) -> Tuple[int, int, int,
+                                                                            Dict[int, int],
+                                                                            Dict[int, int],
+                                                                            Dict[int, int]]:
+        # same as _count_pool, but the per-OSD sums are the products of the
+        # pg -> osd incidence of the up sets with the per-pg stat vectors
+        up, pg_objects, pg_bytes = ms.pg_arrays(poolid)
+        rows, cols = np.nonzero(up != CRUSHMap.ITEM_NONE)
+        osds, index = np.unique(up[rows, cols], return_inverse=True)
+        n = len(osds)
+        osd_pgs = np.bincount(index, minlength=n)
+        osd_objects = np.zeros(n, dtype=np.int64)
+        np.add.at(osd_objects, index, pg_objects[rows])
+        osd_bytes = np.zeros(n, dtype=np.int64)
+        np.add.at(osd_bytes, index, pg_bytes[rows])
+
+        # associate each osd with the first of the pool's roots it is in
+        osd_list = osds.tolist()
+        root_of = np.full(n, -1)
+        roots = pe.pool_roots[pool]
+        for i, root in reversed(list(enumerate(roots))):
+            in_root = [osd in pe.target_by_root[root] for osd in osd_list]
+            root_of[np.array(in_root, dtype=bool)] = i
+
+        pgs = objects = bytes = 0
+        for i, root in enumerate(roots):
+            sel = np.flatnonzero(root_of == i)
+            if len(sel) == 0:
+                continue
+            actual = actual_by_root[root]
+            for j, osd in zip(sel.tolist(), osds[sel].tolist()):
+                actual['pgs'][osd] += int(osd_pgs[j])
+                actual['objects'][osd] += int(osd_objects[j])
+                actual['bytes'][osd] += int(osd_bytes[j])
+            root_pgs = int(osd_pgs[sel].sum())
+            root_objects = int(osd_objects[sel].sum())
+            root_bytes = int(osd_bytes[sel].sum())
+            pe.total_by_root[root]['pgs'] += root_pgs
+            pe.total_by_root[root]['objects'] += root_objects
+            pe.total_by_root[root]['bytes'] += root_bytes
+            pgs += root_pgs
+            objects += root_objects
+            bytes += root_bytes
+
+        return (pgs, objects, bytes,
+                dict(zip(osd_list, osd_pgs.tolist())),
+                dict(zip(osd_list, osd_objects.tolist())),
+                dict(zip(osd_list, osd_bytes.tolist())))
+
     def calc_eval(self, ms: MappingState, pools: List[str]) -> Eval:
         pe = Eval(ms)
         pool_rule = {}
@@ -751,15 +908,7 @@ class Module(MgrModule):
                 pe.root_pools[root].append(pe.pool_name[poolid])
             pe.root_ids[root] = rootid
             roots.append(root)
-            weight_map = ms.crush.get_take_weight_osd_map(rootid)
-            adjusted_map = {
-                osd: cw * osd_weight[osd]
-                for osd, cw in weight_map.items() if osd in osd_weight and cw > 0
-            }
-            sum_w = sum(adjusted_map.values())
-            assert len(adjusted_map) == 0 or sum_w > 0
-            pe.target_by_root[root] = {osd: w / sum_w
-                                       for osd, w in adjusted_map.items()}
+            pe.target_by_root[root] = self._calc_target(ms, rootid, osd_weight)
             actual_by_root[root] = {
                 'pgs': {},
                 'objects': {},
@@ -781,40 +930,12 @@ class Module(MgrModule):
         # pool and root actual
         for pool, pi in pool_info.items():
             poolid = pi['pool']
-            pm = ms.pg_up_by_poolid[poolid]
-            pgs = 0
-            objects = 0
-            bytes = 0
-            pgs_by_osd = {}
-            objects_by_osd = {}
-            bytes_by_osd = {}
-            for pgid, up in pm.items():
-                for osd in [int(osd) for osd in up]:
-                    if osd == CRUSHMap.ITEM_NONE:
-                        continue
-                    if osd not in pgs_by_osd:
-                        pgs_by_osd[osd] = 0
-                        objects_by_osd[osd] = 0
-                        bytes_by_osd[osd] = 0
-                    pgs_by_osd[osd] += 1
-                    objects_by_osd[osd] += ms.pg_stat[pgid]['num_objects']
-                    bytes_by_osd[osd] += ms.pg_stat[pgid]['num_bytes']
-                    # pick a root to associate this pg instance with.
-                    # note that this is imprecise if the roots have
-                    # overlapping children.
-                    # FIXME: divide bytes by k for EC pools.
-                    for root in pe.pool_roots[pool]:
-                        if osd in pe.target_by_root[root]:
-                            actual_by_root[root]['pgs'][osd] += 1
-                            actual_by_root[root]['objects'][osd] += ms.pg_stat[pgid]['num_objects']
-                            actual_by_root[root]['bytes'][osd] += ms.pg_stat[pgid]['num_bytes']
-                            pgs += 1
-                            objects += ms.pg_stat[pgid]['num_objects']
-                            bytes += ms.pg_stat[pgid]['num_bytes']
-                            pe.total_by_root[root]['pgs'] += 1
-                            pe.total_by_root[root]['objects'] += ms.pg_stat[pgid]['num_objects']
-                            pe.total_by_root[root]['bytes'] += ms.pg_stat[pgid]['num_bytes']
-                            break
+            if np is not None:
+                pgs, objects, bytes, pgs_by_osd, objects_by_osd, bytes_by_osd = \
+                    self._count_pool_np(pe, ms, pool, poolid, actual_by_root)
+            else:
+                pgs, objects, bytes, pgs_by_osd, objects_by_osd, bytes_by_osd = \
+                    self._count_pool(pe, ms, pool, poolid, actual_by_root)
             pe.count_by_pool[pool] = {
                 'pgs': {
                     k: v
@@ -829,20 +950,6 @@ class Module(MgrModule):
                     for k, v in bytes_by_osd.items()
                 },
             }
-            pe.actual_by_pool[pool] = {
-                'pgs': {
-                    k: float(v) / float(max(pgs, 1))
-                    for k, v in pgs_by_osd.items()
-                },
-                'objects': {
-                    k: float(v) / float(max(objects, 1))
-                    for k, v in objects_by_osd.items()
-                },
-                'bytes': {
-                    k: float(v) / float(max(bytes, 1))
-                    for k, v in bytes_by_osd.items()
-                },
-            }
             pe.total_by_pool[pool] = {
                 'pgs': pgs,
                 'objects': objects,
@@ -863,19 +970,41 @@ class Module(MgrModule):
                     for k, v in actual_by_root[root]['bytes'].items()
                 },
             }
+        return self._calc_scores(pe)
+
+    def _calc_target(self,
+                     ms: MappingState,
+                     rootid: int,
+                     osd_weight: Dict[int, float]) -> Dict[int, float]:
+        weight_map = ms.crush.get_take_weight_osd_map(rootid)
+        adjusted_map = {
+            osd: cw * osd_weight[osd]
+            for osd, cw in weight_map.items() if osd in osd_weight and cw > 0
+        }
+        sum_w = sum(adjusted_map.values())
+        assert len(adjusted_map) == 0 or sum_w > 0
+        return {osd: w / sum_w for osd, w in adjusted_map.items()}
+
+    def _calc_scores(self, pe: Eval) -> Eval:
+        """
+        Fill in the distributions, stats and scores of an Eval from its
+        per-OSD counts and totals.
+        """
+        for pool, counts in pe.count_by_pool.items():
+            total = pe.total_by_pool[pool]
+            pe.actual_by_pool[pool] = {
+                t: {
+                    k: float(v) / float(max(total[t], 1))
+                    for k, v in counts[t].items()
+                } for t in ('pgs', 'objects', 'bytes')
+            }
+        for root, counts in pe.count_by_root.items():
+            total = pe.total_by_root[root]
             pe.actual_by_root[root] = {
-                'pgs': {
-                    k: float(v) / float(max(pe.total_by_root[root]['pgs'], 1))
-                    for k, v in actual_by_root[root]['pgs'].items()
-                },
-                'objects': {
-                    k: float(v) / float(max(pe.total_by_root[root]['objects'], 1))
-                    for k, v in actual_by_root[root]['objects'].items()
-                },
-                'bytes': {
-                    k: float(v) / float(max(pe.total_by_root[root]['bytes'], 1))
-                    for k, v in actual_by_root[root]['bytes'].items()
-                },
+                t: {
+                    k: v / float(max(total[t], 1))
+                    for k, v in counts[t].items()
+                } for t in ('pgs', 'objects', 'bytes')
             }
         self.log.debug('actual_by_pool %s' % pe.actual_by_pool)
         self.log.debug('actual_by_root %s' % pe.actual_by_root)
@@ -909,9 +1038,89 @@ class Module(MgrModule):
             for k, v in vs.items():
                 if k in metrics:
                     pe.score += v
-        pe.score /= len(metrics) * len(roots)
+        pe.score /= len(metrics) * len(pe.total_by_root)
         return pe
 
+    def calc_eval_update(self, prev: Eval, ms: MappingState, pools: List[str]) -> Eval:
+        """
+        Same as calc_eval(ms, pools), for a state that only differs from
+        the one prev evaluated in its weights: only the PGs whose up set
+        changed are counted again.
+        """
+        pe = Eval(ms)
+        if not prev.total_by_root or ms.poolids != prev.ms.poolids:
+            return self.calc_eval(ms, pools)
+        osd_weight = {a['osd']: a['weight']
+                      for a in ms.osdmap_dump.get('osds', []) if a['weight'] > 0}
+        for root, rootid in prev.root_ids.items():
+            pe.target_by_root[root] = self._calc_target(ms, rootid, osd_weight)
+            if pe.target_by_root[root].keys() != prev.target_by_root[root].keys():
+                # which root the PGs count towards may have changed
+                return self.calc_eval(ms, pools)
+
+        pe.root_ids = prev.root_ids
+        pe.pool_name = prev.pool_name
+        pe.pool_id = prev.pool_id
+        pe.pool_roots = prev.pool_roots
+        pe.root_pools = prev.root_pools
+        pe.count_by_pool = {
+            pool: {t: dict(c) for t, c in counts.items()}
+            for pool, counts in prev.count_by_pool.items()
+        }
+        pe.count_by_root = {
+            root: {t: dict(c) for t, c in counts.items()}
+            for root, counts in prev.count_by_root.items()
+        }
+        pe.total_by_pool = {a: dict(b) for a, b in prev.total_by_pool.items()}
+        pe.total_by_root = {a: dict(b) for a, b in prev.total_by_root.items()}
+
+        moved = 0
+        for pool, poolid in pe.pool_id.items():
+            prev_pm = prev.ms.pg_up_by_poolid[poolid]
+            pm = ms.pg_up_by_poolid[poolid]
+            if prev_pm.keys() != pm.keys():
+                return self.calc_eval(ms, pools)
+            for pgid, up in pm.items():
+                prev_up = prev_pm[pgid]
+                if up != prev_up:
+                    self._count_pg(pe, ms, pool, pgid, prev_up, -1)
+                    self._count_pg(pe, ms, pool, pgid, up, 1)
+                    moved += 1
+        self.log.debug('%d PGs moved since the last evaluation', moved)
+        return self._calc_scores(pe)
+
+    def _count_pg(self,
+                  pe: Eval,
+                  ms: MappingState,
+                  pool: str,
+                  pgid: str,
+                  up: List[int],
+                  sign: int) -> None:
+        # add (or remove, with a negative sign) a PG's up set to the
+        # counts, the same way _count_pool does
+        stat = ms.pg_stat[pgid]
+        inc = {
+            'pgs': sign,
+            'objects': sign * stat['num_objects'],
+            'bytes': sign * stat['num_bytes'],
+        }
+        counts = pe.count_by_pool[pool]
+        for osd in [int(osd) for osd in up]:
+            if osd == CRUSHMap.ITEM_NONE:
+                continue
+            for t, n in inc.items():
+                counts[t][osd] = counts[t].get(osd, 0) + n
+            if counts['pgs'][osd] == 0:
+                for t in inc:
+                    del counts[t][osd]
+            for root in pe.pool_roots[pool]:
+                if osd in pe.target_by_root[root]:
+                    for t, n in inc.items():
+                        pe.count_by_root[root][t][osd] += n
+                        pe.total_by_pool[pool][t] += n
+                        pe.total_by_root[root][t] += n
+                    break
+
     def evaluate(self, ms: MappingState, pools: List[str], verbose: bool = False) -> str:
         pe = self.calc_eval(ms, pools)
         return pe.show(verbose=verbose)
@@ -963,7 +1172,7 @@ class Module(MgrModule):
 
     def do_upmap(self, plan: Plan) -> Tuple[int, str]:
         self.log.info('do_upmap')
-        max_optimizations = cast(float, self.get_module_option('upmap_max_optimizations'))
+        max_optimizations = cast(int, self.get_module_option('upmap_max_optimizations'))
         max_deviation = cast(int, self.get_module_option('upmap_max_deviation'))
         osdmap_dump = plan.osdmap_dump
 
@@ -980,9 +1189,6 @@ class Module(MgrModule):
         self.log.info('pools %s' % pools)
 
         adjusted_pools = []
-        inc = plan.inc
-        total_did = 0
-        left = max_optimizations
         pools_with_pg_merge = [p['pool_name'] for p in osdmap_dump.get('pools', [])
                                if p['pg_num'] > p['pg_num_target']]
         crush_rule_by_pool_name = dict((p['pool_name'], p['crush_rule'])
@@ -997,8 +1203,133 @@ class Module(MgrModule):
             adjusted_pools.append(pool)
         # shuffle so all pools get equal (in)attention
         random.shuffle(adjusted_pools)
-        pool_dump = osdmap_dump.get('pools', [])
-        for pool in adjusted_pools:
+
+        # pools under roots that share no OSDs are optimized in parallel,
+        # each into its own incremental
+        partitions = self._upmap_partitions(plan.osdmap, osdmap_dump, adjusted_pools)
+        if not partitions:
+            return -errno.EALREADY, 'Unable to find further optimization, ' \
+                                    'or pool(s) pg_num is decreasing, ' \
+                                    'or distribution is already perfect'
+
+        # per partition: the map it is optimized on, and the changes and
+        # time spent so far
+        osdmaps: List[Optional['OSDMap']] = [None] * len(partitions)
+        incs: List[Optional['OSDMapIncremental']] = [None] * len(partitions)
+        changes = [0] * len(partitions)
+        durations = [0.0] * len(partitions)
+        # the budget is split evenly between the partitions; what is left
+        # over by those which run out of work goes to those which used up
+        # their share, in further rounds
+        left = max_optimizations
+        wanting = list(range(len(partitions)))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(partitions)) as executor:
+            while wanting and left > 0:
+                budgets = [left // len(wanting)] * len(wanting)
+                for i in range(left % len(wanting)):
+                    budgets[i] += 1
+                futures = {
+                    i: (budget, executor.submit(self._do_upmap_partition, plan,
+                                                osdmaps[i], incs[i], len(partitions) > 1,
+                                                partitions[i][1], max_deviation, budget))
+                    for i, budget in zip(wanting, budgets) if budget > 0
+                }
+                wanting = [i for i, budget in zip(wanting, budgets) if budget == 0]
+                for i, (budget, future) in futures.items():
+                    osdmaps[i], incs[i], did, duration = future.result()
+                    plan.inc.merge_upmaps(incs[i])
+                    changes[i] += did
+                    durations[i] += duration
+                    left -= did
+                    if did >= budget:
+                        wanting.append(i)
+
+        total_did = 0
+        self.last_optimize_partitions = []
+        for (roots, pools), did, duration in zip(partitions, changes, durations):
+            total_did += did
+            self.last_optimize_partitions.append({
+                'roots': roots,
+                'pools': pools,
+                'changes': did,
+                'duration': str(datetime.timedelta(seconds=duration)),
+            })
+            self.log.info('roots %s pools %s: prepared %d changes in %fs',
+                          roots, pools, did, duration)
+        self.log.info('prepared %d/%d changes' % (total_did, max_optimizations))
+        if total_did == 0:
+            return -errno.EALREADY, 'Unable to find further optimization, ' \
+                                    'or pool(s) pg_num is decreasing, ' \
+                                    'or distribution is already perfect'
+        return 0, ''
+
+    def _upmap_partitions(self,
+                          osdmap: OSDMap,
+                          osdmap_dump: Dict[str, Any],
+                          pools: List[str]) -> List[Tuple[List[str], List[str]]]:
+        """
+        Group pools so that no two groups map to a common OSD.
+
+        :return: a list of (root names, pool names)
+        """
+        crush = osdmap.get_crush()
+        pool_ids = {p['pool']: p['pool_name'] for p in osdmap_dump.get('pools', [])}
+        # pool name -> osds and roots it maps to
+        pool_osds: Dict[str, set] = {pool: set() for pool in pools}
+        pool_roots: Dict[str, List[str]] = {pool: [] for pool in pools}
+        for take in crush.find_takes():
+            osds = set(crush.get_take_weight_osd_map(take))
+            root = crush.get_item_name(take) or str(take)
+            for pool_id in osdmap.get_pools_by_take(take):
+                pool = pool_ids.get(pool_id)
+                if pool is not None and pool in pool_osds:
+                    pool_osds[pool] |= osds
+                    pool_roots[pool].append(root)
+
+        partitions: List[Tuple[List[str], List[str], set]] = []
+        for pool in pools:
+            roots = list(pool_roots[pool])
+            members = [pool]
+            osds = set(pool_osds[pool])
+            for other in [p for p in partitions if p[2] & osds]:
+                partitions.remove(other)
+                roots += [r for r in other[0] if r not in roots]
+                members += other[1]
+                osds |= other[2]
+            partitions.append((roots, members, osds))
+        return [(roots, members) for roots, members, _ in partitions]
+
+    def _do_upmap_partition(self,
+                            plan: Plan,
+                            osdmap: Optional['OSDMap'],
+                            prev_inc: Optional['OSDMapIncremental'],
+                            parallel: bool,
+                            pools: List[str],
+                            max_deviation: int,
+                            max_optimizations: int
+                            ) -> Tuple['OSDMap', 'OSDMapIncremental', int, float]:
+        """
+        Optimize the given pools on ``osdmap`` with the changes of the
+        previous round, ``prev_inc``, applied, or on the map of the plan.
+        Threads optimizing in parallel each need their own copy of the map,
+        as calc_pg_upmaps() uses the CRUSH map without locking.
+
+        :return: the map, the changes, the number of changes, and the time
+            it took
+        """
+        start = time.monotonic()
+        if osdmap is None:
+            osdmap = plan.osdmap.copy() if parallel else plan.osdmap
+        if prev_inc is not None:
+            osdmap = osdmap.apply_incremental(prev_inc)
+        inc = osdmap.new_incremental()
+        total_did = 0
+        left = max_optimizations
+        pool_dump = plan.osdmap_dump.get('pools', [])
+        for pool in pools:
+            if left <= 0:
+                break
             for p in pool_dump:
                 if p['pool_name'] == pool:
                     pool_id = p['pool']
@@ -1016,17 +1347,11 @@ class Module(MgrModule):
                         num_pg_active_clean += s['count']
                         break
             available = min(left, num_pg_active_clean)
-            did = plan.osdmap.calc_pg_upmaps(inc, max_deviation, available, [pool])
+            # calc_pg_upmaps() drops the GIL while it works
+            did = osdmap.calc_pg_upmaps(inc, max_deviation, available, [pool])
             total_did += did
             left -= did
-            if left <= 0:
-                break
-        self.log.info('prepared %d/%d changes' % (total_did, max_optimizations))
-        if total_did == 0:
-            return -errno.EALREADY, 'Unable to find further optimization, ' \
-                                    'or pool(s) pg_num is decreasing, ' \
-                                    'or distribution is already perfect'
-        return 0, ''
+        return osdmap, inc, total_did, time.monotonic() - start
 
     def do_crush_compat(self, plan: MsPlan) -> Tuple[int, str]:
         self.log.info('do_crush_compat')
@@ -1090,13 +1415,16 @@ class Module(MgrModule):
             key = 'pgs'
 
         # go
-        best_ws = copy.deepcopy(orig_ws)
-        best_ow = copy.deepcopy(orig_osd_weight)
+        # (the weight maps are flat, so copying them is enough)
+        best_ws = dict(orig_ws)
+        best_ow = dict(orig_osd_weight)
         best_pe = pe
+        # the last evaluated state, which the next one is evaluated against
+        last_pe = pe
         left = max_iterations
         bad_steps = 0
-        next_ws = copy.deepcopy(best_ws)
-        next_ow = copy.deepcopy(best_ow)
+        next_ws = dict(best_ws)
+        next_ow = dict(best_ow)
         while left > 0:
             # adjust
             self.log.debug('best_ws %s' % best_ws)
@@ -1162,9 +1490,10 @@ class Module(MgrModule):
                         next_ws[osd] = next_ws[osd] / factor
 
             # recalc
-            plan.compat_ws = copy.deepcopy(next_ws)
+            plan.compat_ws = dict(next_ws)
             next_ms = plan.final_state()
-            next_pe = self.calc_eval(next_ms, plan.pools)
+            next_pe = self.calc_eval_update(last_pe, next_ms, plan.pools)
+            last_pe = next_pe
             next_misplaced = next_ms.calc_misplaced_from(ms)
             self.log.debug('Step result score %f -> %f, misplacing %f',
                            best_pe.score, next_pe.score, next_misplaced)
@@ -1175,8 +1504,8 @@ class Module(MgrModule):
                                    next_misplaced, max_misplaced)
                     break
                 step /= 2.0
-                next_ws = copy.deepcopy(best_ws)
-                next_ow = copy.deepcopy(best_ow)
+                next_ws = dict(best_ws)
+                next_ow = dict(best_ow)
                 self.log.debug('Step misplaced %f > max %f, reducing step to %f',
                                next_misplaced, max_misplaced, step)
             else:
@@ -1186,15 +1515,15 @@ class Module(MgrModule):
                         self.log.debug('Score got worse, taking another step')
                     else:
                         step /= 2.0
-                        next_ws = copy.deepcopy(best_ws)
-                        next_ow = copy.deepcopy(best_ow)
+                        next_ws = dict(best_ws)
+                        next_ow = dict(best_ow)
                         self.log.debug('Score got worse, trying smaller step %f',
                                        step)
                 else:
                     bad_steps = 0
                     best_pe = next_pe
-                    best_ws = copy.deepcopy(next_ws)
-                    best_ow = copy.deepcopy(next_ow)
+                    best_ws = dict(next_ws)
+                    best_ow = dict(next_ow)
                     if best_pe.score == 0:
                         break
             left -= 1
@@ -1290,12 +1619,10 @@ class Module(MgrModule):
             ms_plan = cast(MsPlan, plan)
             if not CRUSHMap.have_default_choose_args(ms_plan.initial.crush_dump):
                 self.log.debug('ceph osd crush weight-set create-compat')
-                result = CommandResult('')
-                self.send_command(result, 'mon', '', json.dumps({
+                r, outb, outs = self.mon_command({
                     'prefix': 'osd crush weight-set create-compat',
                     'format': 'json',
-                }), '')
-                r, outb, outs = result.wait()
+                })
                 if r != 0:
                     self.log.error('Error creating compat weight-set')
                     return r, outs
@@ -1303,14 +1630,12 @@ class Module(MgrModule):
         for osd, weight in plan.compat_ws.items():
             self.log.info('ceph osd crush weight-set reweight-compat osd.%d %f',
                           osd, weight)
-            result = CommandResult('')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd crush weight-set reweight-compat',
                 'format': 'json',
                 'item': 'osd.%d' % osd,
                 'weight': [weight],
-            }), '')
-            commands.append(result)
+            })
 
         # new_weight
         reweightn = {}
@@ -1318,37 +1643,31 @@ class Module(MgrModule):
             reweightn[str(osd)] = str(int(weight * float(0x10000)))
         if len(reweightn):
             self.log.info('ceph osd reweightn %s', reweightn)
-            result = CommandResult('')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd reweightn',
                 'format': 'json',
                 'weights': json.dumps(reweightn),
-            }), '')
-            commands.append(result)
+            })
 
         # upmap
         incdump = plan.inc.dump()
         for item in incdump.get('new_pg_upmap', []):
             self.log.info('ceph osd pg-upmap %s mappings %s', item['pgid'],
                           item['osds'])
-            result = CommandResult('foo')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd pg-upmap',
                 'format': 'json',
                 'pgid': item['pgid'],
                 'id': item['osds'],
-            }), 'foo')
-            commands.append(result)
+            })
 
         for pgid in incdump.get('old_pg_upmap', []):
             self.log.info('ceph osd rm-pg-upmap %s', pgid)
-            result = CommandResult('foo')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd rm-pg-upmap',
                 'format': 'json',
                 'pgid': pgid,
-            }), 'foo')
-            commands.append(result)
+            })
 
         for item in incdump.get('new_pg_upmap_items', []):
             self.log.info('ceph osd pg-upmap-items %s mappings %s', item['pgid'],
@@ -1356,29 +1675,24 @@ class Module(MgrModule):
             osdlist = []
             for m in item['mappings']:
                 osdlist += [m['from'], m['to']]
-            result = CommandResult('foo')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd pg-upmap-items',
                 'format': 'json',
                 'pgid': item['pgid'],
                 'id': osdlist,
-            }), 'foo')
-            commands.append(result)
+            })
 
         for pgid in incdump.get('old_pg_upmap_items', []):
             self.log.info('ceph osd rm-pg-upmap-items %s', pgid)
-            result = CommandResult('foo')
-            self.send_command(result, 'mon', '', json.dumps({
+            commands.append({
                 'prefix': 'osd rm-pg-upmap-items',
                 'format': 'json',
                 'pgid': pgid,
-            }), 'foo')
-            commands.append(result)
+            })
 
-        # wait for commands
+        # the commands don't depend on each other, send them concurrently
         self.log.debug('commands %s' % commands)
-        for result in commands:
-            r, outb, outs = result.wait()
+        for r, outb, outs in self.mon_commands_batch(commands):
             if r != 0:
                 self.log.error('execute error: r = %d, detail = %s' % (r, outs))
                 return r, outs
@@ -0,0 +1,287 @@
+import os
+import random
+import time
+
+import pytest
+
+from tests import mock
+
+from balancer import module
+from mgr_module import CRUSHMap
+
+
+class FakeCRUSHMap:
+    def __init__(self, roots):
+        # root id -> (name, {osd: crush weight})
+        self._roots = roots
+
+    def dump(self):
+        return {}
+
+    def find_takes(self):
+        return list(self._roots)
+
+    def get_item_name(self, item):
+        return self._roots[item][0]
+
+    def get_take_weight_osd_map(self, root):
+        return self._roots[root][1]
+
+
+class FakeOSDMap:
+    """
+    Just enough of an OSDMap for MappingState and calc_eval.
+    """
+
+    def __init__(self, osd_weights, roots, pools):
+        # pools: pool id -> (crush root id, {pgid: up set})
+        self._osd_weights = osd_weights
+        self._crush = FakeCRUSHMap(roots)
+        self._pools = pools
+
+    def dump(self):
+        return {
+            'osds': [{'osd': o, 'weight': w} for o, w in self._osd_weights.items()],
+            'pools': [{'pool': p, 'pool_name': 'pool%d' % p, 'crush_rule': 0}
+                      for p in self._pools],
+        }
+
+    def get_crush(self):
+        return self._crush
+
+    def get_pools_by_take(self, take):
+        return [p for p, (root, _) in self._pools.items() if root == take]
+
+    def map_pool_pgs_up(self, poolid):
+        return self._pools[poolid][1]
+
+    def new_incremental(self):
+        return mock.Mock()
+
+    def copy(self):
+        return FakeOSDMap(self._osd_weights, self._crush._roots, self._pools)
+
+    def apply_incremental(self, inc):
+        return self.copy()
+
+    def calc_pg_upmaps(self, inc, max_deviation, max_iterations, pools):
+        inc.calls.append((pools, max_iterations))
+        return min(max_iterations, 3)
+
+
+def synthetic_mapping(num_osd, pg_num, num_pools=1, size=3, seed=0):
+    """
+    Build a MappingState of ``num_pools`` pools of ``pg_num`` PGs each,
+    spread randomly over ``num_osd`` OSDs, the way OSDMap.build_simple()
+    would lay out a single-root cluster.
+    """
+    rng = random.Random(seed)
+    osds = list(range(num_osd))
+    roots = {-1: ('default', {o: 1.0 for o in osds})}
+    pools = {}
+    pg_stats = []
+    for poolid in range(1, num_pools + 1):
+        pm = {}
+        for ps in range(pg_num):
+            pgid = '%d.%x' % (poolid, ps)
+            pm[pgid] = rng.sample(osds, size)
+            objects = rng.randint(0, 1000)
+            pg_stats.append({
+                'pgid': pgid,
+                'stat_sum': {'num_objects': objects, 'num_bytes': objects * 4096},
+            })
+        pools[poolid] = (-1, pm)
+    osdmap = FakeOSDMap({o: 1.0 for o in osds}, roots, pools)
+    return module.MappingState(
+        osdmap,
+        {'pg_stats': pg_stats},
+        {'pool_stats': [{'poolid': p} for p in pools]})
+
+
+@pytest.fixture
+def balancer():
+    with mock.patch('balancer.module.Module._configure_logging'):
+        m = module.Module('balancer', 0, 0)
+    m.get_module_option = mock.Mock(return_value='pgs,objects,bytes')
+    return m
+
+
+def make_mapping(moves=None):
+    none = CRUSHMap.ITEM_NONE
+    # osd.3 is out; osd.4 and osd.5 are under a second root, which osd.2
+    # is also part of
+    roots = {
+        -1: ('default', {0: 1.0, 1: 2.0, 2: 1.0, 3: 1.0}),
+        -2: ('ssd', {2: 1.0, 4: 1.0, 5: 0.5}),
+    }
+    pools = {
+        1: (-1, {'1.0': [0, 1, 2], '1.1': [1, 2, 3], '1.2': [2, 0, none],
+                 '1.3': [1, 0, 2]}),
+        2: (-2, {'2.0': [4, 5, 2], '2.1': [5, none, 4]}),
+    }
+    for pgid, up in (moves or {}).items():
+        pools[int(pgid.split('.')[0])][1][pgid] = up
+    sums = {'1.0': 10, '1.1': 0, '1.2': 7, '1.3': 3, '2.0': 100, '2.1': 1}
+    osdmap = FakeOSDMap({0: 1.0, 1: 1.0, 2: 0.5, 3: 0.0, 4: 1.0, 5: 1.0},
+                        roots, pools)
+    return module.MappingState(
+        osdmap,
+        {'pg_stats': [{'pgid': pgid, 'stat_sum': {'num_objects': n, 'num_bytes': n * 100}}
+                      for pgid, n in sums.items()]},
+        {'pool_stats': [{'poolid': p} for p in pools]})
+
+
+@pytest.fixture
+def mapping():
+    return make_mapping()
+
+
+def evaluate(balancer, ms, use_numpy):
+    np = module.np if use_numpy else None
+    with mock.patch('balancer.module.np', np):
+        return balancer.calc_eval(ms, [])
+
+
+def test_calc_eval(balancer, mapping):
+    pe = evaluate(balancer, mapping, False)
+    assert pe.count_by_pool['pool1']['pgs'] == {0: 3, 1: 3, 2: 4, 3: 1}
+    assert pe.count_by_pool['pool2']['objects'] == {2: 100, 4: 101, 5: 101}
+    # osd.3 is out, so it is not part of any root
+    assert pe.total_by_pool['pool1'] == {'pgs': 10, 'objects': 53, 'bytes': 5300}
+    assert pe.total_by_root['ssd'] == {'pgs': 5, 'objects': 302, 'bytes': 30200}
+    assert 0 < pe.score < 1
+
+
+def test_calc_eval_numpy(balancer, mapping):
+    pytest.importorskip('numpy')
+    expected = evaluate(balancer, mapping, False)
+    pe = evaluate(balancer, mapping, True)
+    assert pe.count_by_pool == expected.count_by_pool
+    assert pe.total_by_pool == expected.total_by_pool
+    assert pe.total_by_root == expected.total_by_root
+    assert pe.count_by_root == expected.count_by_root
+    assert pe.actual_by_root == expected.actual_by_root
+    for root, stats in expected.stats_by_root.items():
+        for t, v in stats.items():
+            assert pe.stats_by_root[root][t] == pytest.approx(v)
+    assert pe.score == pytest.approx(expected.score)
+
+    ms = synthetic_mapping(20, 256, num_pools=2)
+    assert evaluate(balancer, ms, True).score == \
+        pytest.approx(evaluate(balancer, ms, False).score)
+
+
+@pytest.mark.parametrize('moves', [
+    {},
+    {'1.0': [0, 1, 3], '2.1': [5, 2, 4]},
+    {'1.1': [0, 1, 2], '1.2': [1, 0, 2], '1.3': [0, 2, CRUSHMap.ITEM_NONE]},
+])
+def test_calc_eval_update(balancer, mapping, moves):
+    prev = balancer.calc_eval(mapping, [])
+    ms = make_mapping(moves)
+    expected = balancer.calc_eval(ms, [])
+    pe = balancer.calc_eval_update(prev, ms, [])
+    assert pe.count_by_pool == expected.count_by_pool
+    assert pe.count_by_root == expected.count_by_root
+    assert pe.total_by_pool == expected.total_by_pool
+    assert pe.total_by_root == expected.total_by_root
+    assert pe.score == pytest.approx(expected.score)
+    # prev is left alone
+    assert prev.count_by_pool == balancer.calc_eval(mapping, []).count_by_pool
+
+
+def test_upmap_partitions(balancer):
+    roots = {
+        -1: ('default', {0: 1.0, 1: 1.0}),
+        -2: ('ssd', {2: 1.0, 3: 1.0}),
+        -3: ('nvme', {4: 1.0}),
+        -4: ('mixed', {1: 1.0, 2: 1.0}),
+    }
+    pools = {1: (-1, {}), 2: (-2, {}), 3: (-3, {}), 4: (-1, {}), 5: (-4, {})}
+    osdmap = FakeOSDMap({o: 1.0 for o in range(5)}, roots, pools)
+    partitions = balancer._upmap_partitions(osdmap, osdmap.dump(),
+                                            ['pool1', 'pool2', 'pool3', 'pool4'])
+    assert sorted((sorted(r), sorted(p)) for r, p in partitions) == [
+        (['default'], ['pool1', 'pool4']),
+        (['nvme'], ['pool3']),
+        (['ssd'], ['pool2']),
+    ]
+    # a pool spanning two roots joins them
+    partitions = balancer._upmap_partitions(osdmap, osdmap.dump(),
+                                            ['pool1', 'pool2', 'pool3', 'pool5'])
+    assert sorted((sorted(r), sorted(p)) for r, p in partitions) == [
+        (['default', 'mixed', 'ssd'], ['pool1', 'pool2', 'pool5']),
+        (['nvme'], ['pool3']),
+    ]
+
+
+def test_do_upmap(balancer):
+    roots = {
+        -1: ('hdd', {0: 1.0, 1: 1.0}),
+        -2: ('nvme', {2: 1.0, 3: 1.0}),
+    }
+    pools = {1: (-1, {}), 2: (-2, {}), 3: (-1, {})}
+    osdmap = FakeOSDMap({o: 1.0 for o in range(4)}, roots, pools)
+    plan = module.Plan('plan', 'upmap', osdmap, [])
+    plan.pg_status = {
+        'pgs_by_pool_state': [
+            {'pool_id': p, 'pg_state_counts': [{'state_name': 'active+clean', 'count': 32}]}
+            for p in pools
+        ]
+    }
+    options = {'upmap_max_optimizations': 10, 'upmap_max_deviation': 1}
+    balancer.get_module_option = mock.Mock(side_effect=options.get)
+    with mock.patch.object(FakeOSDMap, 'dump', lambda self: {
+            'pools': [{'pool': p, 'pool_name': 'pool%d' % p, 'crush_rule': 0,
+                       'pg_num': 32, 'pg_num_target': 32} for p in pools]}):
+        plan.osdmap_dump = osdmap.dump()
+        incs = []
+        maps = []
+        calc_pg_upmaps = FakeOSDMap.calc_pg_upmaps
+
+        def new_incremental(self):
+            incs.append(mock.Mock(calls=[]))
+            return incs[-1]
+
+        def record_calc_pg_upmaps(self, *args):
+            maps.append(self)
+            return calc_pg_upmaps(self, *args)
+
+        with mock.patch.object(FakeOSDMap, 'new_incremental', new_incremental), \
+                mock.patch.object(FakeOSDMap, 'calc_pg_upmaps', record_calc_pg_upmaps):
+            assert balancer.do_upmap(plan) == (0, '')
+
+    # each root is optimized on its own copy of the map
+    assert osdmap not in maps
+    assert len(set(map(id, maps))) >= 2
+    # one incremental per root and round, each merged into the plan
+    assert len(incs) == 3
+    merged = [c[0][0] for c in plan.inc.merge_upmaps.call_args_list]
+    assert sorted(map(id, merged)) == sorted(map(id, incs))
+    by_root = {p['roots'][0]: p for p in balancer.last_optimize_partitions}
+    assert sorted(by_root['hdd']['pools']) == ['pool1', 'pool3']
+    assert by_root['nvme']['pools'] == ['pool2']
+    # the budget is split between the two, and what nvme doesn't need
+    # goes to hdd in a second round
+    assert by_root['nvme']['changes'] == 3
+    assert by_root['hdd']['changes'] == 7
+
+
+@pytest.mark.skipif(not os.environ.get('BALANCER_BENCHMARK'),
+                    reason='set BALANCER_BENCHMARK to run')
+@pytest.mark.parametrize('num_osd,pg_num', [(100, 4096), (1000, 32768), (4000, 131072)])
+def test_calc_eval_benchmark(balancer, num_osd, pg_num):
+    """
+    Run it with
+
+        BALANCER_BENCHMARK=1 pytest -s balancer/tests -k benchmark
+    """
+    pytest.importorskip('numpy')
+    ms = synthetic_mapping(num_osd, pg_num)
+    timings = {}
+    for use_numpy in (False, True):
+        start = time.perf_counter()
+        evaluate(balancer, ms, use_numpy)
+        timings[use_numpy] = time.perf_counter() - start
+    print('\n%d osds %d pgs: python %.3fs numpy %.3fs' %
+          (num_osd, pg_num, timings[False], timings[True]))
@@ -16,10 +16,13 @@ class BasePyOSDMap(object):
     def _dump(self):...
     def _new_incremental(self):...
     def _apply_incremental(self, inc: 'BasePyOSDMapIncremental'):...
+    def _copy(self):...
+    def _diff(self, other: 'BasePyOSDMap') -> Dict[str, Any]:...
     def _get_crush(self):...
     def _get_pools_by_take(self, take):...
     def _calc_pg_upmaps(self, inc, max_deviation, max_iterations, pool):...
     def _map_pool_pgs_up(self, poolid):...
+    def _map_pool_pgs_moved(self, other: 'BasePyOSDMap', poolid: int, osd: int) -> List[int]:...
     def _pg_to_up_acting_osds(self, pool_id, ps):...
     def _pool_raw_used_rate(self, pool_id):...
     @classmethod
@@ -30,6 +33,7 @@ class BasePyOSDMapIncremental(object):
     def _dump(self):...
     def _set_osd_reweights(self, weightmap):...
     def _set_crush_compat_weight_set_weights(self, weightmap):...
+    def _merge_upmaps(self, other: 'BasePyOSDMapIncremental') -> None:...
 
 class BasePyCRUSH(object):
     def _dump(self):...
@@ -70,6 +74,7 @@ class BaseMgrModule(object):
     def _ceph_get(self, data_name: str) -> Any: ...
     def _ceph_get_server(self, hostname: Optional[str]) -> Union[ServerInfoT,
                                                                  List[ServerInfoT]]: ...
+    def _ceph_get_latest_counters(self, svc_type: str, svc_name: str, paths: Sequence[str]) -> Tuple[List[int], List[int]]: ...
     def _ceph_get_perf_schema(self, svc_type: str, svc_name: str) -> Dict[str, Any]: ...
     def _ceph_get_rocksdb_version(self) -> str: ...
     def _ceph_get_counter(self, svc_type: str, svc_name: str, path: str) -> Dict[str, List[Tuple[float, int]]]: ...
@@ -95,6 +100,8 @@ class BaseMgrModule(object):
     def _ceph_get_store_prefix(self, key_prefix) -> Dict[str, str]: ...
     def _ceph_set_module_option(self, module: str, key: str, val: Optional[str]) -> None: ...
     def _ceph_set_store(self, key: str, val: Optional[str]) -> None: ...
+    def _ceph_set_store_batch(self, ops: List[Tuple[str, Optional[str]]]) -> int: ...
+    def _ceph_get_store_version(self) -> int: ...
     def _ceph_get_store(self, key: str) -> Optional[str]: ...
     # mgr actually imports OSDMap from mgr_module and constructs an OSDMap
     def _ceph_get_osdmap(self) -> BasePyOSDMap: ...
@@ -113,5 +120,6 @@ class BaseMgrModule(object):
     def _ceph_reregister_mds_perf_queries(self) -> None: ...
     def _ceph_get_mds_perf_counters(self, query_id: int) -> Optional[Dict[str, List[PerfCounterT]]]: ...
     def _ceph_unregister_client(self, addrs: str) -> None: ...
+    def _ceph_update_snapshot_cache_metrics(self, hits: int, misses: int) -> None: ...
     def _ceph_register_client(self, addrs: str) -> None: ...
     def _ceph_is_authorized(self, arguments: Dict[str, str]) -> bool: ...
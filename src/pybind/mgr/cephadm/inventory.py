@@ -4,6 +4,8 @@ import ipaddress
 import json
 import logging
 import socket
+import threading
+from contextlib import contextmanager
 from typing import TYPE_CHECKING, Dict, List, Iterator, Optional, Any, Tuple, Set, Mapping, cast, \
     NamedTuple, Type
 
@@ -24,6 +26,8 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 HOST_CACHE_PREFIX = "host."
+HOST_DAEMONS_PREFIX = "host_daemons."
+HOST_DEVICES_PREFIX = "host_devices."
 SPEC_STORE_PREFIX = "spec."
 AGENT_CACHE_PREFIX = 'agent.'
 
@@ -181,6 +185,9 @@ class SpecStore():
         self.spec_created = {}  # type: Dict[str, datetime.datetime]
         self.spec_deleted = {}  # type: Dict[str, datetime.datetime]
         self.spec_preview = {}  # type: Dict[str, ServiceSpec]
+        # specs to be stored by the next flush()
+        self._dirty: Set[str] = set()
+        self._dirty_lock = threading.Lock()
 
     @property
     def all_specs(self) -> Mapping[str, ServiceSpec]:
@@ -265,14 +272,40 @@ class SpecStore():
         if update_create:
             self.spec_created[name] = datetime_now()
         self._save(name)
+        # don't wait for the serve loop: this is what the user asked for
+        self.flush()
 
     def save_rank_map(self,
                       name: str,
                       rank_map: Dict[int, Dict[int, Optional[str]]]) -> None:
         self._rank_maps[name] = rank_map
         self._save(name)
+        # the next mgr relies on it to clean up after a failed update of
+        # the service, so it must be stored before the daemons change
+        self.flush()
 
     def _save(self, name: str) -> None:
+        with self._dirty_lock:
+            self._dirty.add(name)
+        self.mgr.events.for_service(self._specs[name],
+                                    OrchestratorEvent.INFO,
+                                    'service was created')
+
+    def flush(self) -> None:
+        """
+        Store the specs changed since the last flush(), using a single KV
+        store batch.
+        """
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        with self.mgr.store_batch():
+            for name in dirty:
+                if name in self._specs:
+                    self._save_spec(name)
+
+    def _save_spec(self, name: str) -> None:
         data: Dict[str, Any] = {
             'spec': self._specs[name].to_json(),
             'created': datetime_to_str(self.spec_created[name]),
@@ -286,9 +319,6 @@ class SpecStore():
             SPEC_STORE_PREFIX + name,
             json.dumps(data, sort_keys=True),
         )
-        self.mgr.events.for_service(self._specs[name],
-                                    OrchestratorEvent.INFO,
-                                    'service was created')
 
     def rm(self, service_name: str) -> bool:
         if service_name not in self._specs:
@@ -312,6 +342,8 @@ class SpecStore():
             del self.spec_created[service_name]
             if service_name in self.spec_deleted:
                 del self.spec_deleted[service_name]
+            with self._dirty_lock:
+                self._dirty.discard(service_name)
             self.mgr.set_store(SPEC_STORE_PREFIX + service_name, None)
         return found
 
@@ -426,11 +458,20 @@ class HostCache():
     Used to run daemon actions after deploying a daemon. We need to
     store it persistently, in order to stay consistent across
     MGR failovers.
+
+    Within a `batch()` block, `save_host()` only queues a host to be
+    persisted, and the queued hosts are written out together in a single
+    KV store batch when the block exits.  Once migration 6 is done, the
+    daemons and devices of a host are stored under their own keys and are
+    only rewritten if they changed since they were last stored.
     """
 
     def __init__(self, mgr):
         # type: (CephadmOrchestrator) -> None
         self.mgr: CephadmOrchestrator = mgr
+        # daemons are updated both by the serve loop and by the agent
+        # thread; guards the daemon indexes against concurrent updates
+        self._daemons_lock = threading.RLock()
         self.daemons = {}   # type: Dict[str, Dict[str, orchestrator.DaemonDescription]]
         self.last_daemon_update = {}   # type: Dict[str, datetime.datetime]
         self.devices = {}              # type: Dict[str, List[inventory.Device]]
@@ -459,8 +500,81 @@ class HostCache():
 
         self.metadata_up_to_date = {}  # type: Dict[str, bool]
 
+        # host -> parts of the host's state ('host', 'daemons', 'devices')
+        # to be stored by the next flush().  Only hosts queued with
+        # save_host() (i.e. with a 'host' part) are flushed.
+        self._dirty: Dict[str, Set[str]] = {}
+        self._dirty_lock = threading.Lock()
+        # set while a serve loop iteration runs, see batch()
+        self._batching = False
+
+    @property
+    def daemons(self) -> Dict[str, Dict[str, orchestrator.DaemonDescription]]:
+        """
+        host -> daemon name -> DaemonDescription.  Go through
+        update_host_daemons(), add_daemon() and rm_daemon() to change it,
+        so that the daemon indexes stay up to date.
+        """
+        return self._daemons
+
+    @daemons.setter
+    def daemons(self, daemons: Dict[str, Dict[str, orchestrator.DaemonDescription]]) -> None:
+        with self._daemons_lock:
+            self._daemons = daemons
+            # daemon name -> host -> dd
+            self._daemons_by_name: Dict[str, Dict[str, orchestrator.DaemonDescription]] = {}
+            # service name / daemon type -> (host, daemon name) -> dd
+            self._daemons_by_service: Dict[str,
+                                           Dict[Tuple[str, str], orchestrator.DaemonDescription]] = {}
+            self._daemons_by_type: Dict[str,
+                                        Dict[Tuple[str, str], orchestrator.DaemonDescription]] = {}
+            for host, dm in daemons.items():
+                for dd in dm.values():
+                    self._index_daemon(host, dd)
+
+    @staticmethod
+    def _index_keys(dd: orchestrator.DaemonDescription) -> Tuple[str, str]:
+        try:
+            service_name = dd.service_name()
+        except OrchestratorError:
+            service_name = ''
+        return service_name, cast(str, dd.daemon_type)
+
+    def _index_daemon(self, host: str, dd: orchestrator.DaemonDescription) -> None:
+        name = dd.name()
+        service_name, daemon_type = self._index_keys(dd)
+        self._daemons_by_name.setdefault(name, {})[host] = dd
+        self._daemons_by_service.setdefault(service_name, {})[(host, name)] = dd
+        self._daemons_by_type.setdefault(daemon_type, {})[(host, name)] = dd
+
+    def _unindex_daemon(self, host: str, name: str) -> None:
+        dd = self._daemons_by_name[name].pop(host)
+        if not self._daemons_by_name[name]:
+            del self._daemons_by_name[name]
+        service_name, daemon_type = self._index_keys(dd)
+        for index, key in ((self._daemons_by_service, service_name),
+                           (self._daemons_by_type, daemon_type)):
+            del index[key][(host, name)]
+            if not index[key]:
+                del index[key]
+
+    def _set_host_daemons(self, host: str, dm: Dict[str, orchestrator.DaemonDescription]) -> None:
+        with self._daemons_lock:
+            for name in self._daemons.get(host, {}):
+                self._unindex_daemon(host, name)
+            self._daemons[host] = dm
+            for dd in dm.values():
+                self._index_daemon(host, dd)
+
     def load(self):
         # type: () -> None
+        stored_daemons = self.mgr.get_store_prefix(HOST_DAEMONS_PREFIX)
+        stored_devices = self.mgr.get_store_prefix(HOST_DEVICES_PREFIX)
+        for prefix, stored in ((HOST_DAEMONS_PREFIX, stored_daemons),
+                               (HOST_DEVICES_PREFIX, stored_devices)):
+            for k in stored:
+                if k[len(prefix):] not in self.mgr.inventory:
+                    self.mgr.set_store(k, None)
         for k, v in self.mgr.get_store_prefix(HOST_CACHE_PREFIX).items():
             host = k[len(HOST_CACHE_PREFIX):]
             if host not in self.mgr.inventory:
@@ -469,6 +583,16 @@ class HostCache():
                 self.mgr.set_store(k, None)
             try:
                 j = json.loads(v)
+                if 'daemons' in j:
+                    # stored before daemons and devices got their own
+                    # keys: move them there with the next flush()
+                    daemons = j['daemons']
+                    devices = j.get('devices', [])
+                    if host in self.mgr.inventory and self._split_layout():
+                        self._mark_dirty(host, 'host', 'daemons', 'devices')
+                else:
+                    daemons = json.loads(stored_daemons.get(HOST_DAEMONS_PREFIX + host, '{}'))
+                    devices = json.loads(stored_devices.get(HOST_DEVICES_PREFIX + host, '[]'))
                 if 'last_device_update' in j:
                     self.last_device_update[host] = str_to_datetime(j['last_device_update'])
                 else:
@@ -479,16 +603,17 @@ class HostCache():
                 # and always trigger a new scrape on mgr restart.
                 self.daemon_refresh_queue.append(host)
                 self.network_refresh_queue.append(host)
-                self.daemons[host] = {}
+                self._set_host_daemons(host, {})
                 self.osdspec_previews[host] = []
                 self.osdspec_last_applied[host] = {}
                 self.devices[host] = []
                 self.networks[host] = {}
                 self.daemon_config_deps[host] = {}
-                for name, d in j.get('daemons', {}).items():
-                    self.daemons[host][name] = \
-                        orchestrator.DaemonDescription.from_json(d)
-                for d in j.get('devices', []):
+                self._set_host_daemons(host, {
+                    name: orchestrator.DaemonDescription.from_json(d)
+                    for name, d in daemons.items()
+                })
+                for d in devices:
                     self.devices[host].append(inventory.Device.from_json(d))
                 self.networks[host] = j.get('networks_and_interfaces', {})
                 self.osdspec_previews[host] = j.get('osdspec_previews', {})
@@ -519,7 +644,8 @@ class HostCache():
 
     def update_host_daemons(self, host, dm):
         # type: (str, Dict[str, orchestrator.DaemonDescription]) -> None
-        self.daemons[host] = dm
+        self._set_host_daemons(host, dm)
+        self._mark_dirty(host, 'daemons')
         self.last_daemon_update[host] = datetime_now()
 
     def update_host_facts(self, host, facts):
@@ -538,8 +664,9 @@ class HostCache():
         a = self.devices[host]
         if len(a) != len(b):
             return True
-        aj = {d.path: d.to_json() for d in a}
-        bj = {d.path: d.to_json() for d in b}
+        # compare with Device.__eq__, which ignores when the report was created
+        aj = {d.path: d for d in a}
+        bj = {d.path: d for d in b}
         if aj != bj:
             self.mgr.log.info("Detected new or changed devices on %s" % host)
             return True
@@ -556,6 +683,7 @@ class HostCache():
                 or self.devices_changed(host, dls)
         ):
             self.last_device_change[host] = datetime_now()
+            self._mark_dirty(host, 'devices')
         self.last_device_update[host] = datetime_now()
         self.devices[host] = dls
 
@@ -604,8 +732,9 @@ class HostCache():
         """
         Install an empty entry for a host
         """
-        self.daemons[host] = {}
+        self._set_host_daemons(host, {})
         self.devices[host] = []
+        self._mark_dirty(host, 'daemons', 'devices')
         self.networks[host] = {}
         self.osdspec_previews[host] = []
         self.osdspec_last_applied[host] = {}
@@ -652,14 +781,84 @@ class HostCache():
     def distribute_new_registry_login_info(self) -> None:
         self.registry_login_queue = set(self.mgr.inventory.keys())
 
+    def _mark_dirty(self, host: str, *parts: str) -> None:
+        with self._dirty_lock:
+            self._dirty.setdefault(host, set()).update(parts)
+
     def save_host(self, host: str) -> None:
+        """
+        Store the cached state of a host.  Within a batch() block, the host
+        is only queued to be stored when the block exits.
+        """
+        self._mark_dirty(host, 'host')
+        if not self._batching:
+            self.flush()
+
+    def save_all_hosts(self) -> None:
+        """
+        Queue the whole cached state of every host, including its daemons
+        and devices, to be stored by the next flush().
+        """
+        for host in self.mgr.inventory.keys():
+            self._mark_dirty(host, 'host', 'daemons', 'devices')
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Defer storing the saved hosts until the block exits.  The serve
+        loop runs every iteration in such a block: the host refreshes, and
+        any command handled meanwhile, save the same hosts over and over.
+        """
+        self._batching = True
+        try:
+            yield
+        finally:
+            self._batching = False
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Store the state of the hosts queued by save_host() since the last
+        flush(), using a single KV store batch.
+        """
+        with self._dirty_lock:
+            dirty = {host: parts for host, parts in self._dirty.items() if 'host' in parts}
+            for host in dirty:
+                del self._dirty[host]
+        if not dirty:
+            return
+        with self.mgr.store_batch():
+            for host, parts in dirty.items():
+                self._save_host(host, parts)
+
+    def _split_layout(self) -> bool:
+        # mgrs that predate migration 6 only read the daemons and devices
+        # of a host from its host record, see Migrations.migrate_5_6()
+        return self.mgr.migration_current is not None and self.mgr.migration_current >= 6
+
+    def _daemons_to_json(self, host: str) -> Dict[str, Any]:
+        with self._daemons_lock:
+            dm = self.daemons.get(host, {}).copy()
+        return {name: dd.to_json() for name, dd in dm.items()}
+
+    def _devices_to_json(self, host: str) -> List[Dict[str, Any]]:
+        return [d.to_json() for d in self.devices.get(host, [])]
+
+    def _save_host(self, host: str, parts: Set[str]) -> None:
+        split = self._split_layout()
+        if split and 'daemons' in parts:
+            self.mgr.set_store(HOST_DAEMONS_PREFIX + host, json.dumps(self._daemons_to_json(host)))
+        if split and 'devices' in parts:
+            self.mgr.set_store(HOST_DEVICES_PREFIX + host, json.dumps(self._devices_to_json(host)))
+
         j: Dict[str, Any] = {
-            'daemons': {},
-            'devices': [],
             'osdspec_previews': [],
             'osdspec_last_applied': {},
             'daemon_config_deps': {},
         }
+        if not split:
+            j['daemons'] = self._daemons_to_json(host)
+            j['devices'] = self._devices_to_json(host)
         if host in self.last_daemon_update:
             j['last_daemon_update'] = datetime_to_str(self.last_daemon_update[host])
         if host in self.last_device_update:
@@ -668,12 +867,6 @@ class HostCache():
             j['last_network_update'] = datetime_to_str(self.last_network_update[host])
         if host in self.last_device_change:
             j['last_device_change'] = datetime_to_str(self.last_device_change[host])
-        if host in self.daemons:
-            for name, dd in self.daemons[host].items():
-                j['daemons'][name] = dd.to_json()
-        if host in self.devices:
-            for d in self.devices[host]:
-                j['devices'].append(d.to_json())
         if host in self.networks:
             j['networks_and_interfaces'] = self.networks[host]
         if host in self.daemon_config_deps:
@@ -703,7 +896,9 @@ class HostCache():
     def rm_host(self, host):
         # type: (str) -> None
         if host in self.daemons:
-            del self.daemons[host]
+            with self._daemons_lock:
+                self._set_host_daemons(host, {})
+                del self._daemons[host]
         if host in self.devices:
             del self.devices[host]
         if host in self.facts:
@@ -734,7 +929,12 @@ class HostCache():
             del self.scheduled_daemon_actions[host]
         if host in self.last_client_files:
             del self.last_client_files[host]
-        self.mgr.set_store(HOST_CACHE_PREFIX + host, None)
+        with self._dirty_lock:
+            self._dirty.pop(host, None)
+        with self.mgr.store_batch():
+            self.mgr.set_store(HOST_CACHE_PREFIX + host, None)
+            self.mgr.set_store(HOST_DAEMONS_PREFIX + host, None)
+            self.mgr.set_store(HOST_DEVICES_PREFIX + host, None)
 
     def get_hosts(self):
         # type: () -> List[str]
@@ -798,30 +998,30 @@ class HostCache():
         return list(self._get_daemons())
 
     def get_error_daemons(self) -> List[orchestrator.DaemonDescription]:
-        r = []
-        for dd in self._get_daemons():
-            if dd.status is not None and dd.status == orchestrator.DaemonDescriptionStatus.error:
-                r.append(dd)
-        return r
+        # the status changes without going through the cache, so it isn't indexed
+        with self._daemons_lock:
+            dds = [dd for dm in self._daemons_by_name.values() for dd in dm.values()]
+        return [dd for dd in dds if dd.status == orchestrator.DaemonDescriptionStatus.error]
 
     def get_daemons_by_host(self, host: str) -> List[orchestrator.DaemonDescription]:
         return list(self.daemons.get(host, {}).values())
 
     def get_daemon(self, daemon_name: str, host: Optional[str] = None) -> orchestrator.DaemonDescription:
         assert not daemon_name.startswith('ha-rgw.')
-        dds = self.get_daemons_by_host(host) if host else self._get_daemons()
-        for dd in dds:
-            if dd.name() == daemon_name:
-                return dd
+        with self._daemons_lock:
+            dm = self._daemons_by_name.get(daemon_name, {}).copy()
+        if host:
+            if host in dm:
+                return dm[host]
+        elif dm:
+            return next(iter(dm.values()))
 
         raise orchestrator.OrchestratorError(f'Unable to find {daemon_name} daemon(s)')
 
     def has_daemon(self, daemon_name: str, host: Optional[str] = None) -> bool:
-        try:
-            self.get_daemon(daemon_name, host)
-        except orchestrator.OrchestratorError:
-            return False
-        return True
+        with self._daemons_lock:
+            dm = self._daemons_by_name.get(daemon_name, {}).copy()
+        return host in dm if host else bool(dm)
 
     def get_daemons_with_volatile_status(self) -> Iterator[Tuple[str, Dict[str, orchestrator.DaemonDescription]]]:
         def alter(host: str, dd_orig: orchestrator.DaemonDescription) -> orchestrator.DaemonDescription:
@@ -844,14 +1044,19 @@ class HostCache():
         assert not service_name.startswith('keepalived.')
         assert not service_name.startswith('haproxy.')
 
-        return list(dd for dd in self._get_daemons() if dd.service_name() == service_name)
+        with self._daemons_lock:
+            return list(self._daemons_by_service.get(service_name, {}).values())
 
     def get_daemons_by_type(self, service_type: str, host: str = '') -> List[orchestrator.DaemonDescription]:
         assert service_type not in ['keepalived', 'haproxy']
 
-        daemons = self.daemons[host].values() if host else self._get_daemons()
-
-        return [d for d in daemons if d.daemon_type in service_to_daemon_types(service_type)]
+        r = []
+        with self._daemons_lock:
+            for daemon_type in service_to_daemon_types(service_type):
+                for (h, _), dd in self._daemons_by_type.get(daemon_type, {}).items():
+                    if not host or h == host:
+                        r.append(dd)
+        return r
 
     def get_daemon_types(self, hostname: str) -> Set[str]:
         """Provide a list of the types of daemons on the host"""
@@ -1010,14 +1215,22 @@ class HostCache():
     def add_daemon(self, host, dd):
         # type: (str, orchestrator.DaemonDescription) -> None
         assert host in self.daemons
-        self.daemons[host][dd.name()] = dd
+        with self._daemons_lock:
+            if dd.name() in self.daemons[host]:
+                self._unindex_daemon(host, dd.name())
+            self.daemons[host][dd.name()] = dd
+            self._index_daemon(host, dd)
+        self._mark_dirty(host, 'daemons')
 
     def rm_daemon(self, host: str, name: str) -> None:
         assert not name.startswith('ha-rgw.')
 
         if host in self.daemons:
-            if name in self.daemons[host]:
-                del self.daemons[host][name]
+            with self._daemons_lock:
+                if name in self.daemons[host]:
+                    del self.daemons[host][name]
+                    self._unindex_daemon(host, name)
+                    self._mark_dirty(host, 'daemons')
 
     def daemon_cache_filled(self) -> bool:
         """
@@ -12,7 +12,7 @@ from orchestrator import OrchestratorError, DaemonDescription
 if TYPE_CHECKING:
     from .module import CephadmOrchestrator
 
-LAST_MIGRATION = 5
+LAST_MIGRATION = 6
 
 logger = logging.getLogger(__name__)
 
@@ -76,6 +76,10 @@ class Migrations:
             if self.migrate_4_5():
                 self.set(5)
 
+        if self.mgr.migration_current == 5:
+            if self.migrate_5_6():
+                self.set(6)
+
     def migrate_0_1(self) -> bool:
         """
         Migration 0 -> 1
@@ -315,6 +319,21 @@ class Migrations:
             self.mgr.log.info('Done migrating registry login info')
         return True
 
+    def migrate_5_6(self) -> bool:
+        """
+        Migration 5 -> 6
+
+        The daemons and devices of a host move from its host.<host> record
+        to their own host_daemons.<host> and host_devices.<host> keys.
+        Older mgrs only read the host record, so HostCache keeps storing
+        the old layout until this migration is done. An older mgr refuses
+        to run once it sees a migration it doesn't know.
+
+        The hosts are stored in the new layout by the next flush().
+        """
+        self.mgr.cache.save_all_hosts()
+        return True
+
 
 def queue_migrate_nfs_spec(mgr: "CephadmOrchestrator", spec_dict: Dict[Any, Any]) -> None:
     """
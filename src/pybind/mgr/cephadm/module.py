@@ -32,6 +32,7 @@ from cephadm.agent import CherryPyThread, CephadmAgentHelpers
 
 
 from mgr_module import MgrModule, HandleCommandResult, Option, NotifyType
+from mgr_util import LatencyHistogram
 import orchestrator
 from orchestrator.module import to_format, Format
 
@@ -168,6 +169,18 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
             default=10 * 60,
             desc='how frequently to perform a host check',
         ),
+        Option(
+            'max_parallel_host_refreshes',
+            type='int',
+            default=10,
+            desc='max number of hosts refreshed concurrently',
+        ),
+        Option(
+            'host_refresh_timeout',
+            type='secs',
+            default=10 * 60,
+            desc='seconds a host refresh may take before it is given up (0 for no limit)',
+        ),
         Option(
             'mode',
             type='str',
@@ -417,6 +430,8 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
             self.daemon_cache_timeout = 0
             self.facts_cache_timeout = 0
             self.host_check_interval = 0
+            self.max_parallel_host_refreshes = 0
+            self.host_refresh_timeout = 0
             self.max_count_per_host = 0
             self.mode = ''
             self.container_image_base = ''
@@ -515,6 +530,13 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
         # in-memory only.
         self.events = EventStore(self)
         self.offline_hosts: Set[str] = set()
+        # how long the last refresh of each host took
+        self.host_refresh_duration: Dict[str, float] = {}
+        # refresh phase -> latencies, see CephadmServe._refresh_hosts_and_daemons()
+        self.host_refresh_latency: Dict[str, LatencyHistogram] = {
+            phase: LatencyHistogram()
+            for phase in ('host', 'check', 'gather', 'ls', 'facts', 'networks', 'devices')
+        }
 
         self.migration = Migrations(self)
 
@@ -557,6 +579,8 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
         self.offline_watcher.shutdown()
         self.run = False
         self.event.set()
+        # don't lose what an unfinished serve loop iteration saved
+        self.cache.flush()
 
     def _get_cephadm_service(self, service_type: str) -> CephadmService:
         assert service_type in ServiceSpec.KNOWN_SERVICE_TYPES
@@ -830,13 +854,24 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
 
         return True, err, ret
 
+    def get_profile(self) -> Dict[str, Any]:
+        """
+        Add the latencies of host refreshes, in total and by phase, to the
+        profile of the module.
+        """
+        r = super().get_profile()
+        r['host_refresh_latency'] = {
+            phase: h.dump() for phase, h in self.host_refresh_latency.items()
+        }
+        return r
+
     def _validate_and_set_ssh_val(self, what: str, new: Optional[str], old: Optional[str]) -> None:
         self.set_store(what, new)
         self.ssh._reconfig_ssh()
         if self.cache.get_hosts():
             # Can't check anything without hosts
             host = self.cache.get_hosts()[0]
-            r = CephadmServe(self)._check_host(host)
+            r = self.wait_async(CephadmServe(self)._check_host(host))
             if r is not None:
                 # connection failed reset user
                 self.set_store(what, old)
@@ -1508,6 +1543,7 @@ Then run the following:
 
         self.inventory.rm_host(host)
         self.cache.rm_host(host)
+        self.host_refresh_duration.pop(host, None)
         self.ssh.reset_con(host)
         self.event.set()  # refresh stray health check
         self.log.info('Removed host %s' % host)
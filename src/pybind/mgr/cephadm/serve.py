@@ -1,15 +1,18 @@
+import asyncio
 import hashlib
 import json
 import logging
+import time
 import uuid
 from collections import defaultdict
+from contextlib import contextmanager
 from typing import TYPE_CHECKING, Optional, List, cast, Dict, Any, Union, Tuple, Set, \
-    DefaultDict
+    DefaultDict, Callable, Awaitable, Iterator, TypeVar
 
 from ceph.deployment import inventory
 from ceph.deployment.drive_group import DriveGroupSpec
 from ceph.deployment.service_spec import ServiceSpec, CustomContainerSpec, PlacementSpec
-from ceph.utils import datetime_now
+from ceph.utils import datetime_now, str_to_datetime
 
 import orchestrator
 from orchestrator import OrchestratorError, set_exception_subject, OrchestratorEvent, \
@@ -17,9 +20,8 @@ from orchestrator import OrchestratorError, set_exception_subject, OrchestratorE
 from cephadm.services.cephadmservice import CephadmDaemonDeploySpec
 from cephadm.schedule import HostAssignment
 from cephadm.autotune import MemoryAutotuner
-from cephadm.utils import forall_hosts, cephadmNoImage, is_repo_digest, \
+from cephadm.utils import cephadmNoImage, is_repo_digest, \
     CephadmNoImage, CEPH_TYPES, ContainerInspectInfo
-from mgr_module import MonCommandFailed
 from mgr_util import format_bytes
 
 from . import utils
@@ -29,6 +31,8 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
 REQUIRES_POST_ACTIONS = ['grafana', 'iscsi', 'prometheus', 'alertmanager', 'rgw']
 
 
@@ -62,44 +66,44 @@ class CephadmServe:
             self.log.debug("serve loop start")
 
             try:
+                with self.mgr.cache.batch():
+                    self.convert_tags_to_repo_digest()
 
-                self.convert_tags_to_repo_digest()
-
-                # refresh daemons
-                self.log.debug('refreshing hosts and daemons')
-                self._refresh_hosts_and_daemons()
+                    # refresh daemons
+                    self.log.debug('refreshing hosts and daemons')
+                    self._refresh_hosts_and_daemons()
 
-                self._check_for_strays()
+                    self._check_for_strays()
 
-                self._update_paused_health()
+                    self._update_paused_health()
 
-                if self.mgr.need_connect_dashboard_rgw and self.mgr.config_dashboard:
-                    self.mgr.need_connect_dashboard_rgw = False
-                    if 'dashboard' in self.mgr.get('mgr_map')['modules']:
-                        self.log.info('Checking dashboard <-> RGW credentials')
-                        self.mgr.remote('dashboard', 'set_rgw_credentials')
+                    if self.mgr.need_connect_dashboard_rgw and self.mgr.config_dashboard:
+                        self.mgr.need_connect_dashboard_rgw = False
+                        if 'dashboard' in self.mgr.get('mgr_map')['modules']:
+                            self.log.info('Checking dashboard <-> RGW credentials')
+                            self.mgr.remote('dashboard', 'set_rgw_credentials')
 
-                if not self.mgr.paused:
-                    self.mgr.to_remove_osds.process_removal_queue()
+                    if not self.mgr.paused:
+                        self.mgr.to_remove_osds.process_removal_queue()
 
-                    self.mgr.migration.migrate()
-                    if self.mgr.migration.is_migration_ongoing():
-                        continue
+                        self.mgr.migration.migrate()
+                        if self.mgr.migration.is_migration_ongoing():
+                            continue
 
-                    if self._apply_all_services():
-                        continue  # did something, refresh
+                        if self._apply_all_services():
+                            continue  # did something, refresh
 
-                    self._check_daemons()
+                        self._check_daemons()
 
-                    self._purge_deleted_services()
+                        self._purge_deleted_services()
 
-                    self._check_for_moved_osds()
+                        self._check_for_moved_osds()
 
-                    if self.mgr.agent_helpers._handle_use_agent_setting():
-                        continue
+                        if self.mgr.agent_helpers._handle_use_agent_setting():
+                            continue
 
-                    if self.mgr.upgrade.continue_upgrade():
-                        continue
+                        if self.mgr.upgrade.continue_upgrade():
+                            continue
 
             except OrchestratorError as e:
                 if e.event_subject:
@@ -189,19 +193,19 @@ class CephadmServe:
 
         agents_down: List[str] = []
 
-        @forall_hosts
-        def refresh(host: str) -> None:
+        async def refresh(host: str) -> None:
 
             # skip hosts that are in maintenance - they could be powered off
             if self.mgr.inventory._inventory[host].get("status", "").lower() == "maintenance":
                 return
 
             if self.mgr.use_agent:
-                if self.mgr.agent_helpers._check_agent(host):
+                if await self._run_sync(self.mgr.agent_helpers._check_agent, host):
                     agents_down.append(host)
 
             if self.mgr.cache.host_needs_check(host):
-                r = self._check_host(host)
+                with self._timed_phase('check'):
+                    r = await self._check_host(host)
                 if r is not None:
                     bad_hosts.append(r)
 
@@ -210,48 +214,29 @@ class CephadmServe:
                 or host not in [h.hostname for h in self.mgr.cache.get_non_draining_hosts()]
                 or host in agents_down
             ):
-                if self.mgr.cache.host_needs_daemon_refresh(host):
-                    self.log.debug('refreshing %s daemons' % host)
-                    r = self._refresh_host_daemons(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_facts_refresh(host):
-                    self.log.debug(('Refreshing %s facts' % host))
-                    r = self._refresh_facts(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_network_refresh(host):
-                    self.log.debug(('Refreshing %s networks' % host))
-                    r = self._refresh_host_networks(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_device_refresh(host):
-                    self.log.debug('refreshing %s devices' % host)
-                    r = self._refresh_host_devices(host)
-                    if r:
-                        failures.append(r)
+                probes = [probe for probe, due in [
+                    ('ls', self.mgr.cache.host_needs_daemon_refresh(host)),
+                    ('facts', self.mgr.cache.host_needs_facts_refresh(host)),
+                    ('networks', self.mgr.cache.host_needs_network_refresh(host)),
+                    ('devices', self.mgr.cache.host_needs_device_refresh(host)),
+                ] if due]
+                failures.extend(await self._refresh_host_probes(host, probes))
                 self.mgr.cache.metadata_up_to_date[host] = True
             elif not self.mgr.cache.get_daemons_by_type('agent', host=host):
                 if self.mgr.cache.host_needs_daemon_refresh(host):
-                    self.log.debug('refreshing %s daemons' % host)
-                    r = self._refresh_host_daemons(host)
-                    if r:
-                        failures.append(r)
+                    failures.extend(await self._refresh_host_probes(host, ['ls']))
                 self.mgr.cache.metadata_up_to_date[host] = True
 
             if self.mgr.cache.host_needs_registry_login(host) and self.mgr.get_store('registry_credentials'):
                 self.log.debug(f"Logging `{host}` into custom registry")
-                r = self.mgr.wait_async(self._registry_login(
-                    host, json.loads(str(self.mgr.get_store('registry_credentials')))))
+                r = await self._registry_login(
+                    host, json.loads(str(self.mgr.get_store('registry_credentials'))))
                 if r:
                     bad_hosts.append(r)
 
             if self.mgr.cache.host_needs_osdspec_preview_refresh(host):
                 self.log.debug(f"refreshing OSDSpec previews for {host}")
-                r = self._refresh_host_osdspec_previews(host)
+                r = await self._run_sync(self._refresh_host_osdspec_previews, host)
                 if r:
                     failures.append(r)
 
@@ -260,11 +245,14 @@ class CephadmServe:
                     and not self.mgr.inventory.has_label(host, '_no_autotune_memory')
             ):
                 self.log.debug(f"autotuning memory for {host}")
-                self._autotune_host_memory(host)
+                await self._run_sync(self._autotune_host_memory, host)
 
-            self._write_client_files(client_files, host)
+            await self._run_sync(self._write_client_files, client_files, host)
 
-        refresh(self.mgr.cache.get_hosts())
+        timed_out = self.mgr.wait_async(self._refresh_hosts(self.mgr.cache.get_hosts(), refresh))
+        for host in timed_out:
+            failures.append(f'host {host} refresh did not finish within '
+                            f'{self.mgr.host_refresh_timeout} seconds')
 
         self.mgr.agent_helpers._update_agent_down_healthcheck(agents_down)
 
@@ -283,15 +271,142 @@ class CephadmServe:
                 'CEPHADM_REFRESH_FAILED', 'failed to probe daemons or devices', len(failures), failures)
         self.mgr.update_failed_daemon_health_check()
 
-    def _check_host(self, host: str) -> Optional[str]:
+    async def _refresh_hosts(self,
+                             hosts: List[str],
+                             refresh: Callable[[str], Awaitable[None]]) -> List[str]:
+        """
+        Run refresh() for all hosts on the event loop, at most
+        `max_parallel_host_refreshes` at a time.  Hosts that are offline or
+        were slow to refresh last time go last, and each host gets
+        `host_refresh_timeout` seconds, so that they don't hold up the
+        others.
+
+        Returns the hosts that ran out of time.
+        """
+        sem = asyncio.Semaphore(max(1, self.mgr.max_parallel_host_refreshes))
+        timeout = self.mgr.host_refresh_timeout or None
+        timed_out: List[str] = []
+
+        async def run(host: str) -> None:
+            async with sem:
+                start = time.monotonic()
+                try:
+                    await asyncio.wait_for(refresh(host), timeout)
+                except asyncio.TimeoutError:
+                    self.log.warning(f'refreshing host {host} timed out')
+                    timed_out.append(host)
+                except Exception:
+                    # don't let one host fail the refresh of all others
+                    self.log.exception(f'refreshing host {host} failed')
+                duration = time.monotonic() - start
+                self.mgr.host_refresh_duration[host] = duration
+                self.mgr.host_refresh_latency['host'].observe(duration)
+
+        hosts = sorted(hosts, key=lambda h: (h in self.mgr.offline_hosts,
+                                             self.mgr.host_refresh_duration.get(h, 0.0)))
+        await asyncio.gather(*[run(h) for h in hosts])
+        return timed_out
+
+    @contextmanager
+    def _timed_phase(self, phase: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mgr.host_refresh_latency[phase].observe(time.monotonic() - start)
+
+    async def _run_sync(self, f: Callable[..., T], *args: Any) -> T:
+        # Run f in a thread instead of on the event loop: it either blocks
+        # (mon commands) or calls mgr.wait_async(), which would deadlock
+        # on the event loop thread.
+        return await asyncio.get_event_loop().run_in_executor(None, f, *args)
+
+    async def _refresh_host_probes(self, host: str, probes: List[str]) -> List[str]:
+        """
+        Refresh what the given probes ('ls', 'facts', 'networks' and
+        'devices') report about a host.  If more than one of them is due,
+        they all run in a single `cephadm gather`, which saves an SSH round
+        trip and a cephadm start for each of the others.
+
+        Returns the failures.
+        """
+        if len(probes) > 1:
+            self.log.debug(f'gathering {", ".join(probes)} of {host}')
+            try:
+                with self._timed_phase('gather'):
+                    gathered = await self._gather_host(host, probes)
+            except OrchestratorError as e:
+                if "invalid choice: 'gather'" not in str(e):
+                    return [str(e)]
+                self.log.debug(f'cephadm on {host} does not support gather')
+            else:
+                failures = []
+                for probe in probes:
+                    section = gathered.get(probe, {})
+                    start = time.monotonic()
+                    if 'data' not in section:
+                        failures.append(f'host {host} `cephadm gather` {probe} failed: '
+                                        f'{section.get("error")}')
+                    elif probe == 'ls':
+                        self.mgr._process_ls_output(host, section['data'])
+                    elif probe == 'facts':
+                        self.mgr.cache.update_host_facts(host, section['data'])
+                    elif probe == 'networks':
+                        self._update_host_networks(host, section['data'])
+                    elif probe == 'devices':
+                        await self._update_host_devices(host, section['data'])
+                    self._observe_gathered(probe, section, time.monotonic() - start)
+                return failures
+
+        refresh = {
+            'ls': self._refresh_host_daemons,
+            'facts': self._refresh_facts,
+            'networks': self._refresh_host_networks,
+            'devices': self._refresh_host_devices,
+        }
+        failures = []
+        for probe in probes:
+            self.log.debug(f'refreshing {host} {probe}')
+            with self._timed_phase(probe):
+                r = await refresh[probe](host)
+            if r:
+                failures.append(r)
+        return failures
+
+    def _observe_gathered(self, probe: str, section: Dict[str, Any], processing: float) -> None:
+        # the time the probe took on the host, as reported by `cephadm
+        # gather`, plus the time it took to process its result here
+        try:
+            duration = (str_to_datetime(section['finished'])
+                        - str_to_datetime(section['started'])).total_seconds()
+        except (KeyError, ValueError):
+            return
+        self.mgr.host_refresh_latency[probe].observe(duration + processing)
+
+    async def _gather_host(self, host: str, probes: List[str]) -> Dict[str, Any]:
+        args = []
+        for probe in probes:
+            args += ['--probe', probe]
+        if 'devices' in probes:
+            if self.mgr.device_enhanced_scan:
+                args.append('--with-lsm')
+            # ceph-volume needs the osd image and the fsid
+            r = await self._run_cephadm_json(host, 'osd', 'gather', args)
+        else:
+            r = await self._run_cephadm_json(host, cephadmNoImage, 'gather', args, no_fsid=True)
+        if not isinstance(r, dict):
+            raise OrchestratorError(f'host {host} `cephadm gather` returned {type(r).__name__}')
+        return r
+
+    async def _check_host(self, host: str) -> Optional[str]:
         if host not in self.mgr.inventory:
             return None
         self.log.debug(' checking %s' % host)
         try:
             addr = self.mgr.inventory.get_addr(host) if host in self.mgr.inventory else host
-            out, err, code = self.mgr.wait_async(self._run_cephadm(
+            out, err, code = await self._run_cephadm(
                 host, cephadmNoImage, 'check-host', [],
-                error_ok=True, no_fsid=True))
+                error_ok=True, no_fsid=True)
             self.mgr.cache.update_last_host_check(host)
             self.mgr.cache.save_host(host)
             if code:
@@ -305,18 +420,18 @@ class CephadmServe:
             return 'host %s (%s) failed check: %s' % (host, addr, e)
         return None
 
-    def _refresh_host_daemons(self, host: str) -> Optional[str]:
+    async def _refresh_host_daemons(self, host: str) -> Optional[str]:
         try:
-            ls = self.mgr.wait_async(self._run_cephadm_json(host, 'mon', 'ls', [], no_fsid=True))
+            ls = await self._run_cephadm_json(host, 'mon', 'ls', [], no_fsid=True)
         except OrchestratorError as e:
             return str(e)
         self.mgr._process_ls_output(host, ls)
         return None
 
-    def _refresh_facts(self, host: str) -> Optional[str]:
+    async def _refresh_facts(self, host: str) -> Optional[str]:
         try:
-            val = self.mgr.wait_async(self._run_cephadm_json(
-                host, cephadmNoImage, 'gather-facts', [], no_fsid=True))
+            val = await self._run_cephadm_json(
+                host, cephadmNoImage, 'gather-facts', [], no_fsid=True)
         except OrchestratorError as e:
             return str(e)
 
@@ -324,7 +439,7 @@ class CephadmServe:
 
         return None
 
-    def _refresh_host_devices(self, host: str) -> Optional[str]:
+    async def _refresh_host_devices(self, host: str) -> Optional[str]:
         with_lsm = self.mgr.device_enhanced_scan
         inventory_args = ['--', 'inventory',
                           '--format=json-pretty',
@@ -334,40 +449,46 @@ class CephadmServe:
 
         try:
             try:
-                devices = self.mgr.wait_async(self._run_cephadm_json(host, 'osd', 'ceph-volume',
-                                                                     inventory_args))
+                devices = await self._run_cephadm_json(host, 'osd', 'ceph-volume',
+                                                       inventory_args)
             except OrchestratorError as e:
                 if 'unrecognized arguments: --filter-for-batch' in str(e):
                     rerun_args = inventory_args.copy()
                     rerun_args.remove('--filter-for-batch')
-                    devices = self.mgr.wait_async(self._run_cephadm_json(host, 'osd', 'ceph-volume',
-                                                                         rerun_args))
+                    devices = await self._run_cephadm_json(host, 'osd', 'ceph-volume',
+                                                           rerun_args)
                 else:
                     raise
 
         except OrchestratorError as e:
             return str(e)
 
+        await self._update_host_devices(host, devices)
+        return None
+
+    async def _update_host_devices(self, host: str, devices: List[Dict[str, Any]]) -> None:
         self.log.debug('Refreshed host %s devices (%d)' % (
             host, len(devices)))
         ret = inventory.Devices.from_json(devices)
         self.mgr.cache.update_host_devices(host, ret.devices)
-        self.update_osdspec_previews(host)
+        await self._run_sync(self.update_osdspec_previews, host)
         self.mgr.cache.save_host(host)
-        return None
 
-    def _refresh_host_networks(self, host: str) -> Optional[str]:
+    async def _refresh_host_networks(self, host: str) -> Optional[str]:
         try:
-            networks = self.mgr.wait_async(self._run_cephadm_json(
-                host, 'mon', 'list-networks', [], no_fsid=True))
+            networks = await self._run_cephadm_json(
+                host, 'mon', 'list-networks', [], no_fsid=True)
         except OrchestratorError as e:
             return str(e)
 
+        self._update_host_networks(host, networks)
+        return None
+
+    def _update_host_networks(self, host: str, networks: Dict[str, Dict[str, List[str]]]) -> None:
         self.log.debug('Refreshed host %s networks (%s)' % (
             host, len(networks)))
         self.mgr.cache.update_host_networks(host, networks)
         self.mgr.cache.save_host(host)
-        return None
 
     def _refresh_host_osdspec_previews(self, host: str) -> Optional[str]:
         self.update_osdspec_previews(host)
@@ -523,6 +644,7 @@ class CephadmServe:
                 self.mgr.remove_health_warning(name)
             invalid_config_options = []
             options_failed_to_set = []
+            to_set: Dict[str, Any] = {}
             for k, v in spec.config.items():
                 try:
                     current = self.mgr.get_foreign_ceph_option(section, k)
@@ -536,17 +658,19 @@ class CephadmServe:
                     continue
                 if current != v:
                     self.log.debug(f'setting [{section}] {k} = {v}')
-                    try:
-                        self.mgr.check_mon_command({
-                            'prefix': 'config set',
-                            'name': k,
-                            'value': str(v),
-                            'who': section,
-                        })
-                    except MonCommandFailed as e:
-                        msg = f'Failed to set {spec.service_name()} option {k}: {e}'
-                        self.log.warning(msg)
-                        options_failed_to_set.append(msg)
+                    to_set[k] = v
+            results = self.mgr.mon_commands_batch([{
+                'prefix': 'config set',
+                'name': k,
+                'value': str(v),
+                'who': section,
+            } for k, v in to_set.items()])
+            for k, (r, _, err) in zip(to_set, results):
+                if r:
+                    msg = (f'Failed to set {spec.service_name()} option {k}: '
+                           f'config set failed: {err} retval: {r}')
+                    self.log.warning(msg)
+                    options_failed_to_set.append(msg)
 
             if invalid_config_options:
                 self.mgr.set_health_warning('CEPHADM_INVALID_CONFIG_OPTION', f'Ignoring {len(invalid_config_options)} invalid config option(s)', len(
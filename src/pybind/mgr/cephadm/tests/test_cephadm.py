@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 
@@ -315,7 +316,7 @@ class TestCephadm(object):
     def test_list_daemons(self, cephadm_module: CephadmOrchestrator):
         cephadm_module.service_cache_timeout = 10
         with with_host(cephadm_module, 'test'):
-            CephadmServe(cephadm_module)._refresh_host_daemons('test')
+            cephadm_module.wait_async(CephadmServe(cephadm_module)._refresh_host_daemons('test'))
             dds = wait(cephadm_module, cephadm_module.list_daemons())
             assert {d.name() for d in dds} == {'rgw.myrgw.foobar', 'haproxy.test.bar'}
 
@@ -925,7 +926,7 @@ class TestCephadm(object):
     @mock.patch("cephadm.services.osd.RemoveUtil.get_pg_count", lambda _, __: 0)
     def test_remove_osds(self, cephadm_module):
         with with_host(cephadm_module, 'test'):
-            CephadmServe(cephadm_module)._refresh_host_daemons('test')
+            cephadm_module.wait_async(CephadmServe(cephadm_module)._refresh_host_daemons('test'))
             c = cephadm_module.list_daemons()
             wait(cephadm_module, c)
 
@@ -980,7 +981,7 @@ class TestCephadm(object):
     ))
     def test_remove_daemon(self, cephadm_module):
         with with_host(cephadm_module, 'test'):
-            CephadmServe(cephadm_module)._refresh_host_daemons('test')
+            cephadm_module.wait_async(CephadmServe(cephadm_module)._refresh_host_daemons('test'))
             c = cephadm_module.list_daemons()
             wait(cephadm_module, c)
             c = cephadm_module.remove_daemons(['rgw.myrgw.myhost.myid'])
@@ -1507,6 +1508,7 @@ class TestCephadm(object):
                                            b'\n\n[mon]\nk=v\n', 0o644, 0, 0, None)
 
             # reload
+            cephadm_module.cache.flush()
             cephadm_module.cache.last_client_files = {}
             cephadm_module.cache.load()
 
@@ -1521,6 +1523,87 @@ class TestCephadm(object):
                 '/etc/ceph/ceph.conf'][0]
             assert before_digest != after_digest
 
+    def test_refresh_hosts(self, cephadm_module: CephadmOrchestrator):
+        cephadm_module.max_parallel_host_refreshes = 2
+        cephadm_module.host_refresh_timeout = 0.2
+        cephadm_module.offline_hosts = {'offline'}
+        cephadm_module.host_refresh_duration = {'slow': 10.0, 'fast': 0.01}
+        started = []
+        running = set()
+        max_running = 0
+
+        async def refresh(host):
+            nonlocal max_running
+            started.append(host)
+            running.add(host)
+            max_running = max(max_running, len(running))
+            try:
+                await asyncio.sleep(10 if host in ('slow', 'offline') else 0.01)
+                if host == 'broken':
+                    raise OrchestratorError('broken')
+            finally:
+                running.remove(host)
+
+        timed_out = cephadm_module.wait_async(CephadmServe(cephadm_module)._refresh_hosts(
+            ['offline', 'slow', 'broken', 'fast', 'new'], refresh))
+        assert sorted(timed_out) == ['offline', 'slow']
+        assert started == ['broken', 'new', 'fast', 'slow', 'offline']
+        assert max_running == 2
+        assert cephadm_module.host_refresh_duration['slow'] < 1
+        assert cephadm_module.host_refresh_latency['host'].count == 5
+        assert 'host_refresh_latency' in cephadm_module.get_profile()
+
+    @mock.patch("cephadm.serve.CephadmServe._run_cephadm")
+    def test_refresh_host_probes(self, _run_cephadm, cephadm_module: CephadmOrchestrator):
+        nets = {'10.0.0.0/24': {'eth0': ['10.0.0.1']}}
+        gather_supported = True
+        commands = []
+
+        async def run_cephadm(host, entity, cmd, args, **kwargs):
+            commands.append(cmd)
+            if cmd == 'gather':
+                if not gather_supported:
+                    return [''], ["cephadm: error: invalid choice: 'gather'"], 2
+                return [json.dumps({
+                    'ls': {'started': '2022-01-01T00:00:00.000000Z',
+                           'finished': '2022-01-01T00:00:02.000000Z', 'data': []},
+                    'facts': {'started': '', 'finished': '', 'error': 'boom'},
+                    'networks': {'started': '2022-01-01T00:00:00.000000Z',
+                                 'finished': '2022-01-01T00:00:00.500000Z', 'data': nets},
+                })], [''], 0
+            if cmd == 'list-networks':
+                return [json.dumps(nets)], [''], 0
+            return ['{}' if cmd == 'gather-facts' else '[]'], [''], 0
+        _run_cephadm.side_effect = run_cephadm
+
+        with with_host(cephadm_module, 'test', refresh_hosts=False):
+            assert 'test' not in cephadm_module.cache.last_daemon_update
+            serve = CephadmServe(cephadm_module)
+            commands.clear()
+            failures = cephadm_module.wait_async(
+                serve._refresh_host_probes('test', ['ls', 'facts', 'networks']))
+            assert commands == ['gather']
+            assert failures == ['host test `cephadm gather` facts failed: boom']
+            assert cephadm_module.cache.networks['test'] == nets
+            # every probe is timed with the times it reported
+            latency = cephadm_module.host_refresh_latency
+            assert latency['gather'].count == 1
+            assert (latency['ls'].count, latency['facts'].count, latency['networks'].count) \
+                == (1, 0, 1)
+            assert 2 <= latency['ls'].sum < 3
+            assert 0.5 <= latency['networks'].sum < 1
+            assert 'test' in cephadm_module.cache.last_daemon_update
+
+            # cephadm on the host doesn't know about gather
+            gather_supported = False
+            commands.clear()
+            cephadm_module.cache.networks['test'] = {}
+            failures = cephadm_module.wait_async(
+                serve._refresh_host_probes('test', ['ls', 'facts', 'networks']))
+            assert commands == ['gather', 'ls', 'gather-facts', 'list-networks']
+            assert failures == []
+            assert cephadm_module.cache.networks['test'] == nets
+
     def test_etc_ceph_init(self):
         with with_cephadm_module({'manage_etc_ceph_ceph_conf': True}) as m:
             assert m.manage_etc_ceph_ceph_conf is True
@@ -1616,7 +1699,7 @@ Traceback (most recent call last):
             _run_cephadm.reset_mock()
             _run_cephadm.side_effect = OrchestratorError(error_message)
 
-            s = CephadmServe(cephadm_module)._refresh_host_devices('test')
+            s = cephadm_module.wait_async(CephadmServe(cephadm_module)._refresh_host_devices('test'))
             assert s == 'host test `cephadm ceph-volume` failed: ' + error_message
 
             assert _run_cephadm.mock_calls == [
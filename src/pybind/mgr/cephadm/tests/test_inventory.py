@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from ceph.deployment.inventory import Device
+from orchestrator import DaemonDescription, DaemonDescriptionStatus, OrchestratorError
+
+from ceph.deployment.service_spec import ServiceSpec
+from cephadm.inventory import HostCache, HOST_CACHE_PREFIX, HOST_DAEMONS_PREFIX, \
+    HOST_DEVICES_PREFIX, SPEC_STORE_PREFIX
+from cephadm.module import CephadmOrchestrator
+from .fixtures import _run_cephadm, with_host
+
+
+def _dd(daemon_type, daemon_id, host, status=DaemonDescriptionStatus.running):
+    return DaemonDescription(daemon_type=daemon_type, daemon_id=daemon_id,
+                             hostname=host, status=status)
+
+
+def _host_daemons(host, daemons):
+    return {dd.name(): dd for dd in daemons}
+
+
+@pytest.fixture
+def cache():
+    return HostCache(mock.MagicMock())
+
+
+def test_daemon_indexes(cache):
+    mon1 = _dd('mon', 'host1', 'host1')
+    rgw1 = _dd('rgw', 'foo.host1.abc', 'host1')
+    mon2 = _dd('mon', 'host2', 'host2')
+    crash2 = _dd('crash', 'host2', 'host2', DaemonDescriptionStatus.error)
+    cache.update_host_daemons('host1', _host_daemons('host1', [mon1, rgw1]))
+    cache.update_host_daemons('host2', _host_daemons('host2', [mon2, crash2]))
+
+    assert cache.get_daemon('mon.host1') is mon1
+    assert cache.get_daemon('mon.host2', 'host2') is mon2
+    with pytest.raises(OrchestratorError):
+        cache.get_daemon('mon.host2', 'host1')
+    assert cache.has_daemon('rgw.foo.host1.abc')
+    assert not cache.has_daemon('rgw.foo.host1.abc', 'host2')
+    assert cache.get_daemons_by_service('mon') == [mon1, mon2]
+    assert cache.get_daemons_by_service('rgw.foo') == [rgw1]
+    assert cache.get_daemons_by_type('mon', 'host2') == [mon2]
+    assert cache.get_error_daemons() == [crash2]
+
+    # a refresh replaces everything that was on the host
+    mgr1 = _dd('mgr', 'host1.xyz', 'host1')
+    cache.update_host_daemons('host1', _host_daemons('host1', [mgr1]))
+    assert not cache.has_daemon('mon.host1')
+    assert cache.get_daemons_by_service('mon') == [mon2]
+    assert cache.get_daemons_by_service('rgw.foo') == []
+    assert cache.get_daemons_by_type('mgr') == [mgr1]
+
+    # replacing a daemon by name
+    mon2b = _dd('mon', 'host2', 'host2', DaemonDescriptionStatus.error)
+    cache.add_daemon('host2', mon2b)
+    assert cache.get_daemon('mon.host2') is mon2b
+    assert cache.get_daemons_by_service('mon') == [mon2b]
+
+    cache.rm_daemon('host2', 'mon.host2')
+    assert cache.get_daemons_by_service('mon') == []
+    cache.rm_host('host1')
+    assert not cache.has_daemon('mgr.host1.xyz')
+    assert cache.get_daemons() == [crash2]
+
+    # replacing the whole map rebuilds the indexes
+    cache.daemons = {'host3': _host_daemons('host3', [_dd('mon', 'host3', 'host3')])}
+    assert cache.has_daemon('mon.host3', 'host3')
+    assert not cache.has_daemon('crash.host2')
+
+
+def test_daemon_indexes_concurrent_update(cache):
+    # the agent thread refreshes hosts while the serve loop reads the
+    # indexes: readers must never fail or see a half updated host
+    small = _host_daemons('host1', [_dd('osd', str(i), 'host1') for i in range(10)])
+    big = _host_daemons('host1', [_dd('osd', str(i), 'host1', DaemonDescriptionStatus.error)
+                                  for i in range(100)])
+    cache.update_host_daemons('host1', small)
+    done = threading.Event()
+
+    def update():
+        try:
+            for i in range(300):
+                cache.update_host_daemons('host1', big if i % 2 else small)
+        finally:
+            done.set()
+
+    t = threading.Thread(target=update)
+    t.start()
+    try:
+        while not done.is_set():
+            assert len(cache.get_daemons_by_type('osd')) in (10, 100)
+            assert len(cache.get_daemons_by_service('osd')) in (10, 100)
+            assert len(cache.get_error_daemons()) in (0, 100)
+            cache.has_daemon('osd.5', 'host1')
+    finally:
+        t.join()
+
+
+@mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+def test_save_host_flush(cephadm_module: CephadmOrchestrator):
+    with with_host(cephadm_module, 'host1'):
+        cache = cephadm_module.cache
+        cache.flush()
+
+        # the serve loop stores its saves when the iteration is done
+        with cache.batch():
+            cache.update_host_devices('host1', [Device('/dev/sdb')])
+            cache.save_host('host1')
+            assert cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1') == '[]'
+        assert [d['path'] for d in json.loads(
+            cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1'))] == ['/dev/sdb']
+
+        # saves outside of the serve loop are stored right away
+        cache.update_host_devices('host1', [Device('/dev/sdc')])
+        cache.save_host('host1')
+        assert [d['path'] for d in json.loads(
+            cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1'))] == ['/dev/sdc']
+
+        # unchanged daemons and devices are not written again, repeated
+        # saves are written once
+        with mock.patch.object(cephadm_module, '_ceph_set_store_batch',
+                               wraps=cephadm_module._ceph_set_store_batch) as set_batch:
+            with cache.batch():
+                cache.update_host_devices('host1', [Device('/dev/sdc')])
+                cache.update_last_host_check('host1')
+                cache.save_host('host1')
+                cache.save_host('host1')
+            cache.flush()
+        set_batch.assert_called_once()
+        assert [k for k, _ in set_batch.call_args[0][0]] == [HOST_CACHE_PREFIX + 'host1']
+
+        # a record from before daemons and devices were stored on their own
+        j = json.loads(cephadm_module.get_store(HOST_CACHE_PREFIX + 'host1'))
+        j['daemons'] = {'mon.host1': {'daemon_type': 'mon', 'daemon_id': 'host1',
+                                      'hostname': 'host1'}}
+        j['devices'] = [Device('/dev/sdc').to_json()]
+        cephadm_module.set_store(HOST_CACHE_PREFIX + 'host1', json.dumps(j))
+        cache.load()
+        assert cache.has_daemon('mon.host1', 'host1')
+        assert [d.path for d in cache.devices['host1']] == ['/dev/sdc']
+        cache.flush()
+        assert 'daemons' not in json.loads(cephadm_module.get_store(HOST_CACHE_PREFIX + 'host1'))
+        assert list(json.loads(
+            cephadm_module.get_store(HOST_DAEMONS_PREFIX + 'host1'))) == ['mon.host1']
+        cache.load()
+        assert cache.has_daemon('mon.host1', 'host1')
+        assert [d.path for d in cache.devices['host1']] == ['/dev/sdc']
+
+    assert cephadm_module.get_store(HOST_DAEMONS_PREFIX + 'host1') is None
+    assert cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1') is None
+
+
+@mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+def test_save_host_before_migration(cephadm_module: CephadmOrchestrator):
+    with with_host(cephadm_module, 'host1'):
+        cache = cephadm_module.cache
+        cache.update_host_devices('host1', [Device('/dev/sdb')])
+
+        # older mgrs only read the host record
+        cephadm_module.migration_current = 5
+        cache.save_host('host1')
+        j = json.loads(cephadm_module.get_store(HOST_CACHE_PREFIX + 'host1'))
+        assert [d['path'] for d in j['devices']] == ['/dev/sdb']
+        assert 'daemons' in j
+        cephadm_module.set_store(HOST_DEVICES_PREFIX + 'host1', None)
+        cache.load()
+        assert cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1') is None
+
+        cephadm_module.migration.migrate()
+        assert cephadm_module.migration_current == 6
+        cache.flush()
+        assert 'devices' not in json.loads(cephadm_module.get_store(HOST_CACHE_PREFIX + 'host1'))
+        assert [d['path'] for d in json.loads(
+            cephadm_module.get_store(HOST_DEVICES_PREFIX + 'host1'))] == ['/dev/sdb']
+
+
+def test_save_rank_map(cephadm_module: CephadmOrchestrator):
+    # the serve loop changes the daemons right after recording their ranks
+    spec_store = cephadm_module.spec_store
+    spec_store.save(ServiceSpec('crash'))
+    spec_store.save_rank_map('crash', {0: {1: 'a'}})
+    stored = json.loads(cephadm_module.get_store(SPEC_STORE_PREFIX + 'crash'))
+    assert stored['rank_map'] == {'0': {'1': 'a'}}
+
+
+@pytest.mark.skipif(not os.environ.get('CEPHADM_BENCHMARK'),
+                    reason='set CEPHADM_BENCHMARK to run')
+def test_daemon_lookup_benchmark(cache):
+    """
+    The lookups of a serve loop on 1000 hosts with 30 daemons each.  Run
+    it with
+
+        CEPHADM_BENCHMARK=1 pytest -s cephadm/tests/test_inventory.py -k benchmark
+    """
+    start = time.perf_counter()
+    for h in range(1000):
+        host = 'host%d' % h
+        daemons = [_dd('osd', str(h * 26 + i), host) for i in range(26)]
+        daemons += [_dd('crash', host, host), _dd('node-exporter', host, host),
+                    _dd('rgw', 'foo.%s.abc' % host, host), _dd('mon', host, host)]
+        cache.update_host_daemons(host, _host_daemons(host, daemons))
+    print('\nupdate_host_daemons: %.3fs' % (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for service in ('osd', 'crash', 'node-exporter', 'rgw.foo', 'mon'):
+        cache.get_daemons_by_service(service)
+    names = [dd.name() for dd in cache.get_daemons()]
+    for name in names:
+        cache.get_daemon(name)
+        cache.has_daemon(name)
+    print('%d daemon lookups: %.3fs' % (len(names), time.perf_counter() - start))
@@ -45,7 +45,7 @@ class TestWithSSH:
 
                 asyncssh_connect.return_value = mock.MagicMock()
                 asyncssh_connect.side_effect = None
-                assert CephadmServe(cephadm_module)._check_host('test') is None
+                assert cephadm_module.wait_async(CephadmServe(cephadm_module)._check_host('test')) is None
                 out = wait(cephadm_module, cephadm_module.get_hosts())[0].to_json()
                 assert out == HostSpec('test', '1::4').to_json()
 
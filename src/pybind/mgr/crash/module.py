@@ -324,11 +324,12 @@ class Module(MgrModule):
         # make a copy of the list, since we'll modify self.crashes below
         to_prune = list(self.timestamp_filter(lambda ts: ts <= cutoff))
         assert self.crashes is not None
-        for crashid, crash in to_prune:
-            del self.crashes[crashid]
-            key = 'crash/%s' % crashid
-            self.set_store(key, None)
-            removed_any = True
+        with self.store_batch():
+            for crashid, crash in to_prune:
+                del self.crashes[crashid]
+                key = 'crash/%s' % crashid
+                self.set_store(key, None)
+                removed_any = True
         if removed_any:
             self._refresh_health_checks()
 
@@ -358,12 +359,13 @@ class Module(MgrModule):
         Acknowledge all new crashes and silence health warning(s)
         """
         assert self.crashes is not None
-        for crashid, crash in self.crashes.items():
-            if not crash.get('archived'):
-                crash['archived'] = str(datetime.datetime.utcnow())
-                self.crashes[crashid] = crash
-                key = 'crash/%s' % crashid
-                self.set_store(key, json.dumps(crash))
+        with self.store_batch():
+            for crashid, crash in self.crashes.items():
+                if not crash.get('archived'):
+                    crash['archived'] = str(datetime.datetime.utcnow())
+                    self.crashes[crashid] = crash
+                    key = 'crash/%s' % crashid
+                    self.set_store(key, json.dumps(crash))
         self._refresh_health_checks()
         return 0, '', ''
 
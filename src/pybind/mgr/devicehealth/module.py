@@ -314,7 +314,7 @@ CREATE TABLE DeviceHealthMetrics (
             return True
 
         done = False
-        with ioctx, self._db_lock, self.db:
+        with ioctx, self.db_transaction():
             count = 0
             for obj in ioctx.list_objects():
                 try:
@@ -383,6 +383,8 @@ CREATE TABLE DeviceHealthMetrics (
             self.event.wait(sleep_interval)
             self.event.clear()
 
+        self.db_flush()
+
     def shutdown(self) -> None:
         self.log.info('Stopping')
         self.run = False
@@ -496,7 +498,7 @@ CREATE TABLE DeviceHealthMetrics (
             VALUES (?, ?);
         """
 
-        with self._db_lock, self.db:
+        with self.db_transaction():
             self._create_device(devid)
             self.db.execute(SQL, (devid, json.dumps(data)))
             self._prune_device_metrics()
@@ -550,7 +552,7 @@ CREATE TABLE DeviceHealthMetrics (
 
         self.log.debug(f"_get_device_metrics: {devid} {sample} {min_sample}")
 
-        with self._db_lock, self.db:
+        with self.db_transaction():
             if isample:
                 cursor = self.db.execute(SQL_EXACT, (devid, isample))
             else:
@@ -709,15 +711,13 @@ CREATE TABLE DeviceHealthMetrics (
         if r != 0:
             self.log.warning('Could not mark OSD %s out. r: [%s], outb: [%s], outs: [%s]',
                              osd_ids, r, outb, outs)
-        for osd_id in osd_ids:
-            result = CommandResult('')
-            self.send_command(result, 'mon', '', json.dumps({
-                'prefix': 'osd primary-affinity',
-                'format': 'json',
-                'id': int(osd_id),
-                'weight': 0.0,
-            }), '')
-            r, outb, outs = result.wait()
+        results = self.mon_commands_batch([{
+            'prefix': 'osd primary-affinity',
+            'format': 'json',
+            'id': int(osd_id),
+            'weight': 0.0,
+        } for osd_id in osd_ids])
+        for osd_id, (r, outb, outs) in zip(osd_ids, results):
             if r != 0:
                 self.log.warning('Could not set osd.%s primary-affinity, '
                                  'r: [%s], outb: [%s], outs: [%s]',
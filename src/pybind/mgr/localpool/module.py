@@ -1,4 +1,4 @@
-from mgr_module import MgrModule, CommandResult, Option, NotifyType
+from mgr_module import MgrModule, CommandResult, Option, NotifyType, NotifyCoalesce
 import json
 import threading
 from typing import cast, Any
@@ -47,6 +47,7 @@ class Module(MgrModule):
             runtime=True),
     ]
     NOTIFY_TYPES = [NotifyType.osd_map]
+    NOTIFY_COALESCE = {NotifyType.osd_map: NotifyCoalesce(interval=1.0)}
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super(Module, self).__init__(*args, **kwargs)
@@ -134,3 +135,4 @@ class Module(MgrModule):
 
     def shutdown(self) -> None:
         self.serve_event.set()
+        super(Module, self).shutdown()
@@ -4,7 +4,7 @@ Automatically scale MDSs based on status of the file-system using the FSMap
 
 import logging
 from typing import Any, Optional
-from mgr_module import MgrModule, NotifyType
+from mgr_module import MgrModule, NotifyCoalesce, NotifyType
 from orchestrator._interface import MDSSpec, ServiceSpec
 import orchestrator
 import copy
@@ -17,6 +17,8 @@ class MDSAutoscaler(orchestrator.OrchestratorClientMixin, MgrModule):
     MDS autoscaler.
     """
     NOTIFY_TYPES = [NotifyType.fs_map]
+    # every FSMap is rescanned as a whole, bursts of updates only need one scan
+    NOTIFY_COALESCE = {NotifyType.fs_map: NotifyCoalesce(interval=1.0)}
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         MgrModule.__init__(self, *args, **kwargs)
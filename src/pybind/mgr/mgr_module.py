@@ -1,7 +1,7 @@
 import ceph_module  # noqa
 
 from typing import cast, Tuple, Any, Dict, Generic, Optional, Callable, List, \
-    Mapping, NamedTuple, Sequence, Union, TYPE_CHECKING
+    Iterator, Mapping, NamedTuple, Sequence, Union, TYPE_CHECKING
 if TYPE_CHECKING:
     import sys
     if sys.version_info >= (3, 8):
@@ -9,6 +9,8 @@ if TYPE_CHECKING:
     else:
         from typing_extensions import Literal
 
+import array
+import contextlib
 import inspect
 import logging
 import errno
@@ -17,6 +19,7 @@ import json
 import subprocess
 import threading
 from collections import defaultdict
+from concurrent.futures import Future
 from enum import IntEnum, Enum
 import rados
 import re
@@ -25,7 +28,7 @@ import sqlite3
 import sys
 import time
 from ceph_argparse import CephArgtype
-from mgr_util import profile_method
+from mgr_util import profile_method, LatencyHistogram, SamplingProfiler
 
 if sys.version_info >= (3, 8):
     from typing import get_args, get_origin
@@ -101,6 +104,103 @@ class NotifyType(str, Enum):
     # perf_schema_update = 'perf_schema_update'
 
 
+class NotifyCoalesce(NamedTuple):
+    """
+    Coalescing policy of a notify type, see MgrModule.NOTIFY_COALESCE
+    """
+    interval: float  # minimum time between two deliveries, in seconds
+    latest_only: bool = True  # only deliver the last notify_id of a window
+
+
+class NotifyCoalescer(object):
+    """
+    Delivers the notifications of the notify types with a coalescing
+    policy on a worker thread: the first notification of a type is
+    delivered right away, the ones that follow within ``interval`` are
+    merged and delivered together once the interval has passed.
+    """
+
+    def __init__(self,
+                 policies: Mapping[NotifyType, NotifyCoalesce],
+                 deliver: Callable[[str, Any], None],
+                 log: logging.Logger):
+        self.policies = {NotifyType(t).value: p for t, p in policies.items()}
+        self._deliver = deliver
+        self._log = log
+        self._cond = threading.Condition()
+        self._pending: Dict[str, List[Any]] = {}
+        self._last: Dict[str, float] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def queue(self, notify_type: str, notify_id: Any) -> None:
+        with self._cond:
+            self.received += 1
+            pending = self._pending.setdefault(notify_type, [])
+            if self.policies[notify_type].latest_only:
+                self.dropped += len(pending)
+                pending[:] = [notify_id]
+            elif notify_id in pending:
+                self.dropped += 1
+            else:
+                pending.append(notify_id)
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run,
+                                                name='mgr-notify', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'queue_depth': sum(len(p) for p in self._pending.values()),
+                'received': self.received,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+            }
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self) -> None:
+        with self._cond:
+            while not self._stopping:
+                now = time.monotonic()
+                due = []
+                timeout: Optional[float] = None
+                for notify_type, ids in list(self._pending.items()):
+                    ready = self._last.get(notify_type, float('-inf')) + \
+                        self.policies[notify_type].interval
+                    if ready <= now:
+                        due.append((notify_type, ids))
+                        del self._pending[notify_type]
+                        self._last[notify_type] = now
+                    elif timeout is None or ready - now < timeout:
+                        timeout = ready - now
+                if not due:
+                    self._cond.wait(timeout)
+                    continue
+                self._cond.release()
+                try:
+                    for notify_type, ids in due:
+                        for notify_id in ids:
+                            try:
+                                self._deliver(notify_type, notify_id)
+                            except Exception:
+                                self._log.exception('notify {} failed'.format(notify_type))
+                finally:
+                    self._cond.acquire()
+                self.delivered += sum(len(ids) for _, ids in due)
+
+
 class CommandResult(object):
     """
     Use with MgrModule.send_command
@@ -127,6 +227,16 @@ class CommandResult(object):
         return self.r, self.outb, self.outs
 
 
+class CommandFuture(Future):
+    """
+    A `concurrent.futures.Future` of the ``(retval, stdout, stderr)`` of a
+    command. Like a CommandResult, it is completed by ceph-mgr.
+    """
+
+    def complete(self, r: int, outb: str, outs: str) -> None:
+        self.set_result((r, outb, outs))
+
+
 class HandleCommandResult(NamedTuple):
     """
     Tuple containing the result of `handle_command()`
@@ -147,6 +257,383 @@ class MonCommandFailed(RuntimeError): pass
 class MgrDBNotReady(RuntimeError): pass
 
 
+class MgrDBPool(object):
+    """
+    Connections to the sqlite database of a module.
+
+    A thread keeps the connection it got for as long as it runs
+    transactions, nested ones included. At most ``size`` connections are
+    opened; other threads wait for one to be returned.  libcephsqlite
+    serializes the connections to a database on a RADOS lock, so modules
+    storing their database in RADOS should keep a single connection.
+
+    With a ``commit_window``, transactions are nested, as savepoints, into a
+    longer lived one that is committed at most ``commit_window`` seconds
+    later, or by flush(), so that a burst of small transactions costs a
+    single sync. Each transaction still rolls back on its own if it fails.
+    Batching commits requires a single connection.
+    """
+
+    def __init__(self,
+                 connect: Callable[[], sqlite3.Connection],
+                 size: int = 1,
+                 commit_window: float = 0.0,
+                 log: Optional[logging.Logger] = None):
+        self._connect = connect
+        self._size = size
+        self.size = 1 if commit_window > 0 else size
+        self.commit_window = commit_window
+        self.log = log or logging.getLogger(__name__)
+        self._cond = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []
+        self._opened = 0
+        self._local = threading.local()
+        self._timer: Optional[threading.Timer] = None
+        # time spent waiting for a connection, in transactions, committing
+        self.lock_wait = LatencyHistogram()
+        self.transactions = LatencyHistogram()
+        self.commits = LatencyHistogram()
+
+    def current(self) -> Optional[sqlite3.Connection]:
+        """
+        Return the connection of the calling thread, if it holds one
+        """
+        return getattr(self._local, 'conn', None)
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.current()
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            # close connections beyond the size, e.g. after a commit window
+            # has been set
+            surplus = False
+            with self._cond:
+                if self._opened > self.size and not conn.in_transaction:
+                    self._opened -= 1
+                    surplus = True
+                else:
+                    self._idle.append(conn)
+                self._cond.notify()
+            if surplus:
+                conn.close()
+
+    def _acquire(self) -> sqlite3.Connection:
+        start = time.monotonic()
+        with self._cond:
+            while not self._idle and self._opened >= self.size:
+                self._cond.wait()
+            self.lock_wait.observe(time.monotonic() - start)
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run a transaction on the connection of the calling thread. The
+        connection must be in autocommit mode (``isolation_level = None``).
+        """
+        with self.connection() as conn:
+            start = time.monotonic()
+            depth = getattr(self._local, 'depth', 0)
+            # there may be a transaction open already, waiting for the end
+            # of the commit window
+            begun = not conn.in_transaction
+            if begun:
+                conn.execute('BEGIN')
+            conn.execute('SAVEPOINT mgr')
+            self._local.depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK TO mgr')
+                conn.execute('RELEASE mgr')
+                if begun:
+                    conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('RELEASE mgr')
+                if depth == 0 and self.commit_window > 0:
+                    self._schedule_commit()
+                elif begun:
+                    self._commit(conn)
+            finally:
+                self._local.depth = depth
+                with self._cond:
+                    self.transactions.observe(time.monotonic() - start)
+
+    def _commit(self, conn: sqlite3.Connection) -> None:
+        start = time.monotonic()
+        conn.execute('COMMIT')
+        with self._cond:
+            self.commits.observe(time.monotonic() - start)
+
+    def _schedule_commit(self) -> None:
+        with self._cond:
+            if self._timer is None:
+                self._timer = threading.Timer(self.commit_window, self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_timer(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            self.log.exception('failed to commit to the database')
+
+    def set_commit_window(self, commit_window: float) -> None:
+        with self._cond:
+            self.commit_window = commit_window
+            self.size = 1 if commit_window > 0 else self._size
+        if commit_window <= 0:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit the transactions waiting for the end of the commit window. If
+        the commit fails, it is retried at the end of the next window.
+        """
+        with self._cond:
+            timer, self._timer = self._timer, None
+            if not self._opened:
+                return
+        if timer is not None:
+            timer.cancel()
+        if getattr(self._local, 'depth', 0):
+            # the transactions of the calling thread are committed once
+            # they are done
+            return
+        with self.connection() as conn:
+            if not conn.in_transaction:
+                return
+            try:
+                self._commit(conn)
+            except Exception:
+                if conn.in_transaction:
+                    self._schedule_commit()
+                raise
+
+    def dump(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'connections': self._opened,
+                'idle': len(self._idle),
+                'lock_wait': self.lock_wait.dump(),
+                'transactions': self.transactions.dump(),
+                'commits': self.commits.dump(),
+            }
+
+
+class StoreBatch(object):
+    """
+    KV store updates collected by MgrModule.store_batch()
+    """
+
+    def __init__(self) -> None:
+        # key -> value, or None to remove the key
+        self.ops: Dict[str, Optional[str]] = {}
+
+    def set(self, key: str, val: Optional[str]) -> None:
+        self.ops[key] = val
+
+    def rm(self, key: str) -> None:
+        self.ops[key] = None
+
+
+class ReadOnlyDict(Dict[str, Any]):
+    """
+    A dict which can't be modified, handed out by `MgrModule.get_snapshot()`
+    so that a snapshot can be shared by all its callers. It is still a dict,
+    so it can be passed to ``json.dumps()`` and friends. ``dict(d)`` and
+    ``copy.copy(d)`` return a modifiable shallow copy, ``copy.deepcopy(d)``
+    a modifiable deep copy.
+
+    >>> d = ReadOnlyDict({'a': 1})
+    >>> d['a'] = 2
+    Traceback (most recent call last):
+    ...
+    TypeError: ReadOnlyDict is read-only
+    >>> import copy
+    >>> copy.deepcopy(ReadOnlyDict({'a': (1, 2)}))
+    {'a': [1, 2]}
+    """
+
+    def _readonly(self, *args: Any, **kwargs: Any) -> Any:
+        raise TypeError('ReadOnlyDict is read-only')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Dict[str, Any]:
+        return thaw(self)
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (ReadOnlyDict, (dict(self),))
+
+
+def freeze(obj: Any) -> Any:
+    """
+    Turn the dicts and lists of a structure returned by `MgrModule.get()`
+    into ReadOnlyDicts and tuples.
+
+    >>> freeze({'pools': [{'pool': 1}]})
+    {'pools': ({'pool': 1},)}
+    """
+    if isinstance(obj, dict):
+        return ReadOnlyDict({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple([freeze(v) for v in obj])
+    return obj
+
+
+def thaw(obj: Any) -> Any:
+    """
+    Inverse of `freeze()`: return a modifiable deep copy of a snapshot.
+
+    >>> thaw(freeze({'pools': [{'pool': 1}]}))
+    {'pools': [{'pool': 1}]}
+    """
+    if isinstance(obj, dict):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class PerfCounterSchema(object):
+    """
+    The schema of the perf counters of a `PerfCounterSnapshot`, in columns.
+    Every counter path of a daemon type is stored once, no matter how many
+    daemons report it.
+    """
+
+    def __init__(self) -> None:
+        self.index: Dict[Tuple[str, str], int] = {}
+        self.svc_types: List[str] = []
+        self.paths: List[str] = []
+        self.descriptions: List[str] = []
+        self.nicks: List[str] = []
+        self.types: List[int] = []
+        self.priorities: List[int] = []
+        self.units: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def intern(self, svc_type: str, path: str, counter_schema: Dict[str, Any]) -> int:
+        key = (svc_type, path)
+        counter = self.index.get(key)
+        if counter is None:
+            counter = len(self.paths)
+            self.index[key] = counter
+            self.svc_types.append(svc_type)
+            self.paths.append(path)
+            self.descriptions.append(counter_schema.get('description', ''))
+            self.nicks.append(counter_schema.get('nick', ''))
+            self.types.append(counter_schema['type'])
+            self.priorities.append(counter_schema['priority'])
+            self.units.append(counter_schema.get('units', 0))
+        return counter
+
+
+class PerfCounterSnapshot(object):
+    """
+    The latest values of the perf counters of many daemons, in columns.
+
+    Row ``i`` is the counter ``schema.paths[counter_index[i]]`` of the daemon
+    ``daemons[daemon_index[i]]``. ``values[i]`` is its raw value (the sum for
+    long running averages, nanoseconds for time counters) and ``counts[i]``
+    the count of a long running average, 0 for other counters. The rows of
+    a daemon are contiguous, see `rows()`.
+
+    The index and value columns are ``array.array`` objects, `numpy()`
+    returns them as NumPy arrays without copying them.
+    """
+
+    def __init__(self,
+                 schema: PerfCounterSchema,
+                 daemons: List[str],
+                 offsets: 'array.array[int]',
+                 daemon_index: 'array.array[int]',
+                 counter_index: 'array.array[int]',
+                 values: 'array.array[int]',
+                 counts: 'array.array[int]') -> None:
+        self.schema = schema
+        self.daemons = daemons
+        self.offsets = offsets
+        self.daemon_index = daemon_index
+        self.counter_index = counter_index
+        self.values = values
+        self.counts = counts
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def rows(self, daemon: int) -> range:
+        """
+        :param daemon: the index of the daemon in ``daemons``
+        :return: the rows of the counters of the daemon
+        """
+        return range(self.offsets[daemon], self.offsets[daemon + 1])
+
+    def numpy(self) -> Dict[str, Any]:
+        """
+        Return ``daemon_index``, ``counter_index``, ``values`` and ``counts``
+        as NumPy arrays sharing the memory of the snapshot.
+
+        :raises ImportError: if NumPy isn't available
+        """
+        import numpy
+        return {
+            'daemon_index': numpy.frombuffer(self.daemon_index, dtype=numpy.uint32),
+            'counter_index': numpy.frombuffer(self.counter_index, dtype=numpy.uint32),
+            'values': numpy.frombuffer(self.values, dtype=numpy.uint64),
+            'counts': numpy.frombuffer(self.counts, dtype=numpy.uint64),
+        }
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Return the snapshot in the format of `MgrModule.get_all_perf_counters()`.
+        """
+        schema = self.schema
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for daemon, name in enumerate(self.daemons):
+            counters = result[name] = {}
+            for row in self.rows(daemon):
+                counter = self.counter_index[row]
+                info = {
+                    'description': schema.descriptions[counter],
+                    'type': schema.types[counter],
+                    'priority': schema.priorities[counter],
+                    'units': schema.units[counter],
+                    'value': self.values[row],
+                }
+                if schema.nicks[counter]:
+                    info['nick'] = schema.nicks[counter]
+                if schema.types[counter] & MgrModule.PERFCOUNTER_LONGRUNAVG:
+                    info['count'] = self.counts[row]
+                counters[schema.paths[counter]] = info
+        return result
+
+
 class OSDMap(ceph_module.BasePyOSDMap):
     def get_epoch(self) -> int:
         return self._get_epoch()
@@ -157,6 +644,23 @@ class OSDMap(ceph_module.BasePyOSDMap):
     def dump(self) -> Dict[str, Any]:
         return self._dump()
 
+    def diff(self, other: 'OSDMap') -> Dict[str, Any]:
+        """
+        Describe what changed between this map and a later map ``other``.
+
+        Only the OSDs whose existence, up state, weight or primary affinity
+        differ are listed, and each of them only carries the attributes that
+        changed, as ``[old, new]`` pairs.  Pools are listed by id in
+        ``pools_created``, ``pools_removed`` and ``pools_changed``, and the
+        PGs whose ``pg_temp``, ``primary_temp``, ``pg_upmap`` or
+        ``pg_upmap_items`` entries differ are listed by pgid.
+
+        This is much cheaper than comparing the output of :meth:`dump` for
+        both maps, as the cost grows with the number of changes rather than
+        with the size of the cluster.
+        """
+        return self._diff(other)
+
     def get_pools(self) -> Dict[int, Dict[str, Any]]:
         # FIXME: efficient implementation
         d = self._dump()
@@ -173,6 +677,13 @@ class OSDMap(ceph_module.BasePyOSDMap):
     def apply_incremental(self, inc: 'OSDMapIncremental') -> 'OSDMap':
         return self._apply_incremental(inc)
 
+    def copy(self) -> 'OSDMap':
+        """
+        Return a deep copy of the map, CRUSH map included, e.g. to run
+        calc_pg_upmaps() on the same map in several threads at once.
+        """
+        return self._copy()
+
     def get_crush(self) -> 'CRUSHMap':
         return self._get_crush()
 
@@ -192,6 +703,18 @@ class OSDMap(ceph_module.BasePyOSDMap):
     def map_pool_pgs_up(self, poolid: int) -> List[int]:
         return self._map_pool_pgs_up(poolid)
 
+    def map_pool_pgs_moved(self, other: 'OSDMap', poolid: int, osd: int) -> List[int]:
+        """
+        Find the PGs of a pool that moved between this map and ``other``.
+
+        A PG is reported when ``osd`` is in its acting set in either map and
+        the acting set differs between the two.  The whole pool is mapped in
+        a single call, without holding the GIL.
+
+        :return: the placement seeds of the PGs that moved
+        """
+        return self._map_pool_pgs_moved(other, poolid, osd)
+
     def pg_to_up_acting_osds(self, pool_id: int, ps: int) -> Dict[str, Any]:
         return self._pg_to_up_acting_osds(pool_id, ps)
 
@@ -232,6 +755,13 @@ class OSDMapIncremental(ceph_module.BasePyOSDMapIncremental):
         """
         return self._set_crush_compat_weight_set_weights(weightmap)
 
+    def merge_upmaps(self, other: 'OSDMapIncremental') -> None:
+        """
+        Apply the pg-upmap changes of ``other`` to this incremental, e.g.
+        to combine the results of calc_pg_upmaps() runs on disjoint pools.
+        """
+        return self._merge_upmaps(other)
+
 
 class CRUSHMap(ceph_module.BasePyCRUSH):
     ITEM_NONE = 0x7fffffff
@@ -907,6 +1437,11 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
     SCHEMA = None # type: Optional[str]
     SCHEMA_VERSIONED = None # type: Optional[List[str]]
 
+    # maximum number of connections to the database, see MgrDBPool
+    DB_POOL_SIZE = 1
+    # prepared statements kept per connection
+    DB_CACHED_STATEMENTS = 256
+
     # Priority definitions for perf counters
     PRIO_CRITICAL = 10
     PRIO_INTERESTING = 8
@@ -928,6 +1463,38 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
     BYTES = 0
     NONE = 1
 
+    # seconds to keep the perf counter layout of get_perf_counter_snapshot()
+    PERF_COUNTER_LAYOUT_TTL = 60.0
+
+    # maximum number of commands in flight in mon_commands_batch() and friends
+    MAX_COMMANDS_IN_FLIGHT = 16
+
+    # notify type -> NotifyCoalesce. Notifications of these types are
+    # delivered on a worker thread, at most once per interval
+    NOTIFY_COALESCE: Dict[NotifyType, NotifyCoalesce] = {}
+
+    # The maps the data returned by get() is derived from, see get_snapshot()
+    SNAPSHOT_VERSIONS = {
+        'osd_map': ('osd_map',),
+        'osd_map_tree': ('osd_map',),
+        'osd_map_crush': ('osd_map',),
+        'osdmap_crush_map_text': ('osd_map',),
+        'pg_summary': ('pg_map',),
+        'pg_status': ('pg_map',),
+        'pg_dump': ('pg_map',),
+        'pg_stats': ('pg_map',),
+        'pool_stats': ('pg_map',),
+        'osd_stats': ('pg_map',),
+        'osd_ping_times': ('pg_map',),
+        'io_rate': ('pg_map',),
+        'df': ('osd_map', 'pg_map'),
+        'osd_pool_stats': ('osd_map', 'pg_map'),
+        'fs_map': ('fs_map',),
+        'mon_map': ('mon_map',),
+        'mgr_map': ('mgr_map',),
+        'service_map': ('service_map',),
+    }
+
     # Cluster log priorities
     class ClusterLogPrio(IntEnum):
         DEBUG = 0
@@ -978,6 +1545,32 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         self._mgr_ips: Optional[str] = None
 
         self._db_lock = threading.Lock()
+        self._db_pool: Optional[MgrDBPool] = None
+
+        # data name -> (map versions, frozen data), see get_snapshot()
+        self._snapshots: Dict[str, Tuple[Tuple[int, ...], Any]] = {}
+        self._snapshot_locks: Dict[str, threading.Lock] = {}
+        self._snapshot_lock = threading.Lock()
+
+        # the last layout of get_perf_counter_snapshot()
+        self._perf_counter_layout: Optional[Tuple[Any, ...]] = None
+
+        # see `ceph mgr profile`
+        self._profiler = SamplingProfiler()
+        self._command_latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._notify_latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self._latency_lock = threading.Lock()
+
+        self._notify_coalescer = NotifyCoalescer(self.NOTIFY_COALESCE,
+                                                 self._deliver_notify, self.log)
+
+        # read cache of the KV store, valid as long as the store version is
+        # unchanged, see get_store()
+        self._store_lock = threading.Lock()
+        self._store_version: Optional[int] = None
+        self._store_keys: Dict[str, Optional[str]] = {}
+        self._store_prefixes: Dict[str, Dict[str, str]] = {}
+        self._store_batches = threading.local()
 
     def __del__(self) -> None:
         self._unconfigure_logging()
@@ -999,6 +1592,20 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                    runtime=True,
                    enum_allowed=['info', 'debug', 'critical', 'error',
                                  'warning', '']))
+        if cls.SCHEMA is not None:
+            cls.MODULE_OPTIONS.append(
+                Option(name='sqlite_journal_mode', type='str', default='PERSIST',
+                       enum_allowed=['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY'],
+                       desc='journal mode of the database of the module'))
+            cls.MODULE_OPTIONS.append(
+                Option(name='sqlite_synchronous', type='str', default='FULL',
+                       enum_allowed=['OFF', 'NORMAL', 'FULL', 'EXTRA'],
+                       desc='synchronous mode of the database of the module'))
+            cls.MODULE_OPTIONS.append(
+                Option(name='sqlite_commit_window', type='float', default=0.0,
+                       min=0.0,
+                       desc='how long to delay commits to the database, '
+                            'in seconds, to batch them'))
 
     @classmethod
     def _register_commands(cls, module_name: str) -> None:
@@ -1113,8 +1720,8 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         self.log.debug(f"set_kv('{key}', '{value}')")
 
-        with self._db_lock, self.db:
-            self.db.execute(SQL, (key, value))
+        with self.db_transaction() as db:
+            db.execute(SQL, (key, value))
 
     @API.expose
     def get_kv(self, key: str) -> Any:
@@ -1124,8 +1731,8 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         self.log.debug(f"get_kv('{key}')")
 
-        with self._db_lock, self.db:
-            cur = self.db.execute(SQL, (key,))
+        with self.db_transaction() as db:
+            cur = db.execute(SQL, (key,))
             row = cur.fetchone()
             if row is None:
                 return None
@@ -1166,8 +1773,11 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             cur.close()
 
     def configure_db(self, db: sqlite3.Connection) -> None:
+        journal_mode = self.get_module_option('sqlite_journal_mode', 'PERSIST')
+        synchronous = self.get_module_option('sqlite_synchronous', 'FULL')
         db.execute('PRAGMA FOREIGN_KEYS = 1')
-        db.execute('PRAGMA JOURNAL_MODE = PERSIST')
+        db.execute(f'PRAGMA JOURNAL_MODE = {journal_mode}')
+        db.execute(f'PRAGMA SYNCHRONOUS = {synchronous}')
         db.execute('PRAGMA PAGE_SIZE = 65536')
         db.execute('PRAGMA CACHE_SIZE = 64')
         db.row_factory = sqlite3.Row
@@ -1180,20 +1790,64 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             self.create_mgr_pool()
         uri = f"file:///{self.MGR_POOL_NAME}:{self.module_name}/main.db?vfs=ceph";
         self.log.debug(f"using uri {uri}")
-        db = sqlite3.connect(uri, check_same_thread=False, uri=True)
+        db = sqlite3.connect(uri, check_same_thread=False, uri=True,
+                             cached_statements=self.DB_CACHED_STATEMENTS)
         self.configure_db(db)
         return db
 
+    def _connect_db(self) -> sqlite3.Connection:
+        db_allowed = self.get_ceph_option("mgr_pool")
+        if not db_allowed:
+            raise MgrDBNotReady()
+        db = self.open_db()
+        if db is None:
+            raise MgrDBNotReady()
+        # transactions are run by MgrDBPool
+        db.isolation_level = None
+        return db
+
+    def _get_db_pool(self) -> MgrDBPool:
+        with self._db_lock:
+            if self._db_pool is None:
+                window = self.get_module_option('sqlite_commit_window', 0.0)
+                self._db_pool = MgrDBPool(self._connect_db, self.DB_POOL_SIZE,
+                                          cast(float, window or 0.0), log=self.log)
+            return self._db_pool
+
+    @contextlib.contextmanager
+    def db_transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Run a transaction on a connection to the database of the module. The
+        connection is reused by nested transactions and by ``self.db`` in the
+        calling thread.
+
+        :raises MgrDBNotReady: if the database cannot be opened yet
+        """
+        with self._get_db_pool().transaction() as db:
+            yield db
+
+    def db_flush(self) -> None:
+        """
+        Commit the transactions that wait for the end of the commit window
+        (``sqlite_commit_window``)
+        """
+        if self._db_pool is not None:
+            self._db_pool.flush()
+
     @API.expose
     def db_ready(self) -> bool:
-        with self._db_lock:
-            try:
-                return self.db is not None
-            except MgrDBNotReady:
-                return False
+        try:
+            with self._get_db_pool().connection():
+                return True
+        except MgrDBNotReady:
+            return False
 
     @property
     def db(self) -> sqlite3.Connection:
+        if self._db_pool is not None:
+            db = self._db_pool.current()
+            if db is not None:
+                return db
         assert self._db_lock.locked()
         if self._db is not None:
             return self._db
@@ -1241,6 +1895,22 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         """
         pass
 
+    def _dispatch_notify(self, notify_type: str, notify_id: Any) -> None:
+        # called by ceph-mgr instead of notify(), so that notifications can
+        # be coalesced and the latency of every one is accounted for
+        if notify_type in self._notify_coalescer.policies:
+            self._notify_coalescer.queue(notify_type, notify_id)
+        else:
+            self._deliver_notify(notify_type, notify_id)
+
+    def _deliver_notify(self, notify_type: str, notify_id: Any) -> None:
+        start = time.monotonic()
+        try:
+            self.notify(cast(NotifyType, notify_type), notify_id)
+        finally:
+            self._observe_latency(self._notify_latency, notify_type,
+                                  time.monotonic() - start)
+
     def _config_notify(self) -> None:
         # check logging options for changes
         mgr_level = cast(str, self.get_ceph_option("debug_mgr"))
@@ -1264,6 +1934,10 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             else:
                 self._disable_cluster_log()
 
+        if self.SCHEMA is not None and self._db_pool is not None:
+            window = self.get_module_option('sqlite_commit_window', 0.0)
+            self._db_pool.set_commit_window(cast(float, window or 0.0))
+
         # call module subclass implementations
         self.config_notify()
 
@@ -1293,6 +1967,9 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         :return: None
         """
+        self._profiler.stop()
+        self._notify_coalescer.stop()
+        self.db_flush()
         if self._rados:
             addrs = self._rados.get_addrs()
             self._rados.shutdown()
@@ -1309,7 +1986,7 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                 health, mon_status, devices, device <devid>, pg_stats,
                 pool_stats, pg_ready, osd_ping_times, mgr_map, mgr_ips,
                 modified_config_options, service_map, mds_metadata,
-                have_local_config_map, osd_pool_stats, pg_status.
+                have_local_config_map, osd_pool_stats, pg_status, map_versions.
 
         Note:
             All these structures have their own JSON representations: experiment
@@ -1321,6 +1998,42 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         return obj
 
+    @API.expose
+    def get_snapshot(self, data_name: str) -> Any:
+        """
+        Like `get()`, but return a read-only snapshot (see `freeze()`) which
+        is shared by all callers of this module until the maps it is derived
+        from change. This saves converting the same maps into Python objects
+        again and again, e.g. when several collectors of a module look at
+        the OSDMap in the same cycle.
+
+        Data which isn't derived from a versioned map (see SNAPSHOT_VERSIONS)
+        is fetched on every call. Use `thaw()` to get a modifiable copy.
+
+        Hits and misses are counted in the ``snapshot_cache_hit`` and
+        ``snapshot_cache_miss`` perf counters of the mgr.
+
+        :param str data_name: see `get()`
+        """
+        maps = self.SNAPSHOT_VERSIONS.get(data_name)
+        if maps is None:
+            return freeze(self.get(data_name))
+
+        versions = self.get('map_versions')
+        version = tuple(versions[m] for m in maps)
+        with self._snapshot_lock:
+            lock = self._snapshot_locks.setdefault(data_name, threading.Lock())
+        # only one thread converts a new version, the others wait for it
+        with lock:
+            snapshot = self._snapshots.get(data_name)
+            if snapshot is not None and snapshot[0] == version:
+                self._ceph_update_snapshot_cache_metrics(1, 0)
+                return snapshot[1]
+            obj = freeze(self.get(data_name))
+            self._snapshots[data_name] = (version, obj)
+        self._ceph_update_snapshot_cache_metrics(0, 1)
+        return obj
+
     def _stattype_to_str(self, stattype: int) -> str:
 
         typeonly = stattype & self.PERFCOUNTER_TYPE_MASK
@@ -1573,18 +2286,7 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         :return: status int, out std, err str
         """
-
-        t1 = time.time()
-        result = CommandResult()
-        self.send_command(result, "mon", "", json.dumps(cmd_dict), "", inbuf)
-        r = result.wait()
-        t2 = time.time()
-
-        self.log.debug("mon_command: '{0}' -> {1} in {2:.3f}s".format(
-            cmd_dict['prefix'], r[0], t2 - t1
-        ))
-
-        return r
+        return self.mon_command_async(cmd_dict, inbuf).result()
 
     def osd_command(self, cmd_dict: dict, inbuf: Optional[str] = None) -> Tuple[int, str, str]:
         """
@@ -1599,21 +2301,127 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             }
         :return: status int, out std, err str
         """
+        return self.osd_command_async(cmd_dict, inbuf).result()
+
+    def tell_command(self,
+                     svc_type: str,
+                     svc_id: str,
+                     cmd_dict: dict,
+                     inbuf: Optional[str] = None) -> Tuple[int, str, str]:
+        """
+        Helper for executing a command on a specific daemon, like
+        ``ceph tell <svc_type>.<svc_id> ...``.
+
+        :param str svc_type: ``mon``, ``osd`` or ``mds``
+        :param str svc_id: the name of the mon, the id of the osd or the
+            name of the mds
+        :return: status int, out std, err str
+        """
+        return self.tell_command_async(svc_type, svc_id, cmd_dict, inbuf).result()
+
+    def mon_command_async(self, cmd_dict: dict, inbuf: Optional[str] = None) -> CommandFuture:
+        """
+        Like `mon_command()`, but return a future of the result instead of
+        waiting for it.
+
+        Note that the mons may execute commands which are in flight at the
+        same time in any order.
+        """
+        return self._command_async('mon', '', cmd_dict, inbuf)
+
+    def osd_command_async(self, cmd_dict: dict, inbuf: Optional[str] = None) -> CommandFuture:
+        """
+        Like `osd_command()`, but return a future of the result instead of
+        waiting for it.
+        """
+        return self._command_async('osd', str(cmd_dict['id']), cmd_dict, inbuf)
+
+    def tell_command_async(self,
+                           svc_type: str,
+                           svc_id: str,
+                           cmd_dict: dict,
+                           inbuf: Optional[str] = None) -> CommandFuture:
+        """
+        Like `tell_command()`, but return a future of the result instead of
+        waiting for it.
+        """
+        return self._command_async(svc_type, svc_id, cmd_dict, inbuf)
+
+    def _command_async(self,
+                       svc_type: str,
+                       svc_id: str,
+                       cmd_dict: dict,
+                       inbuf: Optional[str]) -> CommandFuture:
         t1 = time.time()
-        result = CommandResult()
-        self.send_command(result, "osd", cmd_dict['id'], json.dumps(cmd_dict), "", inbuf)
-        r = result.wait()
-        t2 = time.time()
+        future = CommandFuture()
 
-        self.log.debug("osd_command: '{0}' -> {1} in {2:.3f}s".format(
-            cmd_dict['prefix'], r[0], t2 - t1
-        ))
+        def log(f: 'Future[Tuple[int, str, str]]') -> None:
+            if f.exception() is None:
+                self.log.debug("{0}_command: '{1}' -> {2} in {3:.3f}s".format(
+                    svc_type, cmd_dict['prefix'], f.result()[0], time.time() - t1
+                ))
 
-        return r
+        future.add_done_callback(log)
+        try:
+            self.send_command(future, svc_type, svc_id, json.dumps(cmd_dict), "", inbuf)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def mon_commands_batch(self,
+                           cmd_dicts: Sequence[dict],
+                           max_in_flight: Optional[int] = None) -> List[Tuple[int, str, str]]:
+        """
+        Execute many mon commands, at most ``max_in_flight`` (by default
+        MAX_COMMANDS_IN_FLIGHT) at the same time, and wait for all of them.
+        As the commands may be executed in any order, they must not depend
+        on each other.
+
+        :return: the (status int, out std, err str) of every command, in the
+            order of ``cmd_dicts``
+        """
+        return self._commands_batch(
+            [functools.partial(self.mon_command_async, cmd_dict) for cmd_dict in cmd_dicts],
+            max_in_flight)
+
+    def osd_commands_batch(self,
+                           cmd_dicts: Sequence[dict],
+                           max_in_flight: Optional[int] = None) -> List[Tuple[int, str, str]]:
+        """
+        Like `mon_commands_batch()`, for `osd_command()`.
+        """
+        return self._commands_batch(
+            [functools.partial(self.osd_command_async, cmd_dict) for cmd_dict in cmd_dicts],
+            max_in_flight)
+
+    def tell_commands_batch(self,
+                            commands: Sequence[Tuple[str, str, dict]],
+                            max_in_flight: Optional[int] = None) -> List[Tuple[int, str, str]]:
+        """
+        Like `mon_commands_batch()`, for `tell_command()`.
+
+        :param commands: ``(svc_type, svc_id, cmd_dict)`` tuples
+        """
+        return self._commands_batch(
+            [functools.partial(self.tell_command_async, svc_type, svc_id, cmd_dict)
+             for svc_type, svc_id, cmd_dict in commands],
+            max_in_flight)
+
+    def _commands_batch(self,
+                        senders: List[Callable[[], CommandFuture]],
+                        max_in_flight: Optional[int]) -> List[Tuple[int, str, str]]:
+        slots = threading.BoundedSemaphore(max_in_flight or self.MAX_COMMANDS_IN_FLIGHT)
+        futures = []
+        for send in senders:
+            slots.acquire()
+            future = send()
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
 
     def send_command(
             self,
-            result: CommandResult,
+            result: Union[CommandResult, CommandFuture],
             svc_type: str,
             svc_id: str,
             command: str,
@@ -1627,6 +2435,7 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             class, defined in the same module as MgrModule.  This acts as a
             completion and stores the output of the command.  Use
             ``CommandResult.wait()`` if you want to block on completion.
+            Alternatively a ``CommandFuture``.
         :param str svc_type:
         :param str svc_id:
         :param str command: a JSON-serialized command.  This uses the same
@@ -1699,10 +2508,80 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                         inbuf: str,
                         cmd: Dict[str, Any]) -> Union[HandleCommandResult,
                                                       Tuple[int, str, str]]:
-        if cmd['prefix'] not in CLICommand.COMMANDS:
-            return self.handle_command(inbuf, cmd)
+        if cmd['prefix'] == 'mgr profile':
+            return self._handle_profile_command(cmd)
 
-        return CLICommand.COMMANDS[cmd['prefix']].call(self, cmd, inbuf)
+        start = time.monotonic()
+        try:
+            if cmd['prefix'] not in CLICommand.COMMANDS:
+                return self.handle_command(inbuf, cmd)
+
+            return CLICommand.COMMANDS[cmd['prefix']].call(self, cmd, inbuf)
+        finally:
+            self._observe_latency(self._command_latency, cmd['prefix'],
+                                  time.monotonic() - start)
+
+    def _observe_latency(self,
+                         histograms: Dict[str, LatencyHistogram],
+                         key: str,
+                         seconds: float) -> None:
+        with self._latency_lock:
+            histograms[key].observe(seconds)
+
+    def _handle_profile_command(self, cmd: Dict[str, Any]) -> HandleCommandResult:
+        """
+        Implements `ceph mgr profile start|stop|dump|reset <module>`, which
+        ceph-mgr routes to the module named in the command.
+        """
+        action = cmd['action']
+        if action == 'start':
+            if not self._profiler.start():
+                return HandleCommandResult(
+                    retval=-errno.EBUSY,
+                    stderr='profiler of {} is already running'.format(self.module_name))
+            return HandleCommandResult()
+        elif action == 'stop':
+            if not self._profiler.stop():
+                return HandleCommandResult(
+                    retval=-errno.EINVAL,
+                    stderr='profiler of {} is not running'.format(self.module_name))
+            return HandleCommandResult()
+        elif action == 'reset':
+            self._profiler.reset()
+            with self._latency_lock:
+                self._command_latency.clear()
+                self._notify_latency.clear()
+            return HandleCommandResult()
+        elif action == 'dump':
+            if cmd.get('format', 'plain') == 'plain':
+                # collapsed stacks, ready to be fed to flamegraph.pl
+                return HandleCommandResult(stdout=self._profiler.dump())
+            return HandleCommandResult(stdout=json.dumps(self.get_profile()))
+        return HandleCommandResult(retval=-errno.EINVAL,
+                                   stderr='unknown action {}'.format(action))
+
+    def get_profile(self) -> Dict[str, Any]:
+        """
+        Return the state of the sampling profiler of this module along with
+        the latency histograms of its commands, by prefix, and of its
+        notifications, by notify type, the counters of its coalesced
+        notifications and the latencies of its database.
+        """
+        with self._latency_lock:
+            commands = {k: h.dump() for k, h in self._command_latency.items()}
+            notifications = {k: h.dump() for k, h in self._notify_latency.items()}
+        return {
+            'module': self.module_name,
+            'running': self._profiler.running,
+            'interval': self._profiler.interval,
+            'duration': self._profiler.elapsed(),
+            'samples': self._profiler.samples,
+            'stacks': self._profiler.dump(),
+            'command_latency': commands,
+            'notify_latency': notifications,
+            'notify_queue': self._notify_coalescer.stats(),
+            'db': self._db_pool.dump() if self._db_pool is not None else None,
+        }
 
     def handle_command(self,
                        inbuf: str,
@@ -1814,7 +2693,101 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         :param str key_prefix:
         :return: str
         """
-        return self._ceph_get_store_prefix(key_prefix)
+        with self._store_lock:
+            self._check_store_cache()
+            values = self._store_prefixes.get(key_prefix)
+            if values is None:
+                values = self._ceph_get_store_prefix(key_prefix)
+                self._store_prefixes[key_prefix] = values
+            values = dict(values)
+        batch = self._current_store_batch()
+        if batch is not None:
+            for key, val in batch.ops.items():
+                if not key.startswith(key_prefix):
+                    continue
+                if val is None:
+                    values.pop(key, None)
+                else:
+                    values[key] = val
+        return values
+
+    def _current_store_batch(self) -> Optional[StoreBatch]:
+        return getattr(self._store_batches, 'batch', None)
+
+    def _check_store_cache(self) -> None:
+        # drop the read cache if anything changed the store behind our back
+        assert self._store_lock.locked()
+        version = self._ceph_get_store_version()
+        if version != self._store_version:
+            self._store_keys.clear()
+            self._store_prefixes.clear()
+            self._store_version = version
+
+    def _get_store(self, key: str) -> Optional[str]:
+        batch = self._current_store_batch()
+        if batch is not None and key in batch.ops:
+            return batch.ops[key]
+        with self._store_lock:
+            self._check_store_cache()
+            if key in self._store_keys:
+                return self._store_keys[key]
+            for prefix, values in self._store_prefixes.items():
+                if key.startswith(prefix):
+                    return values.get(key)
+            val = self._ceph_get_store(key)
+            self._store_keys[key] = val
+            return val
+
+    def _set_store_batch(self, ops: Dict[str, Optional[str]]) -> None:
+        with self._store_lock:
+            before = self._store_version
+        version = self._ceph_set_store_batch(list(ops.items()))
+        with self._store_lock:
+            if before is None or self._store_version != before or version != before + 1:
+                # somebody else changed the store in the meantime
+                self._store_keys.clear()
+                self._store_prefixes.clear()
+                self._store_version = None
+                return
+            for key, val in ops.items():
+                self._store_keys[key] = val
+                for prefix, values in self._store_prefixes.items():
+                    if not key.startswith(prefix):
+                        continue
+                    if val is None:
+                        values.pop(key, None)
+                    else:
+                        values[key] = val
+            self._store_version = version
+
+    @contextlib.contextmanager
+    def store_batch(self) -> Iterator[StoreBatch]:
+        """
+        Collect the KV store updates made by this thread, with
+        ``set_store()`` or with the ``set()`` and ``rm()`` methods of the
+        returned batch, and commit them together when the block exits. The
+        mon commits them in a single proposal, so storing many keys costs
+        about one round trip instead of one per key. Reads in the block see
+        the pending updates. If the block raises, nothing is stored.
+
+        Nested batches are merged into the outermost one.
+
+        >>> with self.store_batch():    # doctest: +SKIP
+        ...     for host in hosts:
+        ...         self.set_store('host.' + host, json.dumps(hosts[host]))
+        """
+        outer = self._current_store_batch()
+        if outer is not None:
+            yield outer
+            return
+        batch = StoreBatch()
+        self._store_batches.batch = batch
+        try:
+            yield batch
+        finally:
+            self._store_batches.batch = None
+        if batch.ops:
+            self._set_store_batch(batch.ops)
 
     def _set_localized(self,
                        key: str,
@@ -1876,14 +2849,18 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         Set a value in this module's persistent key value store.
         If val is None, remove key from store
         """
-        self._ceph_set_store(key, val)
+        batch = self._current_store_batch()
+        if batch is not None:
+            batch.set(key, val)
+        else:
+            self._set_store_batch({key: val})
 
     @API.expose
     def get_store(self, key: str, default: Optional[str] = None) -> Optional[str]:
         """
         Get a value from this module's persistent key value store
         """
-        r = self._ceph_get_store(key)
+        r = self._get_store(key)
         if r is None:
             return default
         else:
@@ -1891,9 +2868,9 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
     @API.expose
     def get_localized_store(self, key: str, default: Optional[str] = None) -> Optional[str]:
-        r = self._ceph_get_store(_get_localized_key(self.get_mgr_id(), key))
+        r = self._get_store(_get_localized_key(self.get_mgr_id(), key))
         if r is None:
-            r = self._ceph_get_store(key)
+            r = self._get_store(key)
             if r is None:
                 r = default
         return r
@@ -1950,7 +2927,9 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
     def get_all_perf_counters(self, prio_limit: int = PRIO_USEFUL,
                               services: Sequence[str] = ("mds", "mon", "osd",
                                                          "rbd-mirror", "rgw",
-                                                         "tcmu-runner")) -> Dict[str, dict]:
+                                                         "tcmu-runner"),
+                              counter_filter: Optional[Callable[[str, str], bool]] = None
+                              ) -> Dict[str, dict]:
         """
         Return the perf counters currently known to this ceph-mgr
         instance, filtered by priority equal to or greater than `prio_limit`.
@@ -1961,6 +2940,10 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         info structure, which is the information from
         the schema, plus an additional "value" member with the latest
         value.
+
+        If `counter_filter` is given, it is called with the service type
+        and the counter path. Counters it returns False for are skipped
+        before their values are fetched.
         """
 
         result = defaultdict(dict)  # type: Dict[str, dict]
@@ -1992,6 +2975,8 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                     assert isinstance(priority, int)
                     if priority < prio_limit:
                         continue
+                    if counter_filter and not counter_filter(service['type'], counter_path):
+                        continue
 
                     tp = counter_schema['type']
                     assert isinstance(tp, int)
@@ -2018,6 +3003,84 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         return result
 
+    @API.expose
+    @profile_method()
+    def get_perf_counter_snapshot(self, prio_limit: int = PRIO_USEFUL,
+                                  services: Sequence[str] = ("mds", "mon", "osd",
+                                                             "rbd-mirror", "rgw",
+                                                             "tcmu-runner"),
+                                  counter_filter: Optional[Callable[[str, str], bool]] = None
+                                  ) -> PerfCounterSnapshot:
+        """
+        Like `get_all_perf_counters()`, but return a columnar
+        `PerfCounterSnapshot` instead of a dict per counter, and fetch the
+        values of all counters of a daemon at once.
+
+        The schema and the layout of the snapshot are kept until a daemon is
+        added, removed or upgraded, other arguments are passed, or
+        PERF_COUNTER_LAYOUT_TTL seconds have passed, so that counters which
+        daemons add at runtime show up. Only the values are fetched in the
+        meantime.
+        """
+        daemons = sorted(
+            (service['type'], service['id'], service.get('ceph_version', ''))
+            for server in self.list_servers()
+            for service in cast(List[ServiceInfoT], server['services'])
+            if service['type'] in services
+        )
+        key = (prio_limit, tuple(services), counter_filter, tuple(daemons))
+        now = time.monotonic()
+        layout = self._perf_counter_layout
+        if layout is None or layout[0] != key or now - layout[1] >= self.PERF_COUNTER_LAYOUT_TTL:
+            layout = (key, now) + self._get_perf_counter_layout(daemons, prio_limit,
+                                                                counter_filter)
+            self._perf_counter_layout = layout
+        _, _, schema, names, ids, paths, offsets, daemon_index, counter_index = layout
+
+        values = array.array('Q')
+        counts = array.array('Q')
+        for (svc_type, svc_id), daemon_paths in zip(ids, paths):
+            v, c = self._ceph_get_latest_counters(svc_type, svc_id, daemon_paths)
+            values.extend(v)
+            counts.extend(c)
+        return PerfCounterSnapshot(schema, names, offsets, daemon_index, counter_index,
+                                   values, counts)
+
+    def _get_perf_counter_layout(self,
+                                 daemons: List[Tuple[str, str, str]],
+                                 prio_limit: int,
+                                 counter_filter: Optional[Callable[[str, str], bool]]
+                                 ) -> Tuple[Any, ...]:
+        schema = PerfCounterSchema()
+        names: List[str] = []
+        ids: List[Tuple[str, str]] = []
+        paths: List[List[str]] = []
+        offsets = array.array('I', [0])
+        daemon_index = array.array('I')
+        counter_index = array.array('I')
+        for svc_type, svc_id, _ in daemons:
+            name = '{0}.{1}'.format(svc_type, svc_id)
+            schemas = self.get_perf_schema(svc_type, svc_id)
+            if not schemas:
+                self.log.warning("No perf counter schema for {0}".format(name))
+                continue
+            daemon_paths = []
+            for path, counter_schema in schemas[name].items():
+                priority = counter_schema['priority']
+                assert isinstance(priority, int)
+                if priority < prio_limit:
+                    continue
+                if counter_filter and not counter_filter(svc_type, path):
+                    continue
+                counter_index.append(schema.intern(svc_type, path, counter_schema))
+                daemon_paths.append(path)
+            daemon_index.extend([len(names)] * len(daemon_paths))
+            names.append(name)
+            ids.append((svc_type, svc_id))
+            paths.append(daemon_paths)
+            offsets.append(len(counter_index))
+        return schema, names, ids, paths, offsets, daemon_index, counter_index
+
     @API.expose
     def set_uri(self, uri: str) -> None:
         """
@@ -3,6 +3,7 @@ import os
 if 'UNITTEST' in os.environ:
     import tests
 
+import bisect
 import cephfs
 import contextlib
 import datetime
@@ -11,6 +12,7 @@ import socket
 import time
 import logging
 import sys
+import threading
 from threading import Lock, Condition, Event
 from typing import no_type_check
 import urllib
@@ -20,7 +22,7 @@ if sys.version_info >= (3, 3):
 else:
     from threading import _Timer as Timer
 
-from typing import Tuple, Any, Callable, Optional, Dict, TYPE_CHECKING, TypeVar, List, Iterable, Generator, Generic, Iterator
+from typing import Tuple, Any, Callable, Optional, Dict, TYPE_CHECKING, TypeVar, List, Iterable, Generator, Generic, Iterator, Set
 
 from ceph.deployment.utils import wrap_ipv6
 
@@ -810,3 +812,155 @@ def profile_method(skip_attribute: bool = False) -> Callable[[Callable[..., T]],
             return result
         return wrapper
     return outer
+
+
+class LatencyHistogram(object):
+    """
+    Latency histogram with power-of-two buckets from 1ms up to about a
+    minute.
+
+    >>> h = LatencyHistogram()
+    >>> h.observe(0.0015)
+    >>> h.observe(100)
+    >>> h.dump()['buckets']
+    {'0.002': 1, '+Inf': 1}
+    """
+    BOUNDS = [0.001 * 2 ** i for i in range(17)]
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def dump(self) -> Dict[str, Any]:
+        bounds = ['{:g}'.format(b) for b in self.BOUNDS] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            # upper bound in seconds -> number of observations, not cumulative
+            'buckets': {b: n for b, n in zip(bounds, self.buckets) if n},
+        }
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler for the threads of a mgr module.
+
+    While running, a background thread wakes up every ``interval``
+    seconds and records the Python stack of every thread executing code
+    of this interpreter, i.e. of the module.  The stacks are aggregated
+    into the collapsed format understood by flamegraph.pl and speedscope:
+    one line per distinct stack, frames separated by ``;`` and followed
+    by the number of samples.
+
+    All mgr modules share a GIL and ``sys._current_frames()`` reports the
+    threads of every interpreter, so threads are attributed to the module
+    by the globals of their innermost frame.
+    """
+    MAX_DEPTH = 64
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self.duration = 0.0
+        self._started: Optional[float] = None
+        self._lock = Lock()
+        self._event = Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._event.clear()
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._run,
+                                            name='mgr-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> bool:
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return False
+            self._event.set()
+            assert self._started is not None
+            self.duration += time.monotonic() - self._started
+            self._started = None
+        thread.join()
+        return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks = {}
+            self.samples = 0
+            self.duration = 0.0
+            if self._started is not None:
+                self._started = time.monotonic()
+
+    @staticmethod
+    def _own_globals() -> Set[int]:
+        return set(id(vars(m)) for m in list(sys.modules.values())
+                   if m is not None and hasattr(m, '__dict__'))
+
+    def _run(self) -> None:
+        own = self._own_globals()
+        refreshed = time.monotonic()
+        while not self._event.wait(self.interval):
+            # pick up modules imported since the last refresh
+            if time.monotonic() - refreshed > 1.0:
+                own = self._own_globals()
+                refreshed = time.monotonic()
+            self.sample(own)
+
+    def sample(self, own: Set[int]) -> None:
+        """
+        Record the stacks of all threads whose innermost frame runs code of
+        the modules whose ``__dict__`` ids are in ``own``.
+        """
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        stacks = []
+        for ident, frame in frames.items():
+            if ident == me or id(frame.f_globals) not in own:
+                continue
+            stack: List[str] = []
+            f: Any = frame
+            while f is not None and len(stack) < self.MAX_DEPTH:
+                stack.append('{}:{}'.format(f.f_globals.get('__name__', '?'),
+                                            f.f_code.co_name))
+                f = f.f_back
+            stack.append(names.get(ident, 'thread-{}'.format(ident)))
+            stacks.append(';'.join(reversed(stack)))
+        del frames
+        with self._lock:
+            for folded in stacks:
+                self.stacks[folded] = self.stacks.get(folded, 0) + 1
+            self.samples += 1
+
+    def dump(self) -> str:
+        with self._lock:
+            return ''.join('{} {}\n'.format(stack, n)
+                           for stack, n in sorted(self.stacks.items()))
+
+    def elapsed(self) -> float:
+        with self._lock:
+            if self._started is None:
+                return self.duration
+            return self.duration + time.monotonic() - self._started
@@ -1,12 +1,14 @@
 from typing import List, Optional
 
-from mgr_module import MgrModule, CLIReadCommand, CLIWriteCommand, Option, NotifyType
+from mgr_module import MgrModule, CLIReadCommand, CLIWriteCommand, Option, NotifyType, \
+    NotifyCoalesce
 
 from .fs.snapshot_mirror import FSSnapshotMirror
 
 class Module(MgrModule):
     MODULE_OPTIONS: List[Option] = []
     NOTIFY_TYPES = [NotifyType.fs_map]
+    NOTIFY_COALESCE = {NotifyType.fs_map: NotifyCoalesce(interval=1.0)}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
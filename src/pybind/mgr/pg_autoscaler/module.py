@@ -263,13 +263,13 @@ class PgAutoscaler(MgrModule):
     def set_autoscale_mode_all_pools(self, status: str) -> None:
         osdmap = self.get_osdmap()
         pools = osdmap.get_pools_by_name()
-        for pool_name, _ in pools.items():
-            self.mon_command({
-                'prefix': 'osd pool set',
-                'pool': pool_name,
-                'var': 'pg_autoscale_mode',
-                'val': status
-            })
+        self.mon_commands_batch([{
+            'prefix': 'osd pool set',
+            'pool': pool_name,
+            'var': 'pg_autoscale_mode',
+            'val': status
+        } for pool_name in pools])
+
     @CLIWriteCommand("osd pool get noautoscale")
     def get_noautoscale(self) -> Tuple[int, str, str]:
         """
@@ -702,6 +702,7 @@ class PgAutoscaler(MgrModule):
         total_bytes = dict([(r, 0) for r in iter(root_map)])
         total_target_bytes = dict([(r, 0.0) for r in iter(root_map)])
         target_bytes_pools: Dict[int, List[int]] = dict([(r, []) for r in iter(root_map)])
+        adjust: List[Dict[str, Any]] = []
 
         for p in ps:
             pool_id = p['pool_id']
@@ -730,12 +731,7 @@ class PgAutoscaler(MgrModule):
             if p['pg_autoscale_mode'] == 'on':
                 # Note that setting pg_num actually sets pg_num_target (see
                 # OSDMonitor.cc)
-                r = self.mon_command({
-                    'prefix': 'osd pool set',
-                    'pool': p['pool_name'],
-                    'var': 'pg_num',
-                    'val': str(p['pg_num_final'])
-                })
+                adjust.append(p)
 
                 # create new event or update existing one to reflect
                 # progress from current state to the new pg_num_target
@@ -748,14 +744,22 @@ class PgAutoscaler(MgrModule):
                     self._event[pool_id] = PgAdjustmentProgress(pool_id, pg_num, new_target)
                 self._event[pool_id].update(self, 0.0)
 
-                if r[0] != 0:
-                    # FIXME: this is a serious and unexpected thing,
-                    # we should expose it as a cluster log error once
-                    # the hook for doing that from ceph-mgr modules is
-                    # in.
-                    self.log.error("pg_num adjustment on {0} to {1} failed: {2}"
-                                   .format(p['pool_name'],
-                                           p['pg_num_final'], r))
+        # adjust all pools at once instead of one round trip per pool
+        results = self.mon_commands_batch([{
+            'prefix': 'osd pool set',
+            'pool': p['pool_name'],
+            'var': 'pg_num',
+            'val': str(p['pg_num_final'])
+        } for p in adjust])
+        for p, r in zip(adjust, results):
+            if r[0] != 0:
+                # FIXME: this is a serious and unexpected thing,
+                # we should expose it as a cluster log error once
+                # the hook for doing that from ceph-mgr modules is
+                # in.
+                self.log.error("pg_num adjustment on {0} to {1} failed: {2}"
+                               .format(p['pool_name'],
+                                       p['pg_num_final'], r))
 
         if too_few:
             summary = "{0} pools have too few placement groups".format(
@@ -1,5 +1,5 @@
 try:
-    from typing import List, Dict, Union, Any, Optional
+    from typing import List, Dict, Union, Any, Optional, Set
     from typing import TYPE_CHECKING
 except ImportError:
     TYPE_CHECKING = False
@@ -288,10 +288,14 @@ class PgRecoveryEvent(Event):
     def __init__(self, message, refs, which_pgs, which_osds, start_epoch, add_to_ceph_s):
         # type: (str, List[Any], List[PgId], List[str], int, bool) -> None
         super().__init__(str(uuid.uuid4()), message, refs, add_to_ceph_s)
-        self._pgs = which_pgs
+        # the PGs still to recover, by name as found in pg_progress
+        self._pgs = dict((str(pg), pg) for pg in which_pgs)  # type: Dict[str, PgId]
         self._which_osds = which_osds
         self._original_pg_count = len(self._pgs)
-        self._original_bytes_recovered = None  # type: Optional[Dict[PgId, float]]
+        self._original_bytes_recovered = None  # type: Optional[Dict[str, int]]
+        # how far along each partially recovered PG is, and the sum of that
+        self._partial = {}  # type: Dict[str, float]
+        self._partial_sum = 0.0
         self._progress = 0.0
 
         self._start_epoch = start_epoch
@@ -301,8 +305,56 @@ class PgRecoveryEvent(Event):
     def which_osds(self):
         return self. _which_osds
 
-    def pg_update(self, pg_progress: Dict, log: Any) -> None:
-        # FIXME: O(pg_num) in python
+    def _pg_ratio(self, pg: str, info: Optional[Dict[str, Any]]) -> Optional[float]:
+        """
+        How far along the recovery of a PG is, or None if it is complete.
+        """
+        if info is None:
+            # The PG is gone!  Probably a pool was deleted. Drop it.
+            return None
+        # Only checks the state of each PGs when it's epoch >= the OSDMap's epoch
+        if info['reported_epoch'] < self._start_epoch:
+            return 0.0
+
+        states = info['state'].split("+")
+        if "active" in states and "clean" in states:
+            return None
+
+        total_bytes = info['num_bytes']
+        if total_bytes == 0:
+            # Empty PGs are considered 0% done until they are
+            # in the correct state.
+            return 0.0
+        assert self._original_bytes_recovered is not None
+        recovered = info['num_bytes_recovered']
+        original = self._original_bytes_recovered.setdefault(pg, recovered)
+        if total_bytes > 0:
+            ratio = float(recovered - original) / total_bytes
+            # Since the recovered bytes (over time) could perhaps
+            # exceed the contents of the PG (moment in time), we
+            # must clamp this
+            return min(max(ratio, 0.0), 1.0)
+        # Dataless PGs (e.g. containing only OMAPs) count
+        # as half done.
+        return 0.5
+
+    def _set_partial(self, pg: str, ratio: float) -> None:
+        self._partial_sum += ratio - self._partial.pop(pg, 0.0)
+        if ratio:
+            self._partial[pg] = ratio
+        elif not self._partial:
+            # don't let rounding errors accumulate
+            self._partial_sum = 0.0
+
+    def pg_update(self, pg_progress: Dict, log: Any,
+                  changed: Optional[Set[str]] = None) -> None:
+        """
+        Update the progress from the ``pg_progress`` state.
+
+        :param changed: the names of the PGs whose entry in ``pg_progress``
+            changed (or that went away) since the last update of this event,
+            or None to look at all of the remaining PGs.
+        """
         # Sanity check to see if there are any missing PGs and to assign
         # empty array and dictionary if there hasn't been any recovery
         pg_to_state: Dict[str, Any] = pg_progress["pgs"]
@@ -312,17 +364,15 @@ class PgRecoveryEvent(Event):
             self._original_bytes_recovered = {}
             missing_pgs = []
             for pg in self._pgs:
-                pg_str = str(pg)
-                if pg_str in pg_to_state:
+                if pg in pg_to_state:
                     self._original_bytes_recovered[pg] = \
-                        pg_to_state[pg_str]['num_bytes_recovered']
+                        pg_to_state[pg]['num_bytes_recovered']
                 else:
                     missing_pgs.append(pg)
             if pg_ready:
                 for pg in missing_pgs:
-                    self._pgs.remove(pg)
-
-        complete_accumulate = 0.0
+                    del self._pgs[pg]
+            changed = None
 
         # Calculating progress as the number of PGs recovered divided by the
         # original where partially completed PGs count for something
@@ -332,54 +382,26 @@ class PgRecoveryEvent(Event):
         # few-bytes PGs that still need the housekeeping of their recovery
         # to be done. This is subjective...
 
-        complete = set()
-        for pg in self._pgs:
-            pg_str = str(pg)
-            try:
-                info = pg_to_state[pg_str]
-            except KeyError:
-                # The PG is gone!  Probably a pool was deleted. Drop it.
-                complete.add(pg)
-                continue
-            # Only checks the state of each PGs when it's epoch >= the OSDMap's epoch
-            if info['reported_epoch'] < self._start_epoch:
-                continue
-
-            state = info['state']
+        # Only the PGs that changed can have made progress: walk whichever
+        # of the two sets is smaller.
+        if changed is None:
+            todo = list(self._pgs)
+        elif len(changed) < len(self._pgs):
+            todo = [pg for pg in changed if pg in self._pgs]
+        else:
+            todo = [pg for pg in self._pgs if pg in changed]
 
-            states = state.split("+")
+        for pg in todo:
+            ratio = self._pg_ratio(pg, pg_to_state.get(pg))
+            if ratio is None:
+                del self._pgs[pg]
+                ratio = 0.0
+            self._set_partial(pg, ratio)
 
-            if "active" in states and "clean" in states:
-                complete.add(pg)
-            else:
-                if info['num_bytes'] == 0:
-                    # Empty PGs are considered 0% done until they are
-                    # in the correct state.
-                    pass
-                else:
-                    recovered = info['num_bytes_recovered']
-                    total_bytes = info['num_bytes']
-                    if total_bytes > 0:
-                        ratio = float(recovered -
-                                      self._original_bytes_recovered[pg]) / \
-                            total_bytes
-                        # Since the recovered bytes (over time) could perhaps
-                        # exceed the contents of the PG (moment in time), we
-                        # must clamp this
-                        ratio = min(ratio, 1.0)
-                        ratio = max(ratio, 0.0)
-
-                    else:
-                        # Dataless PGs (e.g. containing only OMAPs) count
-                        # as half done.
-                        ratio = 0.5
-                    complete_accumulate += ratio
-
-        self._pgs = list(set(self._pgs) ^ complete)
         completed_pgs = self._original_pg_count - len(self._pgs)
         completed_pgs = max(completed_pgs, 0)
         try:
-            prog = (completed_pgs + complete_accumulate)\
+            prog = (completed_pgs + self._partial_sum)\
                 / self._original_pg_count
         except ZeroDivisionError:
             prog = 0.0
@@ -472,6 +494,8 @@ class Module(MgrModule):
         self._shutdown = threading.Event()
 
         self._latest_osdmap = None  # type: Optional[OSDMap]
+        # pg_progress as of the last update of the PgRecoveryEvents
+        self._last_pg_progress = None  # type: Optional[Dict[str, Any]]
 
         self._dirty = False
 
@@ -498,44 +522,16 @@ class Module(MgrModule):
         # OSD is marked in or out according to the affected PGs
         affected_pgs = []
         for pool in old_dump['pools']:
-            pool_id = pool['pool']  # type: str
-            for ps in range(0, pool['pg_num']):
-
-                # Was this OSD affected by the OSD coming in/out?
-                # Compare old and new osds using
-                # data from the json dump
-                old_up_acting = old_map.pg_to_up_acting_osds(pool['pool'], ps)
-                old_osds = set(old_up_acting['acting'])
-                new_up_acting = new_map.pg_to_up_acting_osds(pool['pool'], ps)
-                new_osds = set(new_up_acting['acting'])
-
-                # Check the osd_id being in the acting set for both old
-                # and new maps to cover both out and in cases
-                was_on_out_or_in_osd = osd_id in old_osds or osd_id in new_osds
-                if not was_on_out_or_in_osd:
-                    continue
-
-                self.log.debug("pool_id, ps = {0}, {1}".format(
-                    pool_id, ps
-                ))
-
-                self.log.debug(
-                    "old_up_acting: {0}".format(json.dumps(old_up_acting, indent=4, sort_keys=True)))
-
-                # Has this OSD been assigned a new location?
-                # (it might not be if there is no suitable place to move
-                #  after an OSD is marked in/out)
-                
-                is_relocated = old_osds != new_osds
-                
-                self.log.debug(
-                    "new_up_acting: {0}".format(json.dumps(new_up_acting,
-                                                           indent=4,
-                                                           sort_keys=True)))
-
-                if was_on_out_or_in_osd and is_relocated:
-                    # This PG is now in motion, track its progress
-                    affected_pgs.append(PgId(pool_id, ps))
+            pool_id = pool['pool']
+            # PGs that were or are now mapped to this OSD and have been
+            # assigned a new location (they might not be if there is no
+            # suitable place to move after an OSD is marked in/out).
+            moved = old_map.map_pool_pgs_moved(new_map, pool_id, int(osd_id))
+            self.log.debug("pool %s: %d/%d PGs moved", pool_id, len(moved),
+                           pool['pg_num'])
+            for ps in moved:
+                # This PG is now in motion, track its progress
+                affected_pgs.append(PgId(pool_id, ps))
 
         # In the case that we ignored some PGs, log the reason why (we may
         # not end up creating a progress event)
@@ -571,26 +567,33 @@ class Module(MgrModule):
 
     def _osdmap_changed(self, old_osdmap, new_osdmap):
         # type: (OSDMap, OSDMap) -> None
-        old_dump = old_osdmap.dump()
-        new_dump = new_osdmap.dump()
-
-        old_osds = dict([(o['osd'], o) for o in old_dump['osds']])
-
-        for osd in new_dump['osds']:
+        # only look at the OSDs whose weight changed, rather than
+        # comparing full dumps of both maps
+        old_dump = None
+        for osd in old_osdmap.diff(new_osdmap)['osds']:
+            if 'weight' not in osd:
+                continue
             osd_id = osd['osd']
-            new_weight = osd['in']
-            if osd_id in old_osds:
-                old_weight = old_osds[osd_id]['in']
-
-                if new_weight == 0.0 and old_weight > new_weight:
-                    self.log.warning("osd.{0} marked out".format(osd_id))
-                    self._osd_in_out(old_osdmap, old_dump, new_osdmap, osd_id, "out")
-                elif new_weight >= 1.0 and old_weight == 0.0:
-                    # Only consider weight>=1.0 as "in" to avoid spawning
-                    # individual recovery events on every adjustment
-                    # in a gradual weight-in
-                    self.log.warning("osd.{0} marked in".format(osd_id))
-                    self._osd_in_out(old_osdmap, old_dump, new_osdmap, osd_id, "in")
+            if 'exists' in osd and not all(osd['exists']):
+                # newly created or removed OSD
+                continue
+            # like OSDMap::is_in(), any non-zero weight counts as in, so
+            # that adjusting the weight of an OSD that is in doesn't spawn
+            # an event
+            was_in, is_in = (weight > 0.0 for weight in osd['weight'])
+
+            marked = None
+            if was_in and not is_in:
+                marked = "out"
+            elif is_in and not was_in:
+                marked = "in"
+            if marked is None:
+                continue
+
+            self.log.warning("osd.{0} marked {1}".format(osd_id, marked))
+            if old_dump is None:
+                old_dump = old_osdmap.dump()
+            self._osd_in_out(old_osdmap, old_dump, new_osdmap, osd_id, marked)
 
     def _pg_state_changed(self):
 
@@ -627,21 +630,39 @@ class Module(MgrModule):
 
         self._osdmap_changed(old_osdmap, self._latest_osdmap)
 
+    def _pg_progress_changes(self, pgs):
+        # type: (Dict[str, Any]) -> Optional[Set[str]]
+        """
+        Find the PGs whose pg_progress entry changed since the last call,
+        so that events only need to look at those.  Returns None if there
+        is nothing to compare with.
+        """
+        last = self._last_pg_progress
+        self._last_pg_progress = pgs
+        if last is None:
+            return None
+        changed = set(pg for pg, info in pgs.items() if last.get(pg) != info)
+        changed.update(pg for pg in last if pg not in pgs)
+        return changed
+
     def _process_pg_summary(self):
         # if there are no events we will skip this here to avoid
         # expensive get calls
         if len(self._events) == 0:
+            # events created from now on start from a full pg_progress
+            self._last_pg_progress = None
             return
 
         global_event = False
         data = self.get("pg_progress")
+        changed = self._pg_progress_changes(data["pgs"])
         for ev_id in list(self._events):
             try:
                 ev = self._events[ev_id]
                 # Check for types of events
                 # we have to update
                 if isinstance(ev, PgRecoveryEvent):
-                    ev.pg_update(data, self.log)
+                    ev.pg_update(data, self.log, changed)
                     self.maybe_complete(ev)
                 elif isinstance(ev, GlobalRecoveryEvent):
                     global_event = True
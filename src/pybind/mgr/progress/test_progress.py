@@ -47,6 +47,36 @@ class TestPgRecoveryEvent(object):
         self.test_event.pg_update(pg_progress, mock.Mock())
         assert self.test_event._progress == 1.0
 
+    def test_pg_update_changed(self):
+        def pg(state, recovered, num_bytes=10):
+            return {
+                "state": state,
+                "num_bytes": num_bytes,
+                "num_bytes_recovered": recovered,
+                "reported_epoch": 30,
+            }
+        pgs = {
+            "1.0": pg("active+remapped+backfilling", 0),
+            "1.1": pg("active+remapped+backfilling", 0),
+            "1.2": pg("active+remapped+backfilling", 0),
+        }
+        self.test_event.pg_update({"pgs": pgs, "pg_ready": True}, mock.Mock())
+        assert self.test_event._progress == 0.0
+
+        pgs = dict(pgs)
+        pgs["1.0"] = pg("active+clean", 10)
+        pgs["1.1"] = pg("active+remapped+backfilling", 5)
+        self.test_event.pg_update({"pgs": pgs, "pg_ready": True}, mock.Mock(),
+                                  {"1.0", "1.1", "2.0"})
+        assert self.test_event._progress == 0.5
+
+        # unchanged PGs keep their contribution, vanished PGs are done
+        del pgs["1.2"]
+        self.test_event.pg_update({"pgs": pgs, "pg_ready": True}, mock.Mock(),
+                                  {"1.2"})
+        assert self.test_event._progress == pytest.approx(2.5 / 3)
+        assert sorted(self.test_event._pgs) == ["1.1"]
+
 
 class OSDMap: 
     
@@ -86,6 +116,16 @@ class OSDMap:
     def pg_to_up_acting_osds(self, pool_id, ps):
         return self._pg_to_up_acting_osds(pool_id, ps)
 
+    def map_pool_pgs_moved(self, other, pool_id, osd):
+        moved = []
+        pool = [p for p in self._dump['pools'] if p['pool'] == pool_id][0]
+        for ps in range(0, pool['pg_num']):
+            old_osds = set(self.pg_to_up_acting_osds(pool_id, ps)['acting'])
+            new_osds = set(other.pg_to_up_acting_osds(pool_id, ps)['acting'])
+            if osd in old_osds | new_osds and old_osds != new_osds:
+                moved.append(ps)
+        return moved
+
 
 class TestModule(object):
     # Testing Module Class
@@ -172,3 +212,33 @@ class TestModule(object):
         assert self.test_module._complete.call_count == 1
         # check if a PgRecovery Event was created and pg_update gets triggered
         assert module.PgRecoveryEvent.pg_update.call_count == 2
+
+    def test_pg_progress_changes(self):
+        pgs = {"1.0": {"state": "active"}, "1.1": {"state": "active"}}
+        assert self.test_module._pg_progress_changes(pgs) is None
+        assert self.test_module._pg_progress_changes(dict(pgs)) == set()
+        new_pgs = {"1.0": {"state": "active+clean"}, "1.2": {"state": "active"}}
+        assert self.test_module._pg_progress_changes(new_pgs) == {"1.0", "1.1", "1.2"}
+
+    def test_osdmap_changed(self):
+        # only OSDs whose weight crossed in/out get an event
+        old_map = mock.Mock()
+        old_map.diff.return_value = {
+            "osds": [
+                {"osd": 0, "weight": [1.0, 0.0]},
+                {"osd": 1, "weight": [0.0, 1.0]},
+                {"osd": 2, "weight": [1.0, 0.5]},
+                {"osd": 3, "up": [True, False]},
+                {"osd": 4, "exists": [False, True], "weight": [0.0, 1.0]},
+                {"osd": 5, "weight": [0.0, 0.5]},
+                {"osd": 6, "exists": [True, False], "weight": [1.0, 0.0]},
+            ]
+        }
+        new_map = mock.Mock()
+        self.test_module._osd_in_out = mock.Mock()
+        self.test_module._osdmap_changed(old_map, new_map)
+        old_map.diff.assert_called_once_with(new_map)
+        old_map.dump.assert_called_once_with()
+        calls = self.test_module._osd_in_out.call_args_list
+        # osd.2 stays in, osd.5 is reweighted in, osd.6 is removed
+        assert [c[0][3:] for c in calls] == [(0, "out"), (1, "in"), (5, "in")]
@@ -1,20 +1,27 @@
 import cherrypy
 from collections import defaultdict
 from distutils.version import StrictVersion
+import fnmatch
+import gzip
+import hashlib
 import json
 import math
 import os
 import re
+import struct
+import tempfile
 import threading
 import time
 import enum
 from mgr_module import CLIReadCommand, MgrModule, MgrStandbyModule, PG_STATES, Option, ServiceInfoT, HandleCommandResult, CLIWriteCommand
 from mgr_util import get_default_addr, profile_method, build_url
+import rados
 from rbd import RBD
 from collections import namedtuple
 import yaml
 
-from typing import DefaultDict, Optional, Dict, Any, Set, cast, Tuple, Union, List, Callable
+from typing import DefaultDict, Optional, Dict, Any, Set, cast, Tuple, Union, List, Callable, \
+    Iterable, Iterator, Pattern
 
 LabelValues = Tuple[str, ...]
 Number = Union[int, float]
@@ -305,72 +312,372 @@ class HealthHistory:
         return yaml.safe_dump(self.as_dict(), explicit_start=True, default_flow_style=False)
 
 
+def promethize(path: str) -> str:
+    ''' replace illegal metric name characters '''
+    result = re.sub(r'[./\s]|::', '_', path).replace('+', '_plus')
+
+    # Hyphens usually turn into underscores, unless they are
+    # trailing
+    if result.endswith("-"):
+        result = result[0:-1] + "_minus"
+    else:
+        result = result.replace("-", "_")
+
+    return "ceph_{0}".format(result)
+
+
+def floatstr(value: float) -> str:
+    ''' represent as Go-compatible float '''
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+class CompressedCache(object):
+    """
+    One generation of the exposition: the encoded body, a gzip-compressed
+    copy of it and its ETag. Both are kept in spooled temporary files, which
+    move to disk beyond `spool_size`, and are read in chunks of CHUNK_SIZE.
+    """
+
+    COMPRESSLEVEL = 6
+    CHUNK_SIZE = 64 * 1024
+    SPOOL_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, chunks: Iterable[bytes], spool_size: int = SPOOL_SIZE) -> None:
+        # serializes seek() + read() of concurrent responses
+        self.lock = threading.Lock()
+        self.body = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.gzip_body = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        digest = hashlib.blake2b(digest_size=16)
+        with gzip.GzipFile(fileobj=self.gzip_body, mode='wb',
+                           compresslevel=self.COMPRESSLEVEL, mtime=0) as gz:
+            for chunk in chunks:
+                digest.update(chunk)
+                self.body.write(chunk)
+                gz.write(chunk)
+        self.body_size = self.body.tell()
+        self.gzip_size = self.gzip_body.tell()
+        self.etag = '"{}"'.format(digest.hexdigest())
+
+    def read(self, gzipped: bool = False) -> Iterator[bytes]:
+        f = self.gzip_body if gzipped else self.body
+        offset = 0
+        while True:
+            with self.lock:
+                f.seek(offset)
+                chunk = f.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    >>> accepts_gzip('gzip')
+    True
+    >>> accepts_gzip('deflate, gzip;q=1.0, *;q=0.5')
+    True
+    >>> accepts_gzip('gzip;q=0')
+    False
+    >>> accepts_gzip('identity')
+    False
+    """
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() not in ('gzip', 'x-gzip'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    >>> etag_matches('"abc"', '"abc"')
+    True
+    >>> etag_matches('W/"abc", "def"', '"abc"')
+    True
+    >>> etag_matches('*', '"abc"')
+    True
+    >>> etag_matches('"def"', '"abc"')
+    False
+    """
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def respond_from_cache(cache: CompressedCache,
+                       stats: Optional[Dict[str, int]] = None) -> Iterator[bytes]:
+    """
+    Stream `cache` to the current cherrypy request, honouring the
+    `If-None-Match` and `Accept-Encoding` request headers.
+    """
+    cherrypy.response.stream = True
+    headers = cherrypy.response.headers
+    headers['Content-Type'] = 'text/plain'
+    headers['ETag'] = cache.etag
+    headers['Vary'] = 'Accept-Encoding'
+
+    if etag_matches(cherrypy.request.headers.get('If-None-Match', ''), cache.etag):
+        if stats is not None:
+            stats['not_modified'] += 1
+        cherrypy.response.status = 304
+        return iter(())
+
+    if accepts_gzip(cherrypy.request.headers.get('Accept-Encoding', '')):
+        if stats is not None:
+            stats['hit'] += 1
+        headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(cache.gzip_size)
+        return cache.read(gzipped=True)
+
+    if stats is not None:
+        stats['miss'] += 1
+    headers['Content-Length'] = str(cache.body_size)
+    return cache.read()
+
+
+RBD_DIRECTORY = 'rbd_directory'
+RBD_DIRECTORY_ID_PREFIX = 'id_'
+
+
+def list_rbd_directory(ioctx: rados.Ioctx, start_after: str, max_return: int) -> List[Tuple[str, str]]:
+    """
+    Return up to `max_return` (image id, image name) pairs from the
+    rbd_directory object of the ioctx namespace, starting after the image id
+    `start_after`.
+    """
+    with rados.ReadOpCtx() as read_op:
+        it, _ = ioctx.get_omap_vals(read_op, RBD_DIRECTORY_ID_PREFIX + start_after,
+                                    RBD_DIRECTORY_ID_PREFIX, max_return)
+        try:
+            ioctx.operate_read_op(read_op, RBD_DIRECTORY)
+        except rados.ObjectNotFound:
+            return []
+        return [(k[len(RBD_DIRECTORY_ID_PREFIX):], decode_rbd_directory_name(v))
+                for k, v in it]
+
+
+def lookup_rbd_directory(ioctx: rados.Ioctx, image_ids: List[str]) -> Dict[str, str]:
+    """
+    Return the names of the given image ids found in the rbd_directory object
+    of the ioctx namespace.
+    """
+    with rados.ReadOpCtx() as read_op:
+        it, _ = ioctx.get_omap_vals_by_keys(
+            read_op, [RBD_DIRECTORY_ID_PREFIX + i for i in image_ids])
+        try:
+            ioctx.operate_read_op(read_op, RBD_DIRECTORY)
+        except rados.ObjectNotFound:
+            return {}
+        return {k[len(RBD_DIRECTORY_ID_PREFIX):]: decode_rbd_directory_name(v)
+                for k, v in it}
+
+
+def decode_rbd_directory_name(value: bytes) -> str:
+    """
+    The values of rbd_directory are encoded strings: a 32 bit little endian
+    length followed by the characters.
+
+    >>> decode_rbd_directory_name(b'\\x03\\x00\\x00\\x00img')
+    'img'
+    """
+    length, = struct.unpack_from('<I', value)
+    return value[4:4 + length].decode('utf-8')
+
+
+class SeriesBudget(object):
+    """
+    Limits the number of series per metric family and in total. Once a
+    limit is reached, the values of new series of a counter family are added
+    up in a single series of the family whose label values are all OTHER,
+    and new series of other families are dropped: a sum of gauges means
+    nothing.
+
+    A limit of 0 means unlimited.
+    """
+
+    OTHER = '__other__'
+
+    def __init__(self, family_limit: int = 0, global_limit: int = 0) -> None:
+        self.family_limit = family_limit
+        self.global_limit = global_limit
+        self.lock = threading.Lock()
+        self.series = 0
+
+    def acquire(self, family_series: int) -> bool:
+        with self.lock:
+            if self.family_limit and family_series >= self.family_limit:
+                return False
+            if self.global_limit and self.series >= self.global_limit:
+                return False
+            self.series += 1
+            return True
+
+    def release(self, series: int) -> None:
+        with self.lock:
+            self.series -= series
+
+    def set_limits(self, family_limit: int, global_limit: int) -> None:
+        with self.lock:
+            self.family_limit = family_limit
+            self.global_limit = global_limit
+
+
 class Metric(object):
+    # shared by all metrics, configured by the module
+    budget: Optional[SeriesBudget] = None
+
     def __init__(self, mtype: str, name: str, desc: str, labels: Optional[LabelValues] = None) -> None:
         self.mtype = mtype
         self.name = name
         self.desc = desc
         self.labelnames = labels  # tuple if present
         self.value: Dict[LabelValues, Number] = {}
-
-    def clear(self) -> None:
+        # series accounted in `budget`, and series aggregated into the OTHER
+        # series or dropped since the last clear()
+        self.budgeted = 0
+        self.aggregated = 0
+        self.dropped = 0
+        self._budget: Optional[SeriesBudget] = None
+        # Rendering caches. They survive clear() so that a family whose
+        # values did not change since the last collection cycle doesn't
+        # need to be formatted again.
+        self._header_key: Optional[Tuple[str, str, str, Optional[LabelValues]]] = None
+        self._header = ''
+        self._prom_name = ''
+        self._prefixes: Dict[LabelValues, str] = {}
+        self._rendered_value: Optional[Dict[LabelValues, Number]] = None
+        self._rendered = ''
+
+    def clear(self, keep_budget: bool = False) -> None:
+        """
+        Drop the values. With keep_budget the series stay accounted in the
+        budget (and the aggregated count is kept) until the next clear(),
+        so that families which have been rendered still count against the
+        global limit while the other families are being collected.
+        """
+        if not keep_budget:
+            self._release_budget()
         self.value = {}
 
     def set(self, value: Number, labelvalues: Optional[LabelValues] = None) -> None:
         # labelvalues must be a tuple
         labelvalues = labelvalues or ('',)
+        if labelvalues not in self.value and not self._acquire_budget():
+            if self.mtype != 'counter':
+                self.dropped += 1
+                return
+            self.aggregated += 1
+            labelvalues = self._other_labelvalues(labelvalues)
+            value += self.value.get(labelvalues, 0)
         self.value[labelvalues] = value
 
-    def str_expfmt(self) -> str:
-
-        def promethize(path: str) -> str:
-            ''' replace illegal metric name characters '''
-            result = re.sub(r'[./\s]|::', '_', path).replace('+', '_plus')
-
-            # Hyphens usually turn into underscores, unless they are
-            # trailing
-            if result.endswith("-"):
-                result = result[0:-1] + "_minus"
-            else:
-                result = result.replace("-", "_")
-
-            return "ceph_{0}".format(result)
-
-        def floatstr(value: float) -> str:
-            ''' represent as Go-compatible float '''
-            if value == float('inf'):
-                return '+Inf'
-            if value == float('-inf'):
-                return '-Inf'
-            if math.isnan(value):
-                return 'NaN'
-            return repr(float(value))
-
-        name = promethize(self.name)
-        expfmt = '''
-# HELP {name} {desc}
-# TYPE {name} {mtype}'''.format(
-            name=name,
+    def _acquire_budget(self) -> bool:
+        """
+        Account for a new series. Returns False if it is over the limits.
+        """
+        budget = self.budget
+        if budget is None:
+            return True
+        if budget is not self._budget:
+            # the budget has been replaced, the old one is gone along with
+            # what was accounted in it
+            self._budget = budget
+            self.budgeted = 0
+        if budget.acquire(self.budgeted):
+            self.budgeted += 1
+            return True
+        return False
+
+    def _release_budget(self) -> None:
+        if self._budget is not None and self._budget is self.budget and self.budgeted:
+            self._budget.release(self.budgeted)
+        self.budgeted = 0
+        self.aggregated = 0
+        self.dropped = 0
+
+    def _other_labelvalues(self, labelvalues: LabelValues) -> LabelValues:
+        return (SeriesBudget.OTHER,) * len(labelvalues)
+
+    def _update_header(self) -> None:
+        key = (self.mtype, self.name, self.desc, self.labelnames)
+        if key == self._header_key:
+            return
+        self._header_key = key
+        self._prom_name = promethize(self.name)
+        self._header = '\n# HELP {name} {desc}\n# TYPE {name} {mtype}'.format(
+            name=self._prom_name,
             desc=self.desc,
             mtype=self.mtype,
         )
+        # series prefixes embed the name and label names
+        self._prefixes = {}
+        self._rendered_value = None
+
+    def _series_prefix(self, labelvalues: LabelValues) -> str:
+        if self.labelnames:
+            labels_list = zip(self.labelnames, labelvalues)
+            labels = ','.join('%s="%s"' % (k, v) for k, v in labels_list)
+        else:
+            labels = ''
+        if labels:
+            return '\n{name}{{{labels}}} '.format(name=self._prom_name, labels=labels)
+        return '\n{name} '.format(name=self._prom_name)
 
+    def str_expfmt(self) -> str:
+        """
+        Render the metric in the Prometheus text exposition format.
+
+        The result is cached and only rebuilt if the values changed since the
+        previous call. Series prefixes (name and labels) are cached for the
+        label values that are still present.
+
+        >>> m = Metric('gauge', 'osd.op_r', 'reads', ('ceph_daemon',))
+        >>> m.set(1, ('osd.0',))
+        >>> print(m.str_expfmt())
+        <BLANKLINE>
+        # HELP ceph_osd_op_r reads
+        # TYPE ceph_osd_op_r gauge
+        ceph_osd_op_r{ceph_daemon="osd.0"} 1.0
+        """
+        self._update_header()
+        if self._rendered_value is not None and self._rendered_value == self.value:
+            return self._rendered
+
+        old_prefixes = self._prefixes
+        prefixes: Dict[LabelValues, str] = {}
+        out = [self._header]
         for labelvalues, value in self.value.items():
-            if self.labelnames:
-                labels_list = zip(self.labelnames, labelvalues)
-                labels = ','.join('%s="%s"' % (k, v) for k, v in labels_list)
-            else:
-                labels = ''
-            if labels:
-                fmtstr = '\n{name}{{{labels}}} {value}'
-            else:
-                fmtstr = '\n{name} {value}'
-            expfmt += fmtstr.format(
-                name=name,
-                labels=labels,
-                value=floatstr(value),
-            )
-        return expfmt
+            prefix = old_prefixes.get(labelvalues)
+            if prefix is None:
+                prefix = self._series_prefix(labelvalues)
+            prefixes[labelvalues] = prefix
+            out.append(prefix)
+            out.append(floatstr(value))
+
+        self._prefixes = prefixes
+        self._rendered_value = dict(self.value)
+        self._rendered = ''.join(out)
+        return self._rendered
 
     def group_by(
         self,
@@ -460,7 +767,8 @@ class Metric(object):
             values[tuple(labels.values())] = metric_value
 
         new_metric = Metric(self.mtype, name if name else self.name, self.desc, labelnames)
-        new_metric.value = values
+        for labelvalues, value in values.items():
+            new_metric.set(value, labelvalues)
 
         return new_metric
 
@@ -473,7 +781,7 @@ class MetricCounter(Metric):
         super(MetricCounter, self).__init__('counter', name, desc, labels)
         self.value = defaultdict(lambda: 0)
 
-    def clear(self) -> None:
+    def clear(self, keep_budget: bool = False) -> None:
         pass  # Skip calls to clear as we want to keep the counters here.
 
     def set(self,
@@ -487,9 +795,164 @@ class MetricCounter(Metric):
             labelvalues: Optional[LabelValues] = None) -> None:
         # labelvalues must be a tuple
         labelvalues = labelvalues or ('',)
+        if labelvalues not in self.value and not self._acquire_budget():
+            self.aggregated += 1
+            labelvalues = self._other_labelvalues(labelvalues)
         self.value[labelvalues] += value
 
 
+class Collector(object):
+    """
+    A unit of metric collection: a method of the module together with the
+    metric families it fills.
+
+    Every collector has its own worker thread, interval and timeout, so that
+    a slow collector (e.g. RBD per image stats) doesn't hold back the
+    others. The result of the last successful run is kept rendered in
+    `output` and streamed into the cache by `Module.collect_scheduled()`.
+    """
+
+    def __init__(self,
+                 module: 'Module',
+                 name: str,
+                 func: Callable[[], None],
+                 families: Optional[List[str]] = None) -> None:
+        self.mod = module
+        self.name = name
+        self.func = func
+        # ordered set of the keys in `Module.metrics` owned by this collector
+        self.families: Dict[str, None] = dict.fromkeys(families or [])
+        self.interval = 0.0  # 0 means every scrape interval
+        self.timeout: Optional[float] = None  # None means the scrape interval
+        # rendered families of the last successful run
+        self.output: List[str] = []
+        self.duration = 0.0
+        self.duration_sum = 0.0
+        self.runs = 0
+        self.last_run = 0.0
+        self.last_success = 0.0
+        self.lock = threading.Lock()
+        self.active = False
+        self.thread: Optional[threading.Thread] = None
+        self.trigger_event = threading.Event()
+        self.done_event = threading.Event()
+        self.done_event.set()
+
+    def add_family(self, path: str) -> None:
+        self.families[path] = None
+
+    def run(self) -> None:
+        with self.lock:
+            start = time.time()
+            self.last_run = start
+            for path in list(self.families):
+                metric = self.mod.metrics.get(path)
+                if metric is not None:
+                    metric.clear()
+            try:
+                self.func()
+            except Exception:
+                # keep serving the output of the last successful run
+                self.mod.log.exception('collector %s failed:', self.name)
+                return
+            finally:
+                self.duration = time.time() - start
+                self.duration_sum += self.duration
+                self.runs += 1
+
+            _metrics = []
+            for path in list(self.families):
+                metric = self.mod.metrics.get(path)
+                if metric is not None:
+                    _metrics.append(metric.str_expfmt())
+                    metric.clear(keep_budget=True)
+            self.output = _metrics
+            self.last_success = time.time()
+
+    def is_due(self, now: float) -> bool:
+        return now - self.last_run >= self.interval
+
+    def start(self) -> None:
+        self.active = True
+        self.thread = threading.Thread(target=self._serve,
+                                       name='prometheus-{}'.format(self.name),
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.active = False
+        self.trigger_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def trigger(self) -> bool:
+        """
+        Ask the worker to run the collector. Returns False if the previous run
+        is still in progress.
+        """
+        if not self.done_event.is_set():
+            return False
+        self.done_event.clear()
+        self.trigger_event.set()
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        return self.done_event.wait(max(timeout, 0))
+
+    def _serve(self) -> None:
+        while True:
+            self.trigger_event.wait()
+            self.trigger_event.clear()
+            if not self.active:
+                self.done_event.set()
+                return
+            try:
+                self.run()
+            finally:
+                self.done_event.set()
+
+
+class PerfCounterFilter(object):
+    """
+    Decides which perf counters get exported.
+
+    Include and exclude patterns are shell-style wildcards matched against
+    `<daemon type>.<counter path>`, e.g. `osd.bluestore.*` or `*.objecter.*`.
+    Each list is compiled into a single regex and the decision is memoized
+    per counter, so that every counter is matched only once.
+
+    >>> f = PerfCounterFilter('osd.* mds.*', 'osd.bluestore.*')
+    >>> f('osd', 'osd.op_r'), f('osd', 'bluestore.kv_flush_lat'), f('rgw', 'rgw.req')
+    (True, False, False)
+    >>> PerfCounterFilter()('rgw', 'rgw.req')
+    True
+    """
+
+    def __init__(self, include: str = '', exclude: str = '') -> None:
+        self.patterns = (include, exclude)
+        self.include = self._compile(include)
+        self.exclude = self._compile(exclude)
+        self._decisions: Dict[Tuple[str, str], bool] = {}
+
+    @staticmethod
+    def _compile(patterns: str) -> Optional[Pattern[str]]:
+        globs = [p for p in re.split(r'[\s,]+', patterns) if p]
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(g) for g in globs))
+
+    def __call__(self, daemon_type: str, path: str) -> bool:
+        key = (daemon_type, path)
+        decision = self._decisions.get(key)
+        if decision is None:
+            name = '{}.{}'.format(daemon_type, path)
+            decision = ((self.include is None or self.include.match(name) is not None)
+                        and (self.exclude is None or self.exclude.match(name) is None))
+            self._decisions[key] = decision
+        return decision
+
+
 class MetricCollectionThread(threading.Thread):
     def __init__(self, module: 'Module') -> None:
         self.mod = module
@@ -505,7 +968,7 @@ class MetricCollectionThread(threading.Thread):
                 start_time = time.time()
 
                 try:
-                    data = self.mod.collect()
+                    cache = self.mod.collect_scheduled()
                 except Exception:
                     # Log any issues encountered during the data collection and continue
                     self.mod.log.exception("failed to collect metrics:")
@@ -530,7 +993,7 @@ class MetricCollectionThread(threading.Thread):
                     sleep_time = 0
 
                 with self.mod.collect_lock:
-                    self.mod.collect_cache = data
+                    self.mod.collect_cache = cache
                     self.mod.collect_time = duration
 
                 self.event.wait(sleep_time)
@@ -538,6 +1001,15 @@ class MetricCollectionThread(threading.Thread):
                 self.mod.log.error('No MON connection')
                 self.event.wait(self.mod.scrape_interval)
 
+    def run(self) -> None:
+        for collector in self.mod.collectors.values():
+            collector.start()
+        try:
+            super(MetricCollectionThread, self).run()
+        finally:
+            for collector in self.mod.collectors.values():
+                collector.stop()
+
     def stop(self) -> None:
         self.active = False
         self.event.set()
@@ -566,11 +1038,50 @@ class Module(MgrModule):
             'stale_cache_strategy',
             default='log'
         ),
+        Option(
+            'collector_intervals',
+            default='',
+            desc='how often individual collectors run',
+            long_desc='Comma or space separated list of <collector>=<seconds> '
+            'entries. Collectors without an entry (or with 0) run every '
+            'scrape_interval.',
+        ),
+        Option(
+            'collector_timeouts',
+            default='',
+            desc='how long to wait for individual collectors',
+            long_desc='Comma or space separated list of <collector>=<seconds> '
+            'entries. If a collector does not finish in time, the data of its '
+            'previous run is served. Defaults to, and is capped at, half of '
+            'scrape_interval.',
+        ),
         Option(
             'cache',
             type='bool',
             default=True,
         ),
+        Option(
+            'cache_spool_size',
+            type='size',
+            default=CompressedCache.SPOOL_SIZE,
+            desc='size above which the cached metrics are kept in a temporary file',
+        ),
+        Option(
+            'perf_counters_include',
+            default='',
+            desc='perf counters to export',
+            long_desc='Comma or space separated list of <daemon type>.<counter path> '
+            'patterns, e.g. "osd.* mds.*". Shell-style wildcards are allowed. '
+            'If empty, all perf counters are exported.',
+        ),
+        Option(
+            'perf_counters_exclude',
+            default='',
+            desc='perf counters not to export',
+            long_desc='Comma or space separated list of <daemon type>.<counter path> '
+            'patterns, e.g. "osd.bluestore.* *.objecter.*". Takes precedence '
+            'over perf_counters_include.',
+        ),
         Option(
             'rbd_stats_pools',
             default=''
@@ -580,6 +1091,42 @@ class Module(MgrModule):
             type='int',
             default=300
         ),
+        Option(
+            name='rbd_stats_max_images',
+            type='int',
+            default=100000,
+            desc='maximum number of RBD images to collect stats for',
+        ),
+        Option(
+            name='rbd_stats_scan_batch',
+            type='int',
+            default=10000,
+            desc='maximum number of RBD image names to list per pool and collection',
+            long_desc='The image names of the pools in rbd_stats_pools are refreshed '
+            'every rbd_stats_pools_refresh_interval seconds by listing the '
+            'rbd_directory objects incrementally, in batches of this size.',
+        ),
+        Option(
+            name='series_limit_per_family',
+            type='uint',
+            default=100000,
+            desc='maximum number of series exported per metric family',
+            long_desc='Once a metric family reaches this many series, the values '
+            'of further series of a counter are added up in a single series '
+            'whose label values are all "__other__", those of other metrics are '
+            'dropped. 0 means unlimited.',
+        ),
+        Option(
+            name='series_limit',
+            type='uint',
+            default=1000000,
+            desc='maximum number of series exported in total',
+            long_desc='Once this many series are exported, the values of further '
+            'series of a counter are added up per metric family in a single '
+            'series whose label values are all "__other__", those of other '
+            'metrics are dropped. The cluster wide and health metrics are not '
+            'limited. 0 means unlimited.',
+        ),
         Option(
             name='standby_behaviour',
             type='str',
@@ -600,6 +1147,26 @@ class Module(MgrModule):
     STALE_CACHE_FAIL = 'fail'
     STALE_CACHE_RETURN = 'return'
 
+    # fraction of the scrape interval to wait for collectors at most
+    COLLECTOR_TIMEOUT_RATIO = 0.5
+
+    # maximum number of image names read from a rbd_directory object at once
+    RBD_DIRECTORY_BATCH = 1024
+
+    # metrics about the exporter itself, not owned by any collector
+    EXPORTER_METRICS = [
+        'prometheus_collect_duration_seconds_sum',
+        'prometheus_collect_duration_seconds_count',
+        'prometheus_collector_duration_seconds',
+        'prometheus_collector_staleness_seconds',
+        'prometheus_response_cache_requests',
+        'prometheus_response_cache_hit_ratio',
+        'prometheus_series',
+        'prometheus_series_limit',
+        'prometheus_series_aggregated',
+        'prometheus_series_dropped',
+    ]
+
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super(Module, self).__init__(*args, **kwargs)
         self.metrics = self._setup_static_metrics()
@@ -608,11 +1175,15 @@ class Module(MgrModule):
         self.collect_time = 0.0
         self.scrape_interval: float = 15.0
         self.cache = True
+        self.cache_spool_size = CompressedCache.SPOOL_SIZE
         self.stale_cache_strategy: str = self.STALE_CACHE_FAIL
-        self.collect_cache: Optional[str] = None
+        self.collect_cache: Optional[CompressedCache] = None
+        # cumulative, only updated by the cherrypy handler under collect_lock
+        self.response_cache_stats: Dict[str, int] = {'hit': 0, 'not_modified': 0, 'miss': 0}
         self.rbd_stats = {
             'pools': {},
             'pools_refresh_time': 0,
+            'num_images': 0,
             'counters_info': {
                 'write_ops': {'type': self.PERFCOUNTER_COUNTER,
                               'desc': 'RBD image writes count'},
@@ -628,6 +1199,12 @@ class Module(MgrModule):
                                  'desc': 'RBD image reads latency (msec)'},
             },
         }  # type: Dict[str, Any]
+        self.collectors = self._setup_collectors()
+        self.perf_counter_filter = PerfCounterFilter()
+        # (daemon, path, type) -> (stattype, path, label names, labels)
+        self.perf_counter_info: Dict[Tuple[str, str, int], Tuple[str, str, LabelValues, LabelValues]] = {}
+        # metric families aggregating series because of the series limits
+        self.series_limited: List[str] = []
         global _global_instance
         _global_instance = self
         self.metrics_thread = MetricCollectionThread(_global_instance)
@@ -818,8 +1395,100 @@ class Module(MgrModule):
                 check.description,
             )
 
+        # cluster wide families have a single series, and the health of
+        # the cluster must be exported whatever else there is
+        for path, metric in metrics.items():
+            if not metric.labelnames or path == 'health_detail':
+                metric.budget = None
+
         return metrics
 
+    def _setup_collectors(self) -> Dict[str, Collector]:
+        def osd_pool_stats() -> List[str]:
+            return ['pool_{}'.format(stat) for stat in OSD_POOL_STATS]
+
+        collectors = [
+            Collector(self, 'health', self.get_health,
+                      ['health_status', 'health_detail']
+                      + ['healthcheck_{}'.format(check.name.lower()) for check in HEALTH_CHECKS]),
+            Collector(self, 'df', self.get_df,
+                      ['cluster_{}'.format(stat) for stat in DF_CLUSTER]
+                      + ['pool_{}'.format(stat) for stat in DF_POOL]),
+            Collector(self, 'pool_stats', self.get_pool_stats, osd_pool_stats()),
+            Collector(self, 'fs', self.get_fs, ['mds_metadata', 'fs_metadata']),
+            Collector(self, 'osd_stats', self.get_osd_stats,
+                      ['osd_{}'.format(stat) for stat in OSD_STATS]),
+            Collector(self, 'quorum_status', self.get_quorum_status,
+                      ['mon_metadata', 'mon_quorum_status']),
+            Collector(self, 'mgr_status', self.get_mgr_status,
+                      ['mgr_metadata', 'mgr_status', 'mgr_module_status', 'mgr_module_can_run']),
+            Collector(self, 'metadata_and_osd_status', self.get_metadata_and_osd_status,
+                      ['osd_flag_{}'.format(flag) for flag in OSD_FLAGS]
+                      + ['osd_metadata', 'disk_occupation', 'disk_occupation_human']
+                      + ['osd_{}'.format(state) for state in OSD_STATUS]
+                      + ['pool_metadata', 'rgw_metadata', 'rbd_mirror_metadata']),
+            Collector(self, 'pg_status', self.get_pg_status,
+                      ['pg_{}'.format(state) for state in PG_STATES] + ['pg_total']),
+            Collector(self, 'num_objects', self.get_num_objects,
+                      ['num_objects_{}'.format(obj) for obj in NUM_OBJECTS]),
+            # the families of the following collectors are created on the fly
+            Collector(self, 'perf_counters', self.get_perf_counters),
+            Collector(self, 'rbd_stats', self.get_rbd_stats),
+        ]
+        return {c.name: c for c in collectors}
+
+    def _config_collectors(self) -> None:
+        def parse(option: str) -> Dict[str, float]:
+            ret = {}
+            for entry in re.split(r'[\s,]+', cast(str, self.get_localized_module_option(option, ''))):
+                if not entry:
+                    continue
+                try:
+                    name, value = entry.split('=', 1)
+                    if name not in self.collectors:
+                        raise ValueError('unknown collector {}'.format(name))
+                    ret[name] = float(value)
+                except ValueError as e:
+                    self.log.error('ignoring invalid %s entry "%s": %s', option, entry, e)
+            return ret
+
+        intervals = parse('collector_intervals')
+        timeouts = parse('collector_timeouts')
+        for name, collector in self.collectors.items():
+            collector.interval = intervals.get(name, 0.0)
+            collector.timeout = timeouts.get(name)
+
+    def _configure(self) -> None:
+        """
+        Apply the options which can be changed while the module is running.
+        """
+        # Make the cache timeout for collecting configurable
+        self.scrape_interval = cast(float, self.get_localized_module_option('scrape_interval'))
+
+        self.stale_cache_strategy = cast(
+            str, self.get_localized_module_option('stale_cache_strategy'))
+        if self.stale_cache_strategy not in [self.STALE_CACHE_FAIL,
+                                             self.STALE_CACHE_RETURN]:
+            self.stale_cache_strategy = self.STALE_CACHE_FAIL
+
+        self._config_collectors()
+        self.cache_spool_size = cast(int, self.get_localized_module_option('cache_spool_size'))
+
+        patterns = (
+            cast(str, self.get_localized_module_option('perf_counters_include', '')),
+            cast(str, self.get_localized_module_option('perf_counters_exclude', '')))
+        if patterns != self.perf_counter_filter.patterns:
+            # a new filter also invalidates the cached perf counter layout
+            self.perf_counter_filter = PerfCounterFilter(*patterns)
+
+        family_limit = cast(int, self.get_localized_module_option('series_limit_per_family'))
+        global_limit = cast(int, self.get_localized_module_option('series_limit'))
+        if Metric.budget is None:
+            Metric.budget = SeriesBudget(family_limit, global_limit)
+        else:
+            # keep accounting the series which are already exported
+            Metric.budget.set_limits(family_limit, global_limit)
+
     def get_server_addr(self) -> str:
         """
         Return the current mgr server IP.
@@ -839,6 +1508,7 @@ class Module(MgrModule):
         self.log.info('Restarting engine...')
         cherrypy.engine.stop()
         cherrypy.server.httpserver = None
+        self._configure()
         server_port = cast(int, self.get_localized_module_option('server_port', DEFAULT_PORT))
         self.set_uri(build_url(scheme='http', host=self.get_server_addr(), port=server_port, path='/'))
         cherrypy.config.update({'server.socket_port': server_port})
@@ -886,6 +1556,7 @@ class Module(MgrModule):
                             "healthcheck %s message format is incompatible and has been dropped",
                             check.name)
                         # drop the metric, so it's no longer emitted
+                        self.metrics[path].clear()
                         del self.metrics[path]
                         continue
                     else:
@@ -907,7 +1578,7 @@ class Module(MgrModule):
     def get_pool_stats(self) -> None:
         # retrieve pool stats to provide per pool recovery metrics
         # (osd_pool_stats moved to mgr in Mimic)
-        pstats = self.get('osd_pool_stats')
+        pstats = self.get_snapshot('osd_pool_stats')
         for pool in pstats['pool_stats']:
             for stat in OSD_POOL_STATS:
                 self.metrics['pool_{}'.format(stat)].set(
@@ -918,7 +1589,7 @@ class Module(MgrModule):
     @profile_method()
     def get_df(self) -> None:
         # maybe get the to-be-exported metrics from a config?
-        df = self.get('df')
+        df = self.get_snapshot('df')
         for stat in DF_CLUSTER:
             self.metrics['cluster_{}'.format(stat)].set(df['stats'][stat])
 
@@ -931,7 +1602,7 @@ class Module(MgrModule):
 
     @profile_method()
     def get_fs(self) -> None:
-        fs_map = self.get('fs_map')
+        fs_map = self.get_snapshot('fs_map')
         servers = self.get_service_list()
         self.log.debug('standbys: {}'.format(fs_map['standbys']))
         # export standby mds metadata, default standby fs_id is '-1'
@@ -986,7 +1657,7 @@ class Module(MgrModule):
 
     @profile_method()
     def get_mgr_status(self) -> None:
-        mgr_map = self.get('mgr_map')
+        mgr_map = self.get_snapshot('mgr_map')
         servers = self.get_service_list()
 
         active = mgr_map['active_name']
@@ -1030,7 +1701,7 @@ class Module(MgrModule):
     @profile_method()
     def get_pg_status(self) -> None:
 
-        pg_summary = self.get('pg_summary')
+        pg_summary = self.get_snapshot('pg_summary')
 
         for pool in pg_summary['by_pool']:
             num_by_state = defaultdict(int)  # type: DefaultDict[str, int]
@@ -1048,7 +1719,7 @@ class Module(MgrModule):
 
     @profile_method()
     def get_osd_stats(self) -> None:
-        osd_stats = self.get('osd_stats')
+        osd_stats = self.get_snapshot('osd_stats')
         for osd in osd_stats['osd_stats']:
             id_ = osd['osd']
             for stat in OSD_STATS:
@@ -1067,14 +1738,14 @@ class Module(MgrModule):
 
     @profile_method()
     def get_metadata_and_osd_status(self) -> None:
-        osd_map = self.get('osd_map')
+        osd_map = self.get_snapshot('osd_map')
         osd_flags = osd_map['flags'].split(',')
         for flag in OSD_FLAGS:
             self.metrics['osd_flag_{}'.format(flag)].set(
                 int(flag in osd_flags)
             )
 
-        osd_devices = self.get('osd_map_crush')['devices']
+        osd_devices = self.get_snapshot('osd_map_crush')['devices']
         servers = self.get_service_list()
         for osd in osd_map['osds']:
             # id can be used to link osd metrics and metadata
@@ -1175,6 +1846,8 @@ class Module(MgrModule):
 
         if 'disk_occupation' in self.metrics:
             try:
+                # release the series of the metric being replaced
+                self.metrics['disk_occupation_human'].clear()
                 self.metrics['disk_occupation_human'] = \
                     self.metrics['disk_occupation'].group_by(
                         ['device', 'instance'],
@@ -1246,7 +1919,7 @@ class Module(MgrModule):
 
     @profile_method()
     def get_num_objects(self) -> None:
-        pg_sum = self.get('pg_summary')['pg_stats_sum']['stat_sum']
+        pg_sum = self.get_snapshot('pg_summary')['pg_stats_sum']['stat_sum']
         for obj in NUM_OBJECTS:
             stat = 'num_objects_{}'.format(obj)
             self.metrics[stat].set(pg_sum[stat])
@@ -1284,7 +1957,7 @@ class Module(MgrModule):
 
             if pool_name == "*":
                 # collect for all pools
-                osd_map = self.get('osd_map')
+                osd_map = self.get_snapshot('osd_map')
                 for pool in osd_map['pools']:
                     if 'rbd' not in pool.get('application_metadata', {}):
                         continue
@@ -1324,6 +1997,7 @@ class Module(MgrModule):
             if rbd_stats_pools != pools or time.time() >= next_refresh:
                 self.refresh_rbd_stats_pools(pools)
                 pools_refreshed = True
+        self.scan_rbd_images()
 
         pool_ids = list(self.rbd_stats['pools'])
         pool_ids.sort()
@@ -1374,6 +2048,8 @@ class Module(MgrModule):
 
         res = self.get_osd_perf_counters(self.rbd_stats['query_id'])
         assert res
+        # counters of images not known yet, resolved in one batch per namespace
+        unresolved = defaultdict(list)  # type: DefaultDict[Tuple[int, str], List[Dict[str, Any]]]
         for c in res['counters']:
             # if the pool id is not found in the object name use id of the
             # pool where the object is located
@@ -1391,18 +2067,20 @@ class Module(MgrModule):
             if nspace_name not in pool['images']:
                 continue
             image_id = c['k'][2][1]
-            if image_id not in pool['images'][nspace_name] and \
-               not pools_refreshed:
-                self.refresh_rbd_stats_pools(pools)
-                pool = self.rbd_stats['pools'][pool_id]
-                pools_refreshed = True
             if image_id not in pool['images'][nspace_name]:
+                unresolved[(pool_id, nspace_name)].append(c)
                 continue
-            counters = pool['images'][nspace_name][image_id]['c']
-            for i in range(len(c['c'])):
-                counters[i][0] += c['c'][i][0]
-                counters[i][1] += c['c'][i][1]
+            self._add_rbd_image_counters(pool['images'][nspace_name][image_id], c)
+
+        for (pool_id, nspace_name), unresolved_counters in unresolved.items():
+            images = self.resolve_rbd_images(
+                pool_id, nspace_name, {c['k'][2][1] for c in unresolved_counters})
+            for c in unresolved_counters:
+                image_id = c['k'][2][1]
+                if image_id in images:
+                    self._add_rbd_image_counters(images[image_id], c)
 
+        collector = self.collectors['rbd_stats']
         label_names = ("pool", "namespace", "image")
         for pool_id, pool in self.rbd_stats['pools'].items():
             pool_name = pool['name']
@@ -1424,6 +2102,7 @@ class Module(MgrModule):
                                     counter_info['desc'],
                                     label_names,
                                 )
+                                collector.add_family(path)
                             self.metrics[path].set(counters[i][0], labels)
                         elif counter_info['type'] == self.PERFCOUNTER_LONGRUNAVG:
                             path = 'rbd_' + key + '_sum'
@@ -1434,6 +2113,7 @@ class Module(MgrModule):
                                     counter_info['desc'] + ' Total',
                                     label_names,
                                 )
+                                collector.add_family(path)
                             self.metrics[path].set(counters[i][0], labels)
                             path = 'rbd_' + key + '_count'
                             if path not in self.metrics:
@@ -1443,20 +2123,49 @@ class Module(MgrModule):
                                     counter_info['desc'] + ' Count',
                                     label_names,
                                 )
+                                collector.add_family(path)
                             self.metrics[path].set(counters[i][1], labels)
                         i += 1
 
+        now = time.time()
+        for path, desc in (
+                ('rbd_stats_images', 'Number of RBD images stats are collected for'),
+                ('rbd_stats_image_names_staleness_seconds',
+                 'Seconds since the RBD image names were last listed completely')):
+            if path not in self.metrics:
+                self.metrics[path] = Metric('gauge', path, desc, ('pool',))
+                collector.add_family(path)
+        for pool in self.rbd_stats['pools'].values():
+            self.metrics['rbd_stats_images'].set(
+                sum(len(images) for images in pool['images'].values()), (pool['name'],))
+            refreshed = [scan['refreshed'] for scan in pool['scans'].values()]
+            if refreshed and min(refreshed):
+                self.metrics['rbd_stats_image_names_staleness_seconds'].set(
+                    now - min(refreshed), (pool['name'],))
+
+    @staticmethod
+    def _add_rbd_image_counters(image: Dict[str, Any], c: Dict[str, Any]) -> None:
+        counters = image['c']
+        for i in range(len(c['c'])):
+            counters[i][0] += c['c'][i][0]
+            counters[i][1] += c['c'][i][1]
+
     def refresh_rbd_stats_pools(self, pools: Dict[str, Set[str]]) -> None:
+        """
+        Update the pools and namespaces to collect stats for and start a new
+        listing of the image names of every namespace not being listed
+        already. The listing is advanced by scan_rbd_images().
+        """
         self.log.debug('refreshing rbd pools %s' % (pools))
 
         rbd = RBD()
-        counters_info = self.rbd_stats['counters_info']
+        now = time.time()
         for pool_name, cfg_ns_names in pools.items():
             try:
                 pool_id = self.rados.pool_lookup(pool_name)
                 with self.rados.open_ioctx(pool_name) as ioctx:
                     if pool_id not in self.rbd_stats['pools']:
-                        self.rbd_stats['pools'][pool_id] = {'images': {}}
+                        self.rbd_stats['pools'][pool_id] = {'images': {}, 'scans': {}}
                     pool = self.rbd_stats['pools'][pool_id]
                     pool['name'] = pool_name
                     pool['ns_names'] = cfg_ns_names
@@ -1464,32 +2173,127 @@ class Module(MgrModule):
                         nspace_names = list(cfg_ns_names)
                     else:
                         nspace_names = [''] + rbd.namespace_list(ioctx)
-                    for nspace_name in pool['images']:
+                    for nspace_name in list(pool['images']):
                         if nspace_name not in nspace_names:
                             del pool['images'][nspace_name]
+                            del pool['scans'][nspace_name]
                     for nspace_name in nspace_names:
                         if nspace_name and\
                            not rbd.namespace_exists(ioctx, nspace_name):
                             self.log.debug('unknown namespace %s for pool %s' %
                                            (nspace_name, pool_name))
                             continue
-                        ioctx.set_namespace(nspace_name)
                         if nspace_name not in pool['images']:
                             pool['images'][nspace_name] = {}
-                        namespace = pool['images'][nspace_name]
-                        images = {}
-                        for image_meta in RBD().list2(ioctx):
-                            image = {'n': image_meta['name']}
-                            image_id = image_meta['id']
-                            if image_id in namespace:
-                                image['c'] = namespace[image_id]['c']
-                            else:
-                                image['c'] = [[0, 0] for x in counters_info]
-                            images[image_id] = image
-                        pool['images'][nspace_name] = images
+                            pool['scans'][nspace_name] = {
+                                'marker': None,
+                                'generation': 0,
+                                'started': 0.0,
+                                'refreshed': 0.0,
+                                'missing': set(),
+                            }
+                        scan = pool['scans'][nspace_name]
+                        if scan['marker'] is None:
+                            scan['marker'] = ''
+                            scan['generation'] += 1
+                            scan['started'] = now
+                            scan['missing'] = set()
             except Exception as e:
                 self.log.error('failed listing pool %s: %s' % (pool_name, e))
-        self.rbd_stats['pools_refresh_time'] = time.time()
+        self.rbd_stats['pools_refresh_time'] = now
+
+    def _rbd_images_count(self) -> int:
+        return sum(len(images)
+                   for pool in self.rbd_stats['pools'].values()
+                   for images in pool['images'].values())
+
+    def _add_rbd_image(self, images: Dict[str, Any], image_id: str, image_name: str,
+                       generation: int, max_images: int) -> bool:
+        if image_id not in images:
+            if self.rbd_stats['num_images'] >= max_images:
+                return False
+            images[image_id] = {'c': [[0, 0] for x in self.rbd_stats['counters_info']]}
+            self.rbd_stats['num_images'] += 1
+        image = images[image_id]
+        image['n'] = image_name
+        image['g'] = generation
+        return True
+
+    def scan_rbd_images(self) -> None:
+        """
+        Advance the listing of the image names of every namespace by up to
+        rbd_stats_scan_batch names per pool. Once the listing of a namespace
+        is complete, images which have not been seen are dropped.
+        """
+        batch = cast(int, self.get_localized_module_option('rbd_stats_scan_batch', 10000))
+        max_images = cast(int, self.get_localized_module_option('rbd_stats_max_images', 100000))
+        self.rbd_stats['num_images'] = self._rbd_images_count()
+        limit_reached = False
+        for pool in self.rbd_stats['pools'].values():
+            scans = [(nspace_name, scan) for nspace_name, scan in pool['scans'].items()
+                     if scan['marker'] is not None]
+            if not scans:
+                continue
+            budget = batch
+            try:
+                with self.rados.open_ioctx(pool['name']) as ioctx:
+                    for nspace_name, scan in scans:
+                        if budget <= 0:
+                            break
+                        ioctx.set_namespace(nspace_name)
+                        images = pool['images'][nspace_name]
+                        while budget > 0:
+                            max_return = min(budget, self.RBD_DIRECTORY_BATCH)
+                            entries = list_rbd_directory(ioctx, scan['marker'], max_return)
+                            budget -= max_return
+                            for image_id, image_name in entries:
+                                if not self._add_rbd_image(images, image_id, image_name,
+                                                           scan['generation'], max_images):
+                                    limit_reached = True
+                            if len(entries) < max_return:
+                                for image_id in [i for i, image in images.items()
+                                                 if image['g'] != scan['generation']]:
+                                    del images[image_id]
+                                    self.rbd_stats['num_images'] -= 1
+                                scan['marker'] = None
+                                scan['refreshed'] = scan['started']
+                                break
+                            scan['marker'] = entries[-1][0]
+            except Exception as e:
+                self.log.error('failed listing images of pool %s: %s' % (pool['name'], e))
+        if limit_reached:
+            self.log.warning('not collecting stats for all RBD images, the limit of '
+                             'rbd_stats_max_images (%d) has been reached' % max_images)
+
+    def resolve_rbd_images(self, pool_id: int, nspace_name: str,
+                           image_ids: Set[str]) -> Dict[str, Any]:
+        """
+        Look up the names of images which haven't been listed yet, and return
+        the images of the namespace.
+        """
+        pool = self.rbd_stats['pools'][pool_id]
+        images = pool['images'][nspace_name]
+        scan = pool['scans'][nspace_name]
+        # ids known not to be in the rbd_directory are looked up once per listing
+        image_ids = image_ids - scan['missing']
+        if not image_ids:
+            return images
+        max_images = cast(int, self.get_localized_module_option('rbd_stats_max_images', 100000))
+        self.rbd_stats['num_images'] = self._rbd_images_count()
+        try:
+            with self.rados.open_ioctx(pool['name']) as ioctx:
+                ioctx.set_namespace(nspace_name)
+                names = lookup_rbd_directory(ioctx, sorted(image_ids))
+        except Exception as e:
+            self.log.error('failed looking up images of pool %s: %s' % (pool['name'], e))
+            return images
+        for image_id in image_ids:
+            if image_id not in names:
+                scan['missing'].add(image_id)
+            else:
+                self._add_rbd_image(images, image_id, names[image_id],
+                                    scan['generation'], max_images)
+        return images
 
     def shutdown_rbd_stats(self) -> None:
         if 'query_id' in self.rbd_stats:
@@ -1507,8 +2311,12 @@ class Module(MgrModule):
         Intended for RGW sync perf. counters but extendable as required.
         See: https://tracker.ceph.com/issues/45311
         """
+        collector = self.collectors['perf_counters']
         new_metrics = {}
-        for metric_path, metrics in self.metrics.items():
+        for metric_path in list(collector.families):
+            metrics = self.metrics.get(metric_path)
+            if metrics is None:
+                continue
             # Address RGW sync perf. counters.
             match = re.search(r'^data-sync-from-(.*)\.', metric_path)
             if match:
@@ -1524,76 +2332,184 @@ class Module(MgrModule):
                     new_metrics[new_path].set(value, label_values + (match.group(1),))
 
         self.metrics.update(new_metrics)
+        for new_path in new_metrics:
+            collector.add_family(new_path)
+
+    def exporter_metric(self,
+                        mtype: str,
+                        path: str,
+                        desc: str,
+                        labels: Optional[LabelValues] = None) -> Metric:
+        """
+        Get or create one of the EXPORTER_METRICS. They are bounded by the
+        number of collectors and families, so they are not subject to the
+        series limits.
+        """
+        metric = self.metrics.get(path)
+        if metric is None:
+            metric = Metric(mtype, path, desc, labels)
+            metric.budget = None
+            self.metrics[path] = metric
+        return metric
 
     def get_collect_time_metrics(self) -> None:
-        sum_metric = self.metrics.get('prometheus_collect_duration_seconds_sum')
-        count_metric = self.metrics.get('prometheus_collect_duration_seconds_count')
-        if sum_metric is None:
-            sum_metric = MetricCounter(
-                'prometheus_collect_duration_seconds_sum',
-                'The sum of seconds took to collect all metrics of this exporter',
-                ('method',))
-            self.metrics['prometheus_collect_duration_seconds_sum'] = sum_metric
-        if count_metric is None:
-            count_metric = MetricCounter(
-                'prometheus_collect_duration_seconds_count',
-                'The amount of metrics gathered for this exporter',
-                ('method',))
-            self.metrics['prometheus_collect_duration_seconds_count'] = count_metric
-
-        # Collect all timing data and make it available as metric, excluding the
-        # `collect` method because it has not finished at this point and hence
-        # there's no `_execution_duration` attribute to be found. The
-        # `_execution_duration` attribute is added by the `profile_method`
-        # decorator.
-        for method_name, method in Module.__dict__.items():
-            duration = getattr(method, '_execution_duration', None)
-            if duration is not None:
-                cast(MetricCounter, sum_metric).add(duration, (method_name,))
-                cast(MetricCounter, count_metric).add(1, (method_name,))
+        sum_metric = self.exporter_metric(
+            'counter',
+            'prometheus_collect_duration_seconds_sum',
+            'The sum of seconds took to collect all metrics of this exporter',
+            ('method',))
+        count_metric = self.exporter_metric(
+            'counter',
+            'prometheus_collect_duration_seconds_count',
+            'The amount of metrics gathered for this exporter',
+            ('method',))
+        duration_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_collector_duration_seconds',
+            'Seconds the last run of a collector took',
+            ('collector',))
+        staleness_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_collector_staleness_seconds',
+            'Seconds since the data of a collector was last refreshed',
+            ('collector',))
 
-    @profile_method(True)
-    def collect(self) -> str:
-        # Clear the metrics before scraping
-        for k in self.metrics.keys():
-            self.metrics[k].clear()
-
-        self.get_health()
-        self.get_df()
-        self.get_pool_stats()
-        self.get_fs()
-        self.get_osd_stats()
-        self.get_quorum_status()
-        self.get_mgr_status()
-        self.get_metadata_and_osd_status()
-        self.get_pg_status()
-        self.get_num_objects()
-
-        for daemon, counters in self.get_all_perf_counters().items():
-            for path, counter_info in counters.items():
-                # Skip histograms, they are represented by long running avgs
-                stattype = self._stattype_to_str(counter_info['type'])
-                if not stattype or stattype == 'histogram':
-                    self.log.debug('ignoring %s, type %s' % (path, stattype))
-                    continue
+        # The durations are tracked by the collectors, the method label is
+        # the name of the method doing the collection.
+        now = time.time()
+        for collector in self.collectors.values():
+            method_name = collector.func.__name__
+            sum_metric.set(collector.duration_sum, (method_name,))
+            count_metric.set(collector.runs, (method_name,))
+            if collector.runs:
+                duration_metric.set(collector.duration, (collector.name,))
+            if collector.last_success:
+                staleness_metric.set(now - collector.last_success, (collector.name,))
+
+    def get_response_cache_metrics(self) -> None:
+        requests_metric = self.exporter_metric(
+            'counter',
+            'prometheus_response_cache_requests',
+            'Scrapes answered from the cached exposition by result '
+            '(hit=precompressed, not_modified=ETag matched, miss=uncompressed)',
+            ('result',))
+        ratio_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_response_cache_hit_ratio',
+            'Ratio of scrapes answered without sending an uncompressed body')
+
+        stats = dict(self.response_cache_stats)
+        for result, count in stats.items():
+            requests_metric.set(count, (result,))
+        total = sum(stats.values())
+        ratio_metric.set((total - stats['miss']) / total if total else 0)
+
+    def get_series_budget_metrics(self) -> None:
+        series_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_series',
+            'Number of series exported, as accounted against series_limit')
+        limit_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_series_limit',
+            'Maximum number of series exported (0=unlimited)',
+            ('scope',))
+        aggregated_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_series_aggregated',
+            'Number of series of a metric family aggregated into its '
+            '__other__ series during the last collection',
+            ('family',))
+        dropped_metric = self.exporter_metric(
+            'gauge',
+            'prometheus_series_dropped',
+            'Number of series of a metric family dropped during the last '
+            'collection',
+            ('family',))
+
+        budget = Metric.budget
+        if budget is None:
+            return
+        series_metric.set(budget.series)
+        limit_metric.set(budget.family_limit, ('family',))
+        limit_metric.set(budget.global_limit, ('global',))
+
+        limited = []
+        # collector threads add families meanwhile
+        for path, metric in list(self.metrics.items()):
+            if metric.aggregated:
+                aggregated_metric.set(metric.aggregated, (promethize(metric.name),))
+            if metric.dropped:
+                dropped_metric.set(metric.dropped, (promethize(metric.name),))
+            if metric.aggregated or metric.dropped:
+                limited.append(path)
+        limited.sort()
+        if limited != self.series_limited:
+            self.series_limited = limited
+            self.update_series_limit_health()
+
+    def update_series_limit_health(self) -> None:
+        checks: Dict[str, Dict[str, Any]] = {}
+        if self.series_limited:
+            checks['PROMETHEUS_SERIES_LIMIT'] = {
+                'severity': 'warning',
+                'summary': '{} metric families exceed the prometheus series limits'.format(
+                    len(self.series_limited)),
+                'count': len(self.series_limited),
+                'detail': [
+                    '{} has {} series aggregated into __other__ and {} dropped'.format(
+                        promethize(path), self.metrics[path].aggregated,
+                        self.metrics[path].dropped)
+                    for path in self.series_limited
+                    if path in self.metrics
+                ],
+            }
+        self.set_health_checks(checks)
+
+    @profile_method()
+    def get_perf_counters(self) -> None:
+        collector = self.collectors['perf_counters']
+        snapshot = self.get_perf_counter_snapshot(counter_filter=self.perf_counter_filter)
+        schema = snapshot.schema
+        # The derived metadata of a counter is kept across cycles, but only for
+        # the counters that are still reported
+        old_info = self.perf_counter_info
+        self.perf_counter_info = {}
+        for daemon_idx, daemon in enumerate(snapshot.daemons):
+            for row in snapshot.rows(daemon_idx):
+                counter = snapshot.counter_index[row]
+                counter_type = schema.types[counter]
+                key = (daemon, schema.paths[counter], counter_type)
+                info = old_info.get(key)
+                if info is None:
+                    stattype = self._stattype_to_str(counter_type)
+                    if not stattype or stattype == 'histogram':
+                        # Skip histograms, they are represented by long running avgs
+                        self.log.debug('ignoring %s, type %s' % (key[1], stattype))
+                        info = ('', key[1], (), ())
+                    else:
+                        info = (stattype,) + self._perfpath_to_path_labels(daemon, key[1])
+                self.perf_counter_info[key] = info
 
-                path, label_names, labels = self._perfpath_to_path_labels(
-                    daemon, path)
+                stattype, path, label_names, labels = info
+                if not stattype:
+                    continue
 
                 # Get the value of the counter
-                value = self._perfvalue_to_value(
-                    counter_info['type'], counter_info['value'])
+                value = self._perfvalue_to_value(counter_type, snapshot.values[row])
+                description = schema.descriptions[counter]
 
                 # Represent the long running avgs as sum/count pairs
-                if counter_info['type'] & self.PERFCOUNTER_LONGRUNAVG:
+                if counter_type & self.PERFCOUNTER_LONGRUNAVG:
                     _path = path + '_sum'
                     if _path not in self.metrics:
                         self.metrics[_path] = Metric(
                             stattype,
                             _path,
-                            counter_info['description'] + ' Total',
+                            description + ' Total',
                             label_names,
                         )
+                        collector.add_family(_path)
                     self.metrics[_path].set(value, labels)
 
                     _path = path + '_count'
@@ -1601,31 +2517,80 @@ class Module(MgrModule):
                         self.metrics[_path] = Metric(
                             'counter',
                             _path,
-                            counter_info['description'] + ' Count',
+                            description + ' Count',
                             label_names,
                         )
-                    self.metrics[_path].set(counter_info['count'], labels,)
+                        collector.add_family(_path)
+                    self.metrics[_path].set(snapshot.counts[row], labels,)
                 else:
                     if path not in self.metrics:
                         self.metrics[path] = Metric(
                             stattype,
                             path,
-                            counter_info['description'],
+                            description,
                             label_names,
                         )
+                        collector.add_family(path)
                     self.metrics[path].set(value, labels)
 
         self.add_fixed_name_metrics()
-        self.get_rbd_stats()
 
+    def render_chunks(self) -> Iterator[str]:
+        """
+        Merge the output of the last successful run of every collector with
+        the metrics about the exporter itself, one metric family at a time.
+        """
         self.get_collect_time_metrics()
+        self.get_response_cache_metrics()
+        self.get_series_budget_metrics()
 
-        # Return formatted metrics and clear no longer used data
-        _metrics = [m.str_expfmt() for m in self.metrics.values()]
-        for k in self.metrics.keys():
-            self.metrics[k].clear()
+        for collector in self.collectors.values():
+            yield from collector.output
+        for path in self.EXPORTER_METRICS:
+            metric = self.metrics.get(path)
+            if metric is not None:
+                yield metric.str_expfmt()
+                metric.clear()
+        yield '\n'
 
-        return ''.join(_metrics) + '\n'
+    def render(self) -> str:
+        return ''.join(self.render_chunks())
+
+    @profile_method(True)
+    def collect(self) -> str:
+        """
+        Run all collectors one after another and return the formatted metrics.
+        """
+        for collector in self.collectors.values():
+            collector.run()
+        return self.render()
+
+    def collect_scheduled(self) -> CompressedCache:
+        """
+        Run the collectors which are due in their worker threads and wait for
+        each of them up to its timeout. Collectors which are still running
+        contribute the output of their previous run.
+        """
+        start = time.time()
+        triggered = []
+        for collector in self.collectors.values():
+            if collector.is_due(start) and collector.trigger():
+                triggered.append(collector)
+
+        # the cache is considered stale once collecting takes a scrape
+        # interval, so don't wait for slow collectors nearly that long
+        max_timeout = self.scrape_interval * self.COLLECTOR_TIMEOUT_RATIO
+        for collector in triggered:
+            timeout = max_timeout
+            if collector.timeout is not None:
+                timeout = min(collector.timeout, max_timeout)
+            if not collector.wait(start + timeout - time.time()):
+                self.log.warning(
+                    'collector %s did not finish within %.2f seconds, using '
+                    'data from its previous run', collector.name, timeout)
+
+        return CompressedCache((chunk.encode('utf-8') for chunk in self.render_chunks()),
+                               self.cache_spool_size)
 
     @CLIReadCommand('prometheus file_sd_config')
     def get_file_sd_config(self) -> Tuple[int, str, str]:
@@ -1675,27 +2640,28 @@ class Module(MgrModule):
 </html>'''
 
             @cherrypy.expose
-            def metrics(self) -> Optional[str]:
+            def metrics(self) -> Optional[Union[str, Iterator[bytes]]]:
                 # Lock the function execution
                 assert isinstance(_global_instance, Module)
                 with _global_instance.collect_lock:
                     return self._metrics(_global_instance)
 
             @staticmethod
-            def _metrics(instance: 'Module') -> Optional[str]:
+            def _metrics(instance: 'Module') -> Optional[Union[str, Iterator[bytes]]]:
                 if not self.cache:
                     self.log.debug('Cache disabled, collecting and returning without cache')
                     cherrypy.response.headers['Content-Type'] = 'text/plain'
                     return self.collect()
 
                 # Return cached data if available
-                if not instance.collect_cache:
+                if instance.collect_cache is None:
                     raise cherrypy.HTTPError(503, 'No cached data available yet')
 
-                def respond() -> Optional[str]:
+                def respond() -> Optional[Iterator[bytes]]:
                     assert isinstance(instance, Module)
-                    cherrypy.response.headers['Content-Type'] = 'text/plain'
-                    return instance.collect_cache
+                    assert instance.collect_cache
+                    return respond_from_cache(instance.collect_cache,
+                                              instance.response_cache_stats)
 
                 if instance.collect_time < instance.scrape_interval:
                     # Respond if cache isn't stale
@@ -1725,15 +2691,7 @@ class Module(MgrModule):
                     raise cherrypy.HTTPError(503, msg)
                 return None
 
-        # Make the cache timeout for collecting configurable
-        self.scrape_interval = cast(float, self.get_localized_module_option('scrape_interval'))
-
-        self.stale_cache_strategy = cast(
-            str, self.get_localized_module_option('stale_cache_strategy'))
-        if self.stale_cache_strategy not in [self.STALE_CACHE_FAIL,
-                                             self.STALE_CACHE_RETURN]:
-            self.stale_cache_strategy = self.STALE_CACHE_FAIL
-
+        self._configure()
         server_addr = cast(str, self.get_localized_module_option(
             'server_addr', get_default_addr()))
         server_port = cast(int, self.get_localized_module_option(
@@ -1834,6 +2792,7 @@ class StandbyModule(MgrStandbyModule):
         })
 
         module = self
+        empty_cache = CompressedCache([])
 
         class Root(object):
             @cherrypy.expose
@@ -1854,9 +2813,8 @@ class StandbyModule(MgrStandbyModule):
                     raise cherrypy.HTTPError(status, message="Keep on looking")
 
             @cherrypy.expose
-            def metrics(self) -> str:
-                cherrypy.response.headers['Content-Type'] = 'text/plain'
-                return ''
+            def metrics(self) -> Iterator[bytes]:
+                return respond_from_cache(empty_cache)
 
         cherrypy.tree.mount(Root(), '/', {})
         self.log.info('Starting engine...')
@@ -1,7 +1,12 @@
+import gzip
+import os
+import threading
+import time
 from typing import Dict
-from unittest import TestCase
+from unittest import TestCase, mock, skipUnless
 
-from prometheus.module import Metric, LabelValues, Number
+from prometheus.module import Metric, MetricCounter, LabelValues, Number, \
+    CompressedCache, respond_from_cache, Collector, Module, PerfCounterFilter, SeriesBudget
 
 
 class MetricGroupTest(TestCase):
@@ -91,3 +96,562 @@ ceph_disk_occupation_display{ceph_daemon="osd.5+osd.6",device="/dev/dm-1",instan
         with self.assertRaises(AssertionError) as cm:
             m.group_by(["foo"], {"bar": "not callable str"})
         self.assertEqual(str(cm.exception), "joins must be callable")
+
+
+class MetricExpfmtTest(TestCase):
+    def test_render_is_cached(self):
+        m = Metric("gauge", "osd.op_w", "writes", ("ceph_daemon",))
+        m.set(1, ("osd.0",))
+        m.set(2, ("osd.1",))
+        first = m.str_expfmt()
+        self.assertIs(m.str_expfmt(), first)
+
+        # a new cycle with the same values reuses the rendered text
+        m.clear()
+        m.set(1, ("osd.0",))
+        m.set(2, ("osd.1",))
+        self.assertIs(m.str_expfmt(), first)
+
+    def test_render_changed_values(self):
+        m = Metric("gauge", "osd.op_w", "writes", ("ceph_daemon",))
+        m.set(1, ("osd.0",))
+        m.set(2, ("osd.1",))
+        m.str_expfmt()
+
+        m.clear()
+        m.set(3, ("osd.1",))
+        m.set(4, ("osd.2",))
+        self.assertEqual(
+            m.str_expfmt(),
+            """
+# HELP ceph_osd_op_w writes
+# TYPE ceph_osd_op_w gauge
+ceph_osd_op_w{ceph_daemon="osd.1"} 3.0
+ceph_osd_op_w{ceph_daemon="osd.2"} 4.0""")
+        # prefixes of series that went away are dropped
+        self.assertEqual(set(m._prefixes), {("osd.1",), ("osd.2",)})
+
+    def test_render_counter(self):
+        m = MetricCounter("collect_count", "count", ("method",))
+        m.add(1, ("get_df",))
+        self.assertTrue(m.str_expfmt().endswith('{method="get_df"} 1.0'))
+        m.add(1, ("get_df",))
+        self.assertTrue(m.str_expfmt().endswith('{method="get_df"} 2.0'))
+
+    def test_render_special_values(self):
+        m = Metric("gauge", "test-", "desc")
+        m.set(float("inf"))
+        self.assertEqual(m.str_expfmt(),
+                         "\n# HELP ceph_test_minus desc\n# TYPE ceph_test_minus gauge"
+                         "\nceph_test_minus +Inf")
+        m.set(float("nan"))
+        self.assertTrue(m.str_expfmt().endswith(" NaN"))
+
+    def test_render_desc_change(self):
+        m = Metric("gauge", "name", "desc")
+        m.set(1)
+        m.str_expfmt()
+        m.desc = "other"
+        self.assertIn("# HELP ceph_name other", m.str_expfmt())
+
+
+class RespondFromCacheTest(TestCase):
+    def setUp(self):
+        self.body = b'\n# HELP ceph_health_status x\nceph_health_status 0.0\n'
+        self.cache = CompressedCache([self.body[:10], self.body[10:]])
+        self.stats = {'hit': 0, 'not_modified': 0, 'miss': 0}
+
+    def _respond(self, **headers):
+        request = mock.Mock(headers=headers)
+        response = mock.Mock(headers={}, status=200)
+        with mock.patch('cherrypy.request', request), \
+                mock.patch('cherrypy.response', response):
+            body = b''.join(respond_from_cache(self.cache, self.stats))
+        return body, response
+
+    def test_gzip(self):
+        body, response = self._respond(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], self.cache.etag)
+        self.assertEqual(gzip.decompress(body), self.body)
+        self.assertEqual(response.headers['Content-Length'], str(len(body)))
+        self.assertTrue(response.stream)
+        self.assertEqual(self.stats['hit'], 1)
+
+    def test_identity(self):
+        body, response = self._respond()
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(body, self.body)
+        self.assertEqual(self.stats['miss'], 1)
+
+    def test_not_modified(self):
+        body, response = self._respond(**{'If-None-Match': self.cache.etag,
+                                          'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(self.stats['not_modified'], 1)
+
+    def test_etag_changes_with_content(self):
+        self.assertEqual(CompressedCache([b'a', b'b']).etag, CompressedCache([b'ab']).etag)
+        self.assertNotEqual(CompressedCache([b'a']).etag, CompressedCache([b'b']).etag)
+
+    def test_spooled_to_file(self):
+        chunks = [os.urandom(1024) for _ in range(200)]
+        cache = CompressedCache(chunks, spool_size=4096)
+        self.assertTrue(cache.body._rolled)
+        self.assertEqual(b''.join(cache.read()), b''.join(chunks))
+        self.assertEqual(gzip.decompress(b''.join(cache.read(gzipped=True))), b''.join(chunks))
+
+    def test_concurrent_readers(self):
+        chunks = [bytes([i]) * CompressedCache.CHUNK_SIZE for i in range(3)]
+        cache = CompressedCache(chunks)
+        first, second = cache.read(), cache.read()
+        self.assertEqual(next(first), chunks[0])
+        self.assertEqual(next(second), chunks[0])
+        self.assertEqual(next(first), chunks[1])
+        self.assertEqual(b''.join(second), b''.join(chunks[1:]))
+
+
+class CollectorTest(TestCase):
+    def setUp(self):
+        self.mod = Module('prometheus', None, None)
+        self.mod.scrape_interval = 5.0
+        self.mod.metrics['fast'] = Metric('gauge', 'fast', 'fast')
+        self.mod.metrics['slow'] = Metric('gauge', 'slow', 'slow')
+        self.release = threading.Event()
+        self.fast_runs = 0
+        self.slow_runs = 0
+
+        def fast():
+            self.fast_runs += 1
+            self.mod.metrics['fast'].set(self.fast_runs)
+
+        def slow():
+            self.slow_runs += 1
+            self.release.wait()
+            self.mod.metrics['slow'].set(self.slow_runs)
+
+        self.mod.collectors = {
+            'fast': Collector(self.mod, 'fast', fast, ['fast']),
+            'slow': Collector(self.mod, 'slow', slow, ['slow']),
+        }
+        for c in self.mod.collectors.values():
+            c.start()
+
+    def tearDown(self):
+        self.release.set()
+        for c in self.mod.collectors.values():
+            c.stop()
+
+    def _collect(self):
+        return b''.join(self.mod.collect_scheduled().read()).decode('utf-8')
+
+    def test_static_metrics_are_owned_once(self):
+        mod = Module('prometheus', None, None)
+        owned = [path for c in mod.collectors.values() for path in c.families]
+        self.assertEqual(len(owned), len(set(owned)))
+        self.assertEqual(set(mod.metrics), set(owned))
+
+    def test_slow_collector_does_not_block(self):
+        self.mod.collectors['slow'].timeout = 0.1
+        self.mod.collectors['slow'].interval = 0
+
+        out = self._collect()
+        self.assertIn('ceph_fast 1.0', out)
+        self.assertNotIn('ceph_slow ', out)
+
+        # still running, so it is not triggered again
+        out = self._collect()
+        self.assertIn('ceph_fast 2.0', out)
+        self.assertEqual(self.slow_runs, 1)
+
+        self.release.set()
+        self.assertTrue(self.mod.collectors['slow'].wait(5))
+        self.assertIn('ceph_slow 1.0', ''.join(self.mod.collectors['slow'].output))
+        out = self._collect()
+        self.assertIn('ceph_slow 2.0', out)
+        self.assertIn('prometheus_collector_staleness_seconds{collector="slow"}', out)
+        self.assertIn('prometheus_collect_duration_seconds_count{method="fast"} 3.0', out)
+
+    def test_slow_collector_does_not_stale_cache(self):
+        self.mod.scrape_interval = 0.2
+        # neither the default nor a longer timeout exceeds the scrape interval
+        for timeout in [None, 10]:
+            self.mod.collectors['slow'].timeout = timeout
+            start = time.time()
+            self._collect()
+            self.assertLess(time.time() - start, self.mod.scrape_interval)
+
+    def _config_notify(self):
+        with mock.patch('prometheus.module.cherrypy'), \
+                mock.patch.object(self.mod, 'get_server_addr', return_value='::'), \
+                mock.patch.object(self.mod, 'set_uri'):
+            self.mod.config_notify()
+
+    def test_config_notify(self):
+        options = {
+            'scrape_interval': 30.0,
+            'collector_timeouts': 'slow=3',
+            'cache_spool_size': 4096,
+            'perf_counters_include': 'osd.*',
+            'series_limit_per_family': 10,
+            'series_limit': 100,
+        }
+        self.addCleanup(setattr, Metric, 'budget', None)
+        self.mod.get_localized_module_option = \
+            lambda key, default=None: options.get(key, default)
+        self._config_notify()
+        self.assertEqual(self.mod.scrape_interval, 30.0)
+        self.assertEqual(self.mod.collectors['slow'].timeout, 3.0)
+        self.assertEqual(self.mod.cache_spool_size, 4096)
+        perf_counter_filter = self.mod.perf_counter_filter
+        self.assertFalse(perf_counter_filter('mds', 'mds.request'))
+        # unchanged patterns keep the filter
+        self._config_notify()
+        self.assertIs(self.mod.perf_counter_filter, perf_counter_filter)
+        budget = Metric.budget
+        self.assertEqual((budget.family_limit, budget.global_limit), (10, 100))
+
+        options['series_limit'] = 50
+        self._config_notify()
+        self.assertIs(Metric.budget, budget)
+        self.assertEqual(budget.global_limit, 50)
+
+    def test_interval(self):
+        self.release.set()
+        self.mod.collectors['slow'].interval = 3600
+        self._collect()
+        out = self._collect()
+        self.assertEqual(self.slow_runs, 1)
+        self.assertEqual(self.fast_runs, 2)
+        # the data of the previous run is kept
+        self.assertIn('ceph_slow 1.0', out)
+
+    def test_failing_collector_keeps_previous_output(self):
+        self.release.set()
+        self._collect()
+
+        def fail():
+            raise RuntimeError()
+
+        self.mod.collectors['fast'].func = fail
+        out = self._collect()
+        self.assertIn('ceph_fast 1.0', out)
+
+
+class PerfCountersTest(TestCase):
+    def setUp(self):
+        self.mod = Module('prometheus', None, None)
+        self.counters = {
+            'osd.0': {
+                'osd.op_r': {'type': 10, 'priority': 5, 'description': 'reads', 'value': 5},
+                'osd.op_hist': {'type': 0x8 | 0x4, 'priority': 5, 'description': 'hist',
+                                'value': 0},
+                'osd.op_debug': {'type': 10, 'priority': 0, 'description': 'debug',
+                                 'value': 1},
+            },
+            'rgw.foo': {
+                'rgw.req': {'type': 10, 'priority': 5, 'description': 'requests', 'value': 7},
+            },
+        }
+        self.mod.list_servers = lambda: [{'hostname': 'host', 'services': [
+            {'type': name.split('.', 1)[0], 'id': name.split('.', 1)[1], 'ceph_version': 'v'}
+            for name in self.counters
+        ]}]
+        self.mod.get_perf_schema = mock.Mock(
+            side_effect=lambda svc_type, svc_id: {
+                f'{svc_type}.{svc_id}': self.counters[f'{svc_type}.{svc_id}']})
+        self.mod._ceph_get_latest_counters = lambda svc_type, svc_id, paths: (
+            [self.counters[f'{svc_type}.{svc_id}'][p]['value'] for p in paths],
+            [0] * len(paths))
+
+    def test_filter(self):
+        f = PerfCounterFilter('osd.*,rgw.*', 'rgw.rgw.req *.bluestore.*')
+        self.assertTrue(f('osd', 'osd.op_r'))
+        self.assertFalse(f('osd', 'bluestore.kv_flush_lat'))
+        self.assertFalse(f('rgw', 'rgw.req'))
+        self.assertFalse(f('mds', 'mds.request'))
+
+    def test_filter_is_passed(self):
+        self.mod.perf_counter_filter = PerfCounterFilter('osd.*')
+        with mock.patch.object(self.mod, 'get_perf_counter_snapshot',
+                               wraps=self.mod.get_perf_counter_snapshot) as snapshot:
+            self.mod.collectors['perf_counters'].run()
+        _, kwargs = snapshot.call_args
+        self.assertIs(kwargs['counter_filter'], self.mod.perf_counter_filter)
+        self.assertNotIn('rgw', ''.join(self.mod.collectors['perf_counters'].output))
+
+    def test_snapshot(self):
+        snapshot = self.mod.get_perf_counter_snapshot()
+        self.assertEqual(snapshot.daemons, ['osd.0', 'rgw.foo'])
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(list(snapshot.values[r] for r in snapshot.rows(1)), [7])
+        expected = {name: {path: info for path, info in counters.items() if info['priority']}
+                    for name, counters in self.counters.items()}
+        for counters in expected.values():
+            for info in counters.values():
+                info['units'] = 0
+                if info['type'] & 0x4:
+                    info['count'] = 0
+        self.assertEqual(snapshot.to_dict(), expected)
+
+        # the layout is kept until the daemons change
+        self.mod.get_perf_counter_snapshot()
+        self.assertEqual(self.mod.get_perf_schema.call_count, 2)
+        del self.counters['rgw.foo']
+        self.assertEqual(self.mod.get_perf_counter_snapshot().daemons, ['osd.0'])
+        self.assertEqual(self.mod.get_perf_schema.call_count, 3)
+
+        # counters added at runtime show up once the layout expires
+        self.counters['osd.0']['osd.op_w'] = {'type': 10, 'priority': 5,
+                                              'description': 'writes', 'value': 3}
+        self.assertEqual(len(self.mod.get_perf_counter_snapshot()), 2)
+        with mock.patch('time.monotonic',
+                        return_value=time.monotonic() + self.mod.PERF_COUNTER_LAYOUT_TTL):
+            self.assertEqual(len(self.mod.get_perf_counter_snapshot()), 3)
+        self.assertEqual(self.mod.get_perf_schema.call_count, 4)
+
+    def test_snapshot_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('numpy is not available')
+        arrays = self.mod.get_perf_counter_snapshot().numpy()
+        self.assertEqual(arrays['values'].dtype, numpy.uint64)
+        self.assertEqual(list(arrays['values']), [5, 0, 7])
+        self.assertEqual(list(arrays['daemon_index']), [0, 0, 1])
+
+    def test_path_info_is_memoized(self):
+        with mock.patch.object(self.mod, '_perfpath_to_path_labels',
+                               wraps=self.mod._perfpath_to_path_labels) as perfpath:
+            self.mod.collectors['perf_counters'].run()
+            self.mod.collectors['perf_counters'].run()
+            self.assertEqual(perfpath.call_count, 2)
+
+        out = ''.join(self.mod.collectors['perf_counters'].output)
+        self.assertIn('ceph_osd_op_r{ceph_daemon="osd.0"} 5.0', out)
+        self.assertIn('ceph_rgw_req{instance_id="foo"} 7.0', out)
+        self.assertNotIn('op_hist', out)
+
+        # counters of daemons which went away are forgotten
+        del self.counters['rgw.foo']
+        self.mod.collectors['perf_counters'].run()
+        self.assertEqual({k[0] for k in self.mod.perf_counter_info}, {'osd.0'})
+
+
+class SeriesBudgetTest(TestCase):
+    def setUp(self):
+        Metric.budget = SeriesBudget(family_limit=3, global_limit=5)
+
+    def tearDown(self):
+        Metric.budget = None
+
+    def test_family_limit(self):
+        m = Metric('counter', 'm', '', ('a', 'b'))
+        for i in range(5):
+            m.set(1, (str(i), 'x'))
+        self.assertEqual(m.value, {
+            ('0', 'x'): 1,
+            ('1', 'x'): 1,
+            ('2', 'x'): 1,
+            ('__other__', '__other__'): 2,
+        })
+        self.assertEqual(m.aggregated, 2)
+        self.assertEqual(Metric.budget.series, 3)
+        # existing series are updated in place
+        m.set(5, ('0', 'x'))
+        self.assertEqual(m.value[('0', 'x')], 5)
+
+        m.clear()
+        self.assertEqual(Metric.budget.series, 0)
+        self.assertEqual(m.aggregated, 0)
+
+    def test_global_limit(self):
+        m1 = Metric('gauge', 'm1', '', ('a',))
+        m2 = MetricCounter('m2', '', ('a',))
+        for i in range(3):
+            m1.set(1, (str(i),))
+        for i in range(3):
+            m2.add(2, (str(i),))
+        self.assertEqual(Metric.budget.series, 5)
+        self.assertEqual(m2.value, {('0',): 2, ('1',): 2, ('__other__',): 2})
+
+        # rendered series keep counting until the family is collected again
+        m1.clear(keep_budget=True)
+        self.assertEqual(Metric.budget.series, 5)
+        m1.clear()
+        self.assertEqual(Metric.budget.series, 2)
+
+    def test_gauges_are_dropped(self):
+        m = Metric('gauge', 'm', '', ('a',))
+        for i in range(5):
+            m.set(1, (str(i),))
+        self.assertEqual(m.value, {('0',): 1, ('1',): 1, ('2',): 1})
+        self.assertEqual((m.aggregated, m.dropped), (0, 2))
+        m.clear()
+        self.assertEqual(m.dropped, 0)
+
+    def test_cluster_families_are_not_limited(self):
+        mod = Module('prometheus', None, None)
+        Metric.budget = SeriesBudget(family_limit=1, global_limit=1)
+        mod.metrics['osd_up'].set(1, ('osd.0',))
+        for name in ('HEALTH_OK', 'OSD_DOWN'):
+            mod.metrics['health_detail'].set(1, (name, 'HEALTH_WARN'))
+        mod.metrics['health_status'].set(1)
+        self.assertEqual(len(mod.metrics['health_detail'].value), 2)
+        self.assertEqual(mod.metrics['health_status'].value, {('',): 1})
+
+    def test_group_by(self):
+        m = Metric('untyped', 'm', '', ('a', 'b'))
+        m.value = {(str(i), 'x'): 1 for i in range(5)}
+        grouped = m.group_by(['a'], {'b': ','.join})
+        self.assertEqual(len(grouped.value), 3)
+        self.assertEqual(grouped.dropped, 2)
+        self.assertEqual(Metric.budget.series, 3)
+
+    def test_metrics_and_health(self):
+        mod = Module('prometheus', None, None)
+        mod.set_health_checks = mock.Mock()
+        mod.metrics['m'] = Metric('counter', 'm', '', ('a',))
+
+        def collect():
+            for i in range(4):
+                mod.metrics['m'].set(i, (str(i),))
+
+        mod.collectors = {'m': Collector(mod, 'm', collect, ['m'])}
+        out = mod.collect()
+        self.assertIn('ceph_m{a="__other__"} 3.0', out)
+        self.assertIn('ceph_prometheus_series_aggregated{family="ceph_m"} 1.0', out)
+        self.assertIn('ceph_prometheus_series_limit{scope="family"} 3.0', out)
+        self.assertIn('ceph_prometheus_series_limit{scope="global"} 5.0', out)
+        checks = mod.set_health_checks.call_args[0][0]
+        self.assertEqual(checks['PROMETHEUS_SERIES_LIMIT']['count'], 1)
+
+        mod.collectors['m'].func = lambda: mod.metrics['m'].set(1, ('0',))
+        mod.collect()
+        mod.set_health_checks.assert_called_with({})
+
+
+class RbdImageNamesTest(TestCase):
+    def setUp(self):
+        self.mod = Module('prometheus', None, None)
+        self.directory = {'{:05x}'.format(i): 'img{}'.format(i) for i in range(2500)}
+        self.options = {'rbd_stats_scan_batch': 1000, 'rbd_stats_max_images': 100000}
+        self.lookups = []
+
+        def list_directory(ioctx, start_after, max_return):
+            ids = sorted(i for i in self.directory if i > start_after)[:max_return]
+            return [(i, self.directory[i]) for i in ids]
+
+        def lookup_directory(ioctx, image_ids):
+            self.lookups.append(image_ids)
+            return {i: self.directory[i] for i in image_ids if i in self.directory}
+
+        patches = [
+            mock.patch('prometheus.module.list_rbd_directory', side_effect=list_directory),
+            mock.patch('prometheus.module.lookup_rbd_directory', side_effect=lookup_directory),
+            mock.patch.object(Module, 'rados', new_callable=mock.PropertyMock),
+            mock.patch.object(self.mod, 'get_localized_module_option',
+                              side_effect=lambda key, default=None: self.options.get(key, default)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        Module.rados.pool_lookup.return_value = 1
+
+        self.mod.refresh_rbd_stats_pools({'rbd': {'ns'}})
+        self.pool = self.mod.rbd_stats['pools'][1]
+        self.images = self.pool['images']['ns']
+        self.scan = self.pool['scans']['ns']
+
+    def test_incremental_scan(self):
+        self.mod.scan_rbd_images()
+        self.assertEqual(len(self.images), 1000)
+        self.assertEqual(self.scan['marker'], '003e7')
+        self.assertEqual(self.scan['refreshed'], 0.0)
+
+        self.mod.scan_rbd_images()
+        self.mod.scan_rbd_images()
+        self.assertEqual(len(self.images), 2500)
+        self.assertEqual(self.images['00000']['n'], 'img0')
+        self.assertIsNone(self.scan['marker'])
+        self.assertEqual(self.scan['refreshed'], self.scan['started'])
+
+        # nothing to do until the next refresh
+        self.mod.scan_rbd_images()
+        self.assertIsNone(self.scan['marker'])
+
+    def test_removed_images_are_dropped(self):
+        for _ in range(3):
+            self.mod.scan_rbd_images()
+        del self.directory['00001']
+        self.directory['fffff'] = 'new'
+        counters = self.images['00000']['c']
+
+        self.mod.refresh_rbd_stats_pools({'rbd': {'ns'}})
+        for _ in range(3):
+            self.mod.scan_rbd_images()
+        self.assertNotIn('00001', self.images)
+        self.assertEqual(self.images['fffff']['n'], 'new')
+        self.assertIs(self.images['00000']['c'], counters)
+        self.assertEqual(self.mod.rbd_stats['num_images'], 2500)
+
+    def test_refresh_does_not_restart_scan(self):
+        self.mod.scan_rbd_images()
+        self.mod.refresh_rbd_stats_pools({'rbd': {'ns'}})
+        self.assertEqual(self.scan['marker'], '003e7')
+
+    def test_resolve(self):
+        images = self.mod.resolve_rbd_images(1, 'ns', {'00010', 'dead'})
+        self.assertEqual(images['00010']['n'], 'img16')
+        self.assertNotIn('dead', images)
+        # unknown ids are not looked up again during this listing
+        self.mod.resolve_rbd_images(1, 'ns', {'dead'})
+        self.assertEqual(self.lookups, [['00010', 'dead']])
+
+    def test_max_images(self):
+        self.options['rbd_stats_max_images'] = 1500
+        for _ in range(3):
+            self.mod.scan_rbd_images()
+        self.assertEqual(len(self.images), 1500)
+        self.mod.resolve_rbd_images(1, 'ns', {'009c0'})
+        self.assertNotIn('009c0', self.images)
+
+
+@skipUnless(os.environ.get('PROMETHEUS_BENCHMARK'), 'set PROMETHEUS_BENCHMARK to run')
+class MetricExpfmtBenchmark(TestCase):
+    """
+    Micro-benchmark of the exposition renderer. Run it with
+
+        PROMETHEUS_BENCHMARK=1 pytest -s prometheus/test_module.py -k Benchmark
+    """
+
+    SERIES = (1000, 10000, 100000, 1000000)
+
+    def _populate(self, m: Metric, n: int, value: Number) -> None:
+        m.clear()
+        for i in range(n):
+            m.set(value + i, ("osd.{}".format(i % 1200), "pool{}".format(i)))
+
+    def test_str_expfmt(self):
+        for n in self.SERIES:
+            m = Metric("counter", "osd.op_w", "writes", ("ceph_daemon", "pool"))
+
+            self._populate(m, n, 0)
+            start = time.perf_counter()
+            m.str_expfmt()
+            cold = time.perf_counter() - start
+
+            self._populate(m, n, 0)
+            start = time.perf_counter()
+            m.str_expfmt()
+            unchanged = time.perf_counter() - start
+
+            self._populate(m, n, 1)
+            start = time.perf_counter()
+            out = m.str_expfmt()
+            changed = time.perf_counter() - start
+
+            self.assertEqual(out.count('\n'), n + 2)
+            print('\n{:>8} series: cold {:.3f}s, unchanged {:.3f}s, changed {:.3f}s'.format(
+                n, cold, unchanged, changed))
@@ -42,6 +42,7 @@ if 'UNITTEST' in os.environ:
                     del self._store[k]
             else:
                 self._store[k] = value
+            self._mock_store_version = getattr(self, '_mock_store_version', 0) + 1
 
         def mock_store_prefix(self, kind, prefix):
             if not hasattr(self, '_store'):
@@ -62,6 +63,16 @@ if 'UNITTEST' in os.environ:
         def _ceph_get_store_prefix(self, prefix):
             return self.mock_store_prefix('store', prefix)
 
+        def _ceph_set_store_batch(self, ops):
+            version = self._ceph_get_store_version()
+            for k, v in ops:
+                self.mock_store_set('store', k, v)
+            self._mock_store_version = version + 1
+            return self._mock_store_version
+
+        def _ceph_get_store_version(self):
+            return getattr(self, '_mock_store_version', 0)
+
         def _ceph_get_module_option(self, module, key, localized_prefix=None):
             try:
                 _, val, _ = self.check_mon_command({
@@ -192,10 +203,15 @@ if 'UNITTEST' in os.environ:
             self._ceph_log = mock.MagicMock()
             self._ceph_dispatch_remote = lambda *_: None
             self._ceph_get_mgr_id = mock.MagicMock()
+            self._ceph_update_snapshot_cache_metrics = mock.MagicMock()
+
+    class BasePyCRUSH(object):
+        pass
 
     cm = mock.Mock()
     cm.BaseMgrModule = M
     cm.BaseMgrStandbyModule = M
+    cm.BasePyCRUSH = BasePyCRUSH
     sys.modules['ceph_module'] = cm
 
     def mock_ceph_modules():
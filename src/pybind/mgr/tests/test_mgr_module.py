@@ -0,0 +1,364 @@
+import errno
+import json
+import sqlite3
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from mgr_module import MgrDBPool, MgrModule, NotifyCoalesce, NotifyCoalescer, NotifyType, \
+    ReadOnlyDict
+
+
+@pytest.fixture
+def module():
+    m = MgrModule('test', None, None)
+    m.versions = {'osd_map': 1, 'pg_map': 1}
+    m.fetched = []
+
+    def _ceph_get(data_name):
+        if data_name == 'map_versions':
+            return dict(m.versions)
+        m.fetched.append(data_name)
+        return {'epoch': m.versions['osd_map'], 'pools': [{'pool': 1}]}
+
+    m._ceph_get = _ceph_get
+    m._ceph_update_snapshot_cache_metrics = mock.Mock()
+    return m
+
+
+def test_get_snapshot_is_shared_per_version(module):
+    first = module.get_snapshot('osd_map')
+    assert module.get_snapshot('osd_map') is first
+    assert module.fetched == ['osd_map']
+    module._ceph_update_snapshot_cache_metrics.assert_called_with(1, 0)
+
+    # a new pg map doesn't affect the OSDMap
+    module.versions['pg_map'] = 2
+    assert module.get_snapshot('osd_map') is first
+
+    module.versions['osd_map'] = 2
+    second = module.get_snapshot('osd_map')
+    assert second['epoch'] == 2
+    assert module.fetched == ['osd_map', 'osd_map']
+    module._ceph_update_snapshot_cache_metrics.assert_called_with(0, 1)
+
+
+def test_get_snapshot_df_depends_on_both_maps(module):
+    first = module.get_snapshot('df')
+    module.versions['pg_map'] = 2
+    assert module.get_snapshot('df') is not first
+
+
+def test_get_snapshot_unversioned(module):
+    module.get_snapshot('health')
+    module.get_snapshot('health')
+    assert module.fetched == ['health', 'health']
+
+
+def test_get_snapshot_is_read_only(module):
+    snapshot = module.get_snapshot('osd_map')
+    assert isinstance(snapshot, ReadOnlyDict)
+    with pytest.raises(TypeError):
+        snapshot['epoch'] = 3
+    with pytest.raises(TypeError):
+        snapshot['pools'][0].update({'pool': 2})
+    with pytest.raises(AttributeError):
+        snapshot['pools'].append({})
+    assert json.loads(json.dumps(snapshot)) == {'epoch': 1, 'pools': [{'pool': 1}]}
+
+
+def test_mon_commands_batch_limits_in_flight(module):
+    in_flight = []
+    max_in_flight = []
+
+    def _ceph_send_command(result, svc_type, svc_id, command, tag, inbuf):
+        cmd = json.loads(command)
+        in_flight.append(cmd)
+        max_in_flight.append(len(in_flight))
+
+        def complete():
+            in_flight.remove(cmd)
+            result.complete(0 if cmd['n'] != 3 else -22, str(cmd['n']), '')
+
+        threading.Timer(0.01, complete).start()
+
+    module._ceph_send_command = _ceph_send_command
+    results = module.mon_commands_batch([{'prefix': 'test', 'n': n} for n in range(10)],
+                                        max_in_flight=3)
+    assert [r[1] for r in results] == [str(n) for n in range(10)]
+    assert results[3][0] == -22
+    assert max(max_in_flight) == 3
+
+
+def test_command_async_send_failure(module):
+    module._ceph_send_command = mock.Mock(side_effect=ValueError('invalid osd_id'))
+    future = module.osd_command_async({'prefix': 'test', 'id': 'x'})
+    with pytest.raises(ValueError):
+        future.result()
+    with pytest.raises(ValueError):
+        module.osd_commands_batch([{'prefix': 'test', 'id': 'x'}])
+
+
+def test_command_and_notify_latency(module):
+    module.handle_command = mock.Mock(return_value=(0, '', ''))
+    module._handle_command('', {'prefix': 'test ls'})
+    module._handle_command('', {'prefix': 'test ls'})
+    module._dispatch_notify('osd_map', '')
+
+    profile = module.get_profile()
+    assert profile['command_latency']['test ls']['count'] == 2
+    assert profile['notify_latency']['osd_map']['count'] == 1
+    assert not profile['running']
+
+
+def test_profile_command(module):
+    busy = threading.Event()
+
+    def spin():
+        while not busy.is_set():
+            sum(range(100))
+
+    spinner = threading.Thread(target=spin, name='spinner')
+    spinner.start()
+    try:
+        assert module._handle_command('', {'prefix': 'mgr profile',
+                                           'action': 'start'}).retval == 0
+        assert module._handle_command('', {'prefix': 'mgr profile',
+                                           'action': 'start'}).retval == -errno.EBUSY
+        time.sleep(0.2)
+        assert module._handle_command('', {'prefix': 'mgr profile',
+                                           'action': 'stop'}).retval == 0
+    finally:
+        busy.set()
+        spinner.join()
+
+    stacks = module._handle_command('', {'prefix': 'mgr profile', 'action': 'dump'}).stdout
+    assert any(line.startswith('spinner;') and 'spin' in line
+               for line in stacks.splitlines())
+    assert module._profiler.samples > 0
+    # the profiler does not record itself nor `mgr profile` commands
+    assert 'mgr-profiler' not in stacks
+    assert 'mgr profile' not in module.get_profile()['command_latency']
+
+
+def test_notify_coalescer():
+    delivered = []
+    done = threading.Event()
+
+    def deliver(notify_type, notify_id):
+        delivered.append((notify_type, notify_id))
+        if len(delivered) == 5:
+            done.set()
+
+    coalescer = NotifyCoalescer({NotifyType.osd_map: NotifyCoalesce(interval=0.2),
+                                 NotifyType.clog: NotifyCoalesce(interval=0.2,
+                                                                 latest_only=False)},
+                                deliver, mock.Mock())
+    # the first notification of a type is delivered right away...
+    coalescer.queue('osd_map', '')
+    coalescer.queue('clog', '')
+    for _ in range(50):
+        if len(delivered) == 2:
+            break
+        time.sleep(0.01)
+    assert sorted(delivered) == [('clog', ''), ('osd_map', '')]
+
+    # ...the ones within the interval are merged
+    for epoch in range(5):
+        coalescer.queue('osd_map', str(epoch))
+    coalescer.queue('clog', 'a')
+    coalescer.queue('clog', 'b')
+    coalescer.queue('clog', 'a')
+    assert done.wait(2)
+    coalescer.stop()
+
+    assert [i for t, i in delivered if t == 'osd_map'] == ['', '4']
+    assert [i for t, i in delivered if t == 'clog'] == ['', 'a', 'b']
+    assert coalescer.stats() == {'queue_depth': 0, 'received': 10,
+                                 'delivered': 5, 'dropped': 5}
+
+
+def test_dispatch_notify_coalesced(module):
+    module.notify = mock.Mock()
+    module._notify_coalescer = NotifyCoalescer({NotifyType.fs_map: NotifyCoalesce(60)},
+                                               module._deliver_notify, module.log)
+    module._dispatch_notify('osd_map', '')
+    module.notify.assert_called_once_with('osd_map', '')
+    module._dispatch_notify('fs_map', '')
+    module._dispatch_notify('fs_map', '')
+    module._notify_coalescer.stop()
+    stats = module.get_profile()['notify_queue']
+    assert stats['received'] == 2
+    assert stats['delivered'] + stats['queue_depth'] + stats['dropped'] == 2
+
+
+def test_store_read_cache(module):
+    module._ceph_set_store('host.a', '1')
+    module._ceph_set_store('host.b', '2')
+    module._ceph_get_store = mock.Mock(wraps=module._ceph_get_store)
+    module._ceph_get_store_prefix = mock.Mock(wraps=module._ceph_get_store_prefix)
+
+    assert module.get_store_prefix('host.') == {'host.a': '1', 'host.b': '2'}
+    assert module.get_store_prefix('host.') == {'host.a': '1', 'host.b': '2'}
+    # served by the cached prefix
+    assert module.get_store('host.a') == '1'
+    assert module.get_store('host.c') is None
+    assert module._ceph_get_store_prefix.call_count == 1
+    assert module._ceph_get_store.call_count == 0
+
+    # our own updates keep the cache valid
+    module.set_store('host.c', '3')
+    assert module.get_store('host.c') == '3'
+    assert module.get_store_prefix('host.')['host.c'] == '3'
+    assert module._ceph_get_store_prefix.call_count == 1
+
+    # other changes invalidate it
+    module._ceph_set_store('host.a', '4')
+    assert module.get_store('host.a') == '4'
+    assert module._ceph_get_store.call_count == 1
+
+
+def test_store_batch(module):
+    module._ceph_set_store('host.a', '1')
+    module._ceph_set_store_batch = mock.Mock(wraps=module._ceph_set_store_batch)
+
+    with module.store_batch() as batch:
+        for host in 'bcd':
+            module.set_store('host.' + host, host)
+        batch.rm('host.a')
+        with module.store_batch():
+            module.set_store('host.e', 'e')
+        # reads see the pending updates
+        assert module.get_store('host.a') is None
+        assert sorted(module.get_store_prefix('host.')) == ['host.b', 'host.c',
+                                                            'host.d', 'host.e']
+        assert module._ceph_set_store_batch.call_count == 0
+    module._ceph_set_store_batch.assert_called_once()
+    assert module.get_store_prefix('host.') == {'host.b': 'b', 'host.c': 'c',
+                                                'host.d': 'd', 'host.e': 'e'}
+
+    with pytest.raises(ValueError):
+        with module.store_batch():
+            module.set_store('host.f', 'f')
+            raise ValueError()
+    assert module.get_store('host.f') is None
+    assert module._ceph_set_store_batch.call_count == 1
+
+
+class DBModule(MgrModule):
+    SCHEMA = """
+    CREATE TABLE Metrics (t INTEGER, v INTEGER);
+    """
+
+
+@pytest.fixture
+def db_module(tmp_path):
+    m = DBModule('test', None, None)
+    m.get_ceph_option = mock.Mock(return_value=True)
+
+    def open_db():
+        db = sqlite3.connect(str(tmp_path / 'main.db'), check_same_thread=False)
+        m.configure_db(db)
+        return db
+
+    m.open_db = open_db
+    return m
+
+
+def test_db_transaction(db_module):
+    db_module.set_kv('a', 1)
+    assert db_module.get_kv('a') == 1
+    with db_module.db_transaction() as db:
+        db.execute('INSERT INTO Metrics VALUES (1, 1)')
+        # nested transactions, and self.db, use the same connection
+        with pytest.raises(ValueError):
+            with db_module.db_transaction():
+                db_module.db.execute('INSERT INTO Metrics VALUES (2, 2)')
+                raise ValueError()
+    with db_module.db_transaction() as db:
+        assert [tuple(r) for r in db.execute('SELECT t FROM Metrics')] == [(1,)]
+
+    stats = db_module.get_profile()['db']
+    assert stats['connections'] == 1
+    assert stats['transactions']['count'] == 5
+    assert stats['commits']['count'] == 4
+
+
+def test_db_commit_window(db_module, tmp_path):
+    db_module._db_pool = MgrDBPool(db_module._connect_db, commit_window=60)
+    for t in range(10):
+        with db_module.db_transaction() as db:
+            db.execute('INSERT INTO Metrics VALUES (?, ?)', (t, t))
+    # not committed yet, invisible to other connections
+    other = sqlite3.connect(str(tmp_path / 'main.db'))
+    assert other.execute('SELECT COUNT(*) FROM Metrics').fetchone() == (0,)
+    db_module.db_flush()
+    assert other.execute('SELECT COUNT(*) FROM Metrics').fetchone() == (10,)
+    assert db_module._db_pool.commits.count == 1
+
+
+def test_db_commit_window_commit_fails(db_module, tmp_path):
+    pool = db_module._db_pool = MgrDBPool(db_module._connect_db, commit_window=60)
+    commit = pool._commit
+
+    def fail_once(conn):
+        pool._commit = commit
+        raise sqlite3.OperationalError('database is locked')
+
+    pool._commit = fail_once
+    with db_module.db_transaction() as db:
+        db.execute('INSERT INTO Metrics VALUES (1, 1)')
+    with pytest.raises(sqlite3.OperationalError):
+        db_module.db_flush()
+    # the commit is retried, and later transactions are batched with it
+    assert pool._timer is not None
+    with db_module.db_transaction() as db:
+        db.execute('INSERT INTO Metrics VALUES (2, 2)')
+    db_module.db_flush()
+    other = sqlite3.connect(str(tmp_path / 'main.db'))
+    assert other.execute('SELECT COUNT(*) FROM Metrics').fetchone() == (2,)
+    assert pool._timer is None
+
+
+def test_db_commit_window_config(db_module, tmp_path):
+    options = {'sqlite_commit_window': 60.0, 'log_to_cluster_level': '',
+               'log_to_file': False, 'log_to_cluster': False}
+    db_module._set_log_level = mock.Mock()
+    db_module.log_to_file = db_module.log_to_cluster = False
+    db_module.get_module_option = lambda key, default=None: options.get(key, default)
+    with db_module.db_transaction() as db:
+        db.execute('INSERT INTO Metrics VALUES (1, 1)')
+    assert db_module._db_pool.commit_window == 60.0
+
+    # turning batching off commits what is pending
+    options['sqlite_commit_window'] = 0.0
+    db_module._config_notify()
+    other = sqlite3.connect(str(tmp_path / 'main.db'))
+    assert other.execute('SELECT COUNT(*) FROM Metrics').fetchone() == (1,)
+    with db_module.db_transaction() as db:
+        db.execute('INSERT INTO Metrics VALUES (2, 2)')
+    assert other.execute('SELECT COUNT(*) FROM Metrics').fetchone() == (2,)
+
+
+def test_db_pool_waits_for_connection():
+    pool = MgrDBPool(lambda: sqlite3.connect(':memory:', check_same_thread=False,
+                                             isolation_level=None), size=1)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            held.set()
+            release.wait()
+
+    t = threading.Thread(target=hold)
+    t.start()
+    held.wait()
+    threading.Timer(0.05, release.set).start()
+    with pool.transaction() as db:
+        db.execute('SELECT 1')
+    t.join()
+    assert pool.lock_wait.max >= 0.04
+    assert pool.dump()['connections'] == 1